@@ -0,0 +1,144 @@
+""" Benchmarks creating, opening, persisting, closing and listing
+projects, using the fake desktop and programs so that it runs anywhere.
+
+    python -m benchmarks.bench_lifecycle --projects 1 10 100 --programs 1 5 --latency 0.01
+
+Every project uses the fake desktop and `--programs` fake programs. The
+fakes sleep for `--latency` seconds per operation and fail with the
+probability `--failure-rate`, which stand in for how long and how
+reliably real desktops and programs respond. A json line is printed for
+each combination of `--projects` and `--programs`, with the throughput
+and the latency percentiles of each operation.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+import persistd.programs as programs
+from persistd.desktops.fake_desktop import FakeDesktop
+from persistd.programs.fake.fake_program import FakeProgram
+from persistd.util import catalog
+from persistd.util.batch import run_on_projects
+from persistd.util.fakes import FakeBehavior
+from persistd.util.persister import Persister
+from persistd.util.settings import SETTINGS
+
+
+def percentile(values, fraction):
+    """ The nearest-rank percentile of the values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summarize(seconds, latencies, failures):
+    return {'seconds': round(seconds, 4),
+            'per_second': round(len(latencies) / seconds, 2) if seconds > 0 else None,
+            'p50': round(percentile(latencies, 0.5), 5) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 5) if latencies else None,
+            'failures': failures}
+
+
+def create_project(base_path, project_name, program_names):
+    """ Creates a project like `Persister.create_project` does, without
+    asking which desktop and programs to use.
+    """
+    persister = Persister(base_path, project_name)
+    os.makedirs(persister.persister_folder_path)
+    persister.used_desktop = 'fake_desktop'
+    persister.used_programs = list(program_names)
+    try:
+        persister._initialize_desktop_obj()
+        persister._initialize_program_objects()
+        persister.setup()
+    except SystemExit:
+        return False
+    persister.save()
+    persister._update_catalog()
+    return True
+
+
+def bench_create(base_path, project_names, program_names):
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+    for project_name in project_names:
+        started = time.perf_counter()
+        failures += not create_project(base_path, project_name, program_names)
+        latencies.append(time.perf_counter() - started)
+    return summarize(time.perf_counter() - start, latencies, failures)
+
+
+def bench_action(action, project_names, max_workers):
+    start = time.perf_counter()
+    results = run_on_projects(action, project_names, max_workers=max_workers)
+    seconds = time.perf_counter() - start
+    return summarize(seconds, [result.duration for result in results.values()],
+                     sum(not result.success for result in results.values()))
+
+
+def bench_list(base_path, n_lists=5):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n_lists):
+        started = time.perf_counter()
+        catalog.ProjectCatalog(base_path).projects(only_initialized=True)
+        latencies.append(time.perf_counter() - started)
+    return summarize(time.perf_counter() - start, latencies, 0)
+
+
+def run(n_projects, n_programs, max_workers):
+    """ Runs the lifecycle of `n_projects` projects with `n_programs`
+    programs each in a temporary base path
+
+    Returns:
+        result::dict
+            The summary of each operation
+    """
+    program_names = ['fake_%02d' % i for i in range(n_programs)]
+    with tempfile.TemporaryDirectory() as temp_dir, \
+            mock.patch.dict(programs.code_name_to_class, {name: FakeProgram for name in program_names}), \
+            mock.patch.object(catalog, 'CATALOGS_PATH', os.path.join(temp_dir, 'catalogs')), \
+            mock.patch.object(SETTINGS, 'base_path', os.path.join(temp_dir, 'projects')), \
+            mock.patch.object(SETTINGS, 'open_projects', []), \
+            mock.patch.object(SETTINGS, 'file_path', os.path.join(temp_dir, 'settings.json')):
+        project_names = ['project_%04d' % i for i in range(n_projects)]
+        result = {'create': bench_create(SETTINGS.base_path, project_names, program_names)}
+        result['open'] = bench_action('open', project_names, max_workers)
+        opened = list(SETTINGS.open_projects)
+        result['persist'] = bench_action('persist', opened, max_workers)
+        result['close'] = bench_action('close', opened, max_workers)
+        result['list'] = bench_list(SETTINGS.base_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the project lifecycle with fake backends.")
+    parser.add_argument('--projects', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--programs', type=int, nargs='+', default=[1, 5])
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds every fake operation takes")
+    parser.add_argument('--jitter', type=float, default=0.0, help="fraction by which latencies vary")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="probability that a fake operation fails")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-workers', type=int, default=None)
+    args = parser.parse_args()
+
+    for n_projects in args.projects:
+        for n_programs in args.programs:
+            behavior = FakeBehavior(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                                    seed=args.seed)
+            with mock.patch.object(FakeDesktop, 'behavior', behavior), \
+                    mock.patch.object(FakeProgram, 'behavior', behavior):
+                result = run(n_projects, n_programs, args.max_workers)
+            print(json.dumps(dict({'benchmark': 'lifecycle', 'projects': n_projects, 'programs': n_programs,
+                                   'latency': args.latency, 'failure_rate': args.failure_rate,
+                                   'seed': args.seed}, **result)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
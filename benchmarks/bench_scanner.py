@@ -0,0 +1,79 @@
+""" Benchmarks scanning a base path of many project folders.
+
+    python -m benchmarks.bench_scanner --projects 10000 --latency 0.001
+
+`--latency` adds a delay to every file system check, to simulate a
+network share.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from persistd.util import scanner
+
+
+def make_tree(base_path, n_projects, initialized_ratio=0.1):
+    """ Creates project folders, some of which are initialized
+    """
+    step = max(int(1 / initialized_ratio), 1)
+    for i in range(n_projects):
+        project_path = os.path.join(base_path, 'project_%05d' % i)
+        os.makedirs(project_path)
+        if i % step == 0:
+            os.makedirs(os.path.join(project_path, '.persistd'))
+            with open(os.path.join(project_path, '.persistd', 'state.json'), 'w') as fp:
+                json.dump({'version': 1, 'persister': {'used_desktop': 'virtual_desktop', 'used_programs': []},
+                           'desktop': None, 'programs': {}}, fp)
+
+
+def walk_scan(base_path):
+    """ The scan before the scanner: os.walk and one exists per project
+    """
+    projects = [d for d in next(os.walk(base_path))[1] if not d.startswith('.')]
+    return [project_name for project_name in projects if
+            os.path.exists(os.path.join(base_path, project_name, '.persistd', 'pd.json'))
+            or os.path.exists(os.path.join(base_path, project_name, '.persistd', 'state.json'))]
+
+
+def parallel_scan(base_path):
+    return [entry.name for entry in scanner.scan_projects(base_path) if entry.initialized]
+
+
+def with_latency(func, latency):
+    def delayed(*args, **kwargs):
+        time.sleep(latency)
+        return func(*args, **kwargs)
+    return delayed
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the project scanner.")
+    parser.add_argument('--projects', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every file system check")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base_path:
+        make_tree(base_path, args.projects)
+        exists = with_latency(os.path.exists, args.latency)
+        read_entry = with_latency(scanner.read_project_entry, args.latency)
+        with mock.patch('os.path.exists', exists):
+            walk_time, walk_result = timed(walk_scan, base_path)
+        with mock.patch.object(scanner, 'read_project_entry', read_entry):
+            parallel_time, parallel_result = timed(parallel_scan, base_path)
+        assert sorted(walk_result) == sorted(parallel_result)
+        print(json.dumps({'benchmark': 'scanner', 'projects': args.projects, 'latency': args.latency,
+                          'initialized': len(parallel_result),
+                          'walk_seconds': round(walk_time, 4), 'parallel_seconds': round(parallel_time, 4)}))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,24 @@
-import persistd.desktops.virtual_desktop as virtual_desktop
+from persistd.util.registry import LazyClassMap, LazyPlugin
 
-all_desktops = [virtual_desktop,
+# The desktop modules are only imported once their class is needed
+all_desktops = [LazyPlugin('persistd.desktops.virtual_desktop', 'virtual_desktop', 'VirtualDesktop'),
                 ]
 
-code_name_to_class = {desktop.CODE_NAME: desktop.DESKTOP_CLASS
-                      for desktop in all_desktops
-                      if desktop.DESKTOP_CLASS}
+# These can be used by projects, but aren't offered when creating one
+hidden_desktops = [LazyPlugin('persistd.desktops.fake_desktop', 'fake_desktop', 'Fake desktop'),
+                   ]
 
-class_to_code_name = {kls: name for name, kls in code_name_to_class.items()}
+code_name_to_class = LazyClassMap(all_desktops + hidden_desktops, 'DESKTOP_CLASS')
 
-human_readable_name_to_class = {desktop.HUMAN_READABLE_NAME: desktop.DESKTOP_CLASS
-                                for desktop in all_desktops
-                                if desktop.DESKTOP_CLASS}
 
-class_to_human_readable_name = {kls: name for name, kls in human_readable_name_to_class.items()}
+def __getattr__(name):
+    # These need every desktop module, so they are only built on access
+    if name == 'class_to_code_name':
+        return {kls: name for name, kls in code_name_to_class.items()}
+    elif name == 'human_readable_name_to_class':
+        return {desktop.HUMAN_READABLE_NAME: desktop.DESKTOP_CLASS
+                for desktop in all_desktops
+                if desktop.DESKTOP_CLASS}
+    elif name == 'class_to_human_readable_name':
+        return {kls: name for name, kls in __getattr__('human_readable_name_to_class').items()}
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,10 +1,24 @@
+import contextlib
+import os
 from abc import ABC, abstractmethod
 
 from persistd.util.persistable import Persistable
+from persistd.util.tracing import trace_methods
 
 
 class BaseDesktop(Persistable, ABC):
 
+    # The process ids of the programs launched on the
+    # created desktop, by the name of their executable
+    program_pids = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # every desktop is traced the same way
+        trace_methods(cls, ['setup', 'create_desktop', 'switch_to_desktop', 'persist_desktop', 'close_desktop',
+                            'close_current_desktop', 'launch_program', 'move_program', 'move_programs', 'warm_up',
+                            'destroy'])
+
     def __init__(self, project_name, project_path, persist_path):
         """ Initializes a desktop.
 
@@ -61,7 +75,8 @@ class BaseDesktop(Persistable, ABC):
         pass
 
     @abstractmethod
-    def launch_program(self, command, args=None, desktop_id=None, open_async=False, sleep=None):
+    def launch_program(self, command, input=None, desktop_id=None, open_async=False, max_tries=3, timeout=None,
+                       wait_for_new_window=False, window_class=None):
         """ Launches a program, with optional args, at a given desktop.
 
         Args:
@@ -77,8 +92,18 @@ class BaseDesktop(Persistable, ABC):
                 Whether to open the process as asynchronous. If set,
                 there will not be any communication through stdin and
                 stdout, and the return code may not be set.
-            sleep::float
-                The amount of time to sleep before moving the process
+            max_tries::int
+                The # of times moving the program should be tried. If 0,
+                it won't be tried to move.
+            timeout::float
+                The max # of seconds to wait for the window of the
+                program before moving it
+            wait_for_new_window::bool
+                Whether to wait until a new window appears. Useful for
+                programs whose launcher hands off to another process.
+            window_class::str
+                The class of the new window to wait for. If None, any
+                new window will do.
 
         Returns:
             pid::int
@@ -87,6 +112,47 @@ class BaseDesktop(Persistable, ABC):
         """
         pass
 
+    @property
+    def launched_pids(self):
+        """ The process ids of all programs launched on the created desktop
+        """
+        return [pid for pids in (self.program_pids or {}).values() for pid in pids]
+
+    def record_launch(self, command, pid):
+        """ Remembers which program a launched process belongs to, so that
+        its windows can be found later
+        """
+        program = os.path.basename(command[0])
+        program_pids = dict(self.program_pids or {})
+        program_pids[program] = program_pids.get(program, []) + [pid]
+        self.program_pids = program_pids
+
+    @contextlib.contextmanager
+    def batch_moves(self):
+        """ Moves the programs that are launched within it all at once,
+        when it exits, instead of one by one. By default, programs are
+        moved as they are launched.
+        """
+        yield
+
+    def warm_up(self):
+        """ Prepares desktops ahead of time, so that the projects that
+        open later don't have to wait for them to be created.
+
+        Returns:
+            created::int
+                The # of desktops that were prepared
+        """
+        return 0
+
+    @property
+    def position(self):
+        """ The position of the created desktop among all desktops, or
+        None if it isn't known. Closing a desktop moves the ones after
+        it, so many desktops should be closed from the last one.
+        """
+        return None
+
     @abstractmethod
     def destroy(self):
         """ Deletes all info regarding this desktop from the project
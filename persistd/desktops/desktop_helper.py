@@ -0,0 +1,271 @@
+""" A long-lived desktop helper process and its client.
+
+The helper reads one JSON request per line on stdin and writes one JSON
+response per line on stdout. A request carries a batch of operations,
+which are all executed in a single round trip:
+
+    {"id": 1, "ops": [{"op": "move", "desktop": 2, "pid": 1234},
+                      {"op": "move", "desktop": 2, "pid": 5678}]}
+    {"id": 1, "results": [{"ok": true, "value": 2}, {"ok": true, "value": 2}]}
+
+The supported operations are `new`, `switch`, `remove`, `remove_current`,
+`move`, `rename`, `list` and `enumerate`. `list` returns the names of all
+desktops in the order of their positions, which lets desktops be found by
+name even after others were removed, and `enumerate` also returns every
+window with the position of its desktop:
+
+    {"desktops": ["Desktop 1", "persistd: project"],
+     "windows": [[<window handle>, <pid>, <position>], ...]}
+
+`switch` and `remove` can be given the `name` the desktop is expected to
+have, and fail instead of using another desktop that moved to its
+position. A helper that doesn't answer within `desktop_helper_timeout`
+seconds is killed, and started again on the next request.
+
+persistd doesn't ship a helper for Windows yet, so there, every operation
+runs its own VirtualDesktop.exe unless `desktop_helper_command` points to
+a helper that speaks this protocol. Running this module starts a stand-in
+helper that keeps an in-memory model of the desktops, which is used for
+testing on any OS.
+"""
+import atexit
+import itertools
+import json
+import logging
+import queue
+import subprocess
+import sys
+import threading
+
+from persistd.util.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class DesktopHelperError(Exception):
+    pass
+
+
+class DesktopHelperClient:
+
+    def __init__(self, command, timeout=None):
+        """ Initializes a client for a desktop helper. The helper is
+        started on the first request.
+
+        Args:
+            command::list(str)
+                The command that starts the helper
+            timeout::float
+                The max # of seconds to wait for an answer. If None, uses
+                the `desktop_helper_timeout` setting.
+        """
+        self.command = list(command)
+        self._timeout = timeout
+        self._process = None
+        # the lines the helper writes, read by a thread so that they can be waited on with a timeout
+        self._lines = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return SETTINGS.desktop_helper_timeout if self._timeout is None else self._timeout
+
+    @staticmethod
+    def _read_lines(stdout, lines):
+        for line in stdout:
+            lines.put(line)
+        # the helper exited
+        lines.put('')
+
+    def _ensure_started(self):
+        if self._process is None or self._process.poll() is not None:
+            logger.info("Starting desktop helper: %s", ' '.join(self.command))
+            self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             universal_newlines=True, bufsize=1)
+            self._lines = queue.Queue()
+            threading.Thread(target=self._read_lines, args=(self._process.stdout, self._lines), daemon=True).start()
+        return self._process
+
+    def _kill(self):
+        """ Kills the helper, e.g. after it stopped answering
+        """
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+        self._lines = None
+
+    def request(self, ops):
+        """ Executes a batch of operations in a single round trip
+
+        Args:
+            ops::list(dict)
+                The operations, e.g. {"op": "switch", "desktop": 2}
+
+        Returns:
+            results::list(dict)
+                One {"ok": bool, "value": ..., "error": ...} per operation
+        """
+        with self._lock:
+            process = self._ensure_started()
+            request_id = next(self._ids)
+            try:
+                process.stdin.write(json.dumps({'id': request_id, 'ops': ops}) + '\n')
+                process.stdin.flush()
+                line = self._lines.get(timeout=self.timeout or None)
+            except OSError as err:
+                raise DesktopHelperError("Desktop helper is not reachable: %s" % err)
+            except queue.Empty:
+                self._kill()
+                raise DesktopHelperError("Desktop helper didn't answer within %.1fs" % self.timeout)
+            if not line:
+                return_code = process.poll()
+                self._kill()
+                raise DesktopHelperError("Desktop helper exited with code %s" % return_code)
+            try:
+                response = json.loads(line)
+            except ValueError:
+                self._kill()
+                raise DesktopHelperError("Desktop helper answered with invalid json: %r" % line)
+            if response.get('id') != request_id:
+                self._kill()
+                raise DesktopHelperError("Desktop helper answered request %s instead of %s"
+                                         % (response.get('id'), request_id))
+            return response['results']
+
+    def close(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.stdin.close()
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+            self._lines = None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_helper_client(command):
+    """ Returns the client for the given helper command, shared by the
+    whole process so that every desktop uses the same helper session.
+    """
+    key = tuple(command)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = DesktopHelperClient(command)
+        return _clients[key]
+
+
+@atexit.register
+def close_helper_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+class FakeDesktopBackend:
+    """ An in-memory model of virtual desktops, numbered from 0 like
+    VirtualDesktop.exe does.
+    """
+
+    def __init__(self):
+        # the names of the desktops, by position
+        self.names = ['Desktop 1']
+        self.current = 0
+        # pid -> desktop id
+        self.windows = {}
+        # pid -> window handle
+        self.handles = {}
+        self._handles = itertools.count(0x10000, 4)
+
+    @property
+    def desktop_count(self):
+        return len(self.names)
+
+    def _check(self, desktop, name=None):
+        if not 0 <= desktop < self.desktop_count:
+            raise ValueError("No desktop #%s" % desktop)
+        if name is not None and self.names[desktop] != name:
+            raise ValueError("Desktop #%s is %s, not %s" % (desktop, self.names[desktop], name))
+
+    def new(self):
+        self.names.append('Desktop %d' % (self.desktop_count + 1))
+        return self.desktop_count - 1
+
+    def switch(self, desktop, name=None):
+        self._check(desktop, name)
+        self.current = desktop
+        return desktop
+
+    def remove(self, desktop, name=None):
+        self._check(desktop, name)
+        if self.desktop_count == 1:
+            raise ValueError("Can't remove the last desktop")
+        del self.names[desktop]
+        # windows of the removed desktop end up on its neighbour
+        fallback = max(desktop - 1, 0)
+        self.windows = {pid: (fallback if d == desktop else d - 1 if d > desktop else d)
+                        for pid, d in self.windows.items()}
+        if self.current >= desktop and self.current > 0:
+            self.current -= 1
+        return desktop
+
+    def remove_current(self):
+        return self.remove(self.current)
+
+    def move(self, desktop, pid):
+        self._check(desktop)
+        self.windows[pid] = desktop
+        if pid not in self.handles:
+            self.handles[pid] = next(self._handles)
+        return desktop
+
+    def rename(self, desktop, name):
+        self._check(desktop)
+        self.names[desktop] = name
+        return desktop
+
+    def list(self):
+        return list(self.names)
+
+    def enumerate(self):
+        return {'desktops': list(self.names),
+                'windows': [[self.handles[pid], pid, desktop] for pid, desktop in sorted(self.windows.items())]}
+
+
+def run_op(backend, op):
+    """ Runs a single operation on a backend
+
+    Returns:
+        result::dict
+            {"ok": bool, "value": ..., "error": ...}
+    """
+    args = {key: value for key, value in op.items() if key != 'op'}
+    try:
+        if op['op'].startswith('_'):
+            raise ValueError("Unknown operation %s" % op['op'])
+        return {'ok': True, 'value': getattr(backend, op['op'])(**args)}
+    except (AttributeError, TypeError, ValueError) as err:
+        return {'ok': False, 'value': None, 'error': str(err)}
+
+
+def serve(backend, stdin=sys.stdin, stdout=sys.stdout):
+    """ Serves requests from stdin until it is closed
+    """
+    for line in stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        results = [run_op(backend, op) for op in request['ops']]
+        stdout.write(json.dumps({'id': request['id'], 'results': results}) + '\n')
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    serve(FakeDesktopBackend())
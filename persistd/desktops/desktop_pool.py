@@ -0,0 +1,256 @@
+""" A pool of empty virtual desktops, kept warm for the projects that open.
+
+Creating a desktop is one of the slowest parts of opening a project, so
+a few empty desktops are created ahead of time, and a project that opens
+takes one of them instead. A project that closes gives its desktop back
+to the pool if no windows were left on it and the pool isn't full.
+
+Desktops are numbered by their position, which changes whenever a desktop
+before them is removed, so the ids that are saved can go stale. Desktops
+of the pool and of projects are therefore named, and their positions are
+looked up from the live list of desktops, which takes a single `list`
+operation, or an `enumerate` if the pool is given a `DesktopStateCache`,
+before they are used.
+"""
+import contextlib
+import json
+import logging
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from persistd.desktops.desktop_state import DesktopSnapshot, DesktopStateCache
+from persistd.util.savers import atomic_write, file_lock
+from persistd.util.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# The names of the desktops in the pool start with this
+POOL_PREFIX = 'persistd pool '
+
+
+def project_desktop_name(project_name):
+    """ The name of the desktop of a project
+    """
+    return 'persistd: %s' % project_name
+
+
+class DesktopPool:
+
+    def __init__(self, run_ops: Callable[[List[Dict]], List[Dict]], path: Optional[str] = None,
+                 size: Optional[int] = None, cache: Optional[DesktopStateCache] = None):
+        """ Initializes a pool of desktops
+
+        Args:
+            run_ops::callable
+                Runs a batch of desktop operations, and returns one
+                {"ok": bool, "value": ...} per operation
+            path::str
+                The json file that keeps the names of the pooled desktops
+                between runs. If None, they are only kept in memory.
+            size::int
+                The # of desktops to keep warm. If None, uses the
+                `desktop_pool_size` setting.
+            cache::DesktopStateCache
+                The cache of the desktops, which is refreshed whenever
+                the pool lists the desktops and invalidated once it
+                changes them
+        """
+        self.run_ops = run_ops
+        self.path = path
+        self._size = size
+        self.cache = cache
+        self._pooled = []
+        self._lock = threading.RLock()
+
+    @property
+    def size(self):
+        return SETTINGS.desktop_pool_size if self._size is None else self._size
+
+    @contextlib.contextmanager
+    def _pooled_names(self):
+        """ Holds the pool, and yields the list of the names of the pooled
+        desktops, which is saved once done
+        """
+        with self._lock:
+            if self.path is None:
+                yield self._pooled
+                return
+            with file_lock(self.path):
+                try:
+                    with open(self.path, 'r') as fp:
+                        pooled = json.load(fp)['desktops']
+                except (FileNotFoundError, ValueError, KeyError):
+                    pooled = []
+                saved = list(pooled)
+                yield pooled
+                if pooled != saved:
+                    atomic_write(self.path, json.dumps({'desktops': pooled}))
+
+    def _snapshot(self) -> Optional[DesktopSnapshot]:
+        """ Lists the desktops, and their windows if there is a cache to
+        enumerate them with. Returns None if they can't be listed.
+        """
+        if self.cache is not None:
+            return self.cache.refresh(self.run_ops)
+        result, = self.run_ops([{'op': 'list'}])
+        if not result['ok']:
+            logger.error("Could not list the desktops: %s", result.get('error'))
+            return None
+        return DesktopSnapshot(result['value'], None)
+
+    def live_desktops(self):
+        """ Lists the names of all desktops, by position, or None if they
+        can't be listed
+        """
+        snapshot = self._snapshot()
+        return None if snapshot is None else snapshot.names
+
+    def locate(self, name, desktops=None):
+        """ Returns the position of the desktop with the given name, or
+        None if there is no such desktop
+
+        Args:
+            name::str
+                The name of the desktop
+            desktops::list(str)
+                The names of all desktops, if they were already listed
+        """
+        desktops = self.live_desktops() if desktops is None else desktops
+        if desktops is None or name not in desktops:
+            return None
+        return desktops.index(name)
+
+    @staticmethod
+    def _reconcile(pooled, desktops):
+        """ Forgets the pooled desktops that were removed outside persistd
+        """
+        gone = [name for name in pooled if name not in desktops]
+        if gone:
+            logger.warning("Pooled desktops %s are gone", ', '.join(gone))
+            pooled[:] = [name for name in pooled if name in desktops]
+
+    def _run_changes(self, ops):
+        """ Runs operations that change the desktops
+        """
+        try:
+            return self.run_ops(ops)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate()
+
+    def _rename(self, position, name):
+        result, = self._run_changes([{'op': 'rename', 'desktop': position, 'name': name}])
+        if not result['ok']:
+            logger.error("Could not name virtual desktop #%s %s", position, name)
+        return result['ok']
+
+    def acquire(self, name) -> Optional[Tuple[int, Optional[str]]]:
+        """ Gives a desktop to a project, taking one from the pool if it
+        isn't empty, and creating one otherwise. A desktop that already
+        has the name, e.g. because the project wasn't closed, is reused.
+
+        Args:
+            name::str
+                The name the desktop gets
+
+        Returns:
+            position::int
+                The position of the desktop
+            name::str
+                The name of the desktop, or None if it couldn't be named,
+                in which case it can only be found by its position
+
+            Or None if there isn't a desktop for the project.
+        """
+        with self._pooled_names() as pooled:
+            desktops = self.live_desktops()
+            if desktops is None:
+                return None
+            if name in desktops:
+                logger.info("Reusing virtual desktop %s", name)
+                return desktops.index(name), name
+            self._reconcile(pooled, desktops)
+            if pooled:
+                position = desktops.index(pooled.pop())
+                logger.info("Took virtual desktop #%s from the pool", position)
+            else:
+                result, = self._run_changes([{'op': 'new'}])
+                if not result['ok']:
+                    logger.error("Could not create virtual desktop")
+                    return None
+                position = result['value']
+                logger.info("Created virtual desktop #%s", position)
+            if not self._rename(position, name):
+                return position, None
+            return position, name
+
+    def release(self, name):
+        """ Takes a desktop back from a project. It is kept in the pool if
+        the pool isn't full and it is known to have no windows left, e.g.
+        of programs that didn't close, and removed otherwise.
+
+        Args:
+            name::str
+                The name of the desktop
+
+        Returns:
+            success::bool
+                Whether the desktop is gone from the project
+        """
+        with self._pooled_names() as pooled:
+            snapshot = self._snapshot()
+            if snapshot is None:
+                return False
+            desktops = snapshot.names
+            if name not in desktops:
+                logger.warning("Virtual desktop %s is already gone", name)
+                return True
+            self._reconcile(pooled, desktops)
+            position = desktops.index(name)
+            is_empty = snapshot.windows is not None and not any(window_position == position
+                                                                for _, _, window_position in snapshot.windows)
+            if len(pooled) < self.size and is_empty:
+                pool_name = POOL_PREFIX + uuid.uuid4().hex[:8]
+                if self._rename(position, pool_name):
+                    pooled.append(pool_name)
+                    logger.info("Returned virtual desktop #%s to the pool", position)
+                    return True
+            # fails instead of removing another desktop, if this one moved since it was listed
+            result, = self._run_changes([{'op': 'remove', 'desktop': position, 'name': name}])
+            if result['ok']:
+                logger.info("Removed virtual desktop #%s", position)
+            else:
+                logger.error("Could not remove virtual desktop #%s", position)
+            return result['ok']
+
+    def warm_up(self):
+        """ Creates desktops until the pool is full, in a single batch
+
+        Returns:
+            created::int
+                The # of desktops that were added to the pool
+        """
+        with self._pooled_names() as pooled:
+            missing = self.size - len(pooled)
+            if missing <= 0:
+                return 0
+            desktops = self.live_desktops()
+            if desktops is None:
+                return 0
+            self._reconcile(pooled, desktops)
+            missing = self.size - len(pooled)
+            if missing <= 0:
+                return 0
+            positions = [result['value'] for result in self._run_changes([{'op': 'new'}] * missing) if result['ok']]
+            names = [POOL_PREFIX + uuid.uuid4().hex[:8] for _ in positions]
+            results = self._run_changes([{'op': 'rename', 'desktop': position, 'name': name}
+                                         for position, name in zip(positions, names)]) if positions else []
+            added = [name for name, result in zip(names, results) if result['ok']]
+            pooled.extend(added)
+            unnamed = [position for position, result in zip(positions, results) if not result['ok']]
+            if unnamed:
+                # desktops without a name can't be found again, so they aren't kept
+                self._run_changes([{'op': 'remove', 'desktop': position} for position in sorted(unnamed, reverse=True)])
+            logger.info("Added %d virtual desktops to the pool", len(added))
+            return len(added)
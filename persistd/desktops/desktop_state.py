@@ -0,0 +1,124 @@
+""" A cache of the virtual desktops and the windows on them.
+
+A single `enumerate` operation lists every desktop by position and every
+window with the desktop it is on. The snapshot it returns is kept for a
+short while, `desktop_cache_age` seconds, so that looking up where the
+desktop of a project is doesn't take a round trip per lookup. Anything
+that changes the desktops invalidates the snapshot.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from persistd.util.settings import SETTINGS
+from persistd.util.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DesktopSnapshot:
+    """ The desktops and windows at some point in time
+    """
+    # the names of the desktops, by position
+    names: List[str]
+    # the (window handle, pid, position of its desktop) of each window, or
+    # None if the windows couldn't be enumerated
+    windows: Optional[List[Tuple[int, int, int]]]
+    taken_at: float = field(default_factory=time.monotonic)
+
+    def position(self, name) -> Optional[int]:
+        """ The position of the desktop with the given name, or None if
+        there is no such desktop
+        """
+        return self.names.index(name) if name in self.names else None
+
+    def window_handles(self, pids: Iterable[int], position: Optional[int] = None) -> Dict[int, List[int]]:
+        """ The handles of the windows of the given processes
+
+        Args:
+            pids::list(int)
+                The process ids
+            position::int
+                If given, only the windows on this desktop are returned
+
+        Returns:
+            handles::dict(int, list(int))
+                A mapping from process id to the handles of its windows
+        """
+        pids = set(pids)
+        handles = {}
+        for handle, pid, window_position in self.windows or []:
+            if pid in pids and (position is None or window_position == position):
+                handles.setdefault(pid, []).append(handle)
+        return handles
+
+    def window_positions(self, pids: Iterable[int]) -> List[int]:
+        """ The positions of the desktops that have windows of the given
+        processes, sorted
+        """
+        pids = set(pids)
+        return sorted({window_position for _, pid, window_position in self.windows or [] if pid in pids})
+
+
+class DesktopStateCache:
+
+    def __init__(self):
+        """ Initializes an empty cache, which is filled on the first
+        lookup
+        """
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def refresh(self, run_ops: Callable[[List[Dict]], List[Dict]]) -> Optional[DesktopSnapshot]:
+        """ Enumerates the desktops and their windows in a single
+        operation
+
+        Args:
+            run_ops::callable
+                Runs a batch of desktop operations
+
+        Returns:
+            snapshot::DesktopSnapshot
+                The new snapshot, or None if the desktops couldn't be
+                enumerated
+        """
+        TRACER.count('desktop_enumerations')
+        result, = run_ops([{'op': 'enumerate'}])
+        if not result['ok']:
+            logger.error("Could not enumerate the desktops: %s", result.get('error'))
+            self.invalidate()
+            return None
+        windows = result['value'].get('windows')
+        snapshot = DesktopSnapshot(list(result['value']['desktops']),
+                                   None if windows is None else [tuple(window) for window in windows])
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def get(self, run_ops: Callable[[List[Dict]], List[Dict]],
+            max_age: Optional[float] = None) -> Optional[DesktopSnapshot]:
+        """ Returns the cached snapshot, or a new one if the cached one is
+        older than `max_age` seconds
+
+        Args:
+            run_ops::callable
+                Runs a batch of desktop operations
+            max_age::float
+                If None, uses the `desktop_cache_age` setting
+        """
+        max_age = SETTINGS.desktop_cache_age if max_age is None else max_age
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.taken_at > max_age:
+            return self.refresh(run_ops)
+        return snapshot
+
+    def invalidate(self):
+        """ Forgets the snapshot, e.g. after desktops were created,
+        renamed or removed
+        """
+        with self._lock:
+            self._snapshot = None
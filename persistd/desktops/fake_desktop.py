@@ -0,0 +1,153 @@
+import itertools
+import logging
+import os
+import threading
+
+from persistd.desktops.base_desktop import BaseDesktop
+from persistd.desktops.desktop_helper import FakeDesktopBackend, run_op
+from persistd.desktops.desktop_pool import DesktopPool, project_desktop_name
+from persistd.desktops.desktop_state import DesktopStateCache
+from persistd.util.fakes import FakeBehavior
+
+logger = logging.getLogger(__name__)
+
+
+def _run_on_backend(ops):
+    with FakeDesktop._lock:
+        return [run_op(FakeDesktop.backend, op) for op in ops]
+
+
+class FakeDesktop(BaseDesktop):
+    """ A desktop that only exists in memory, which lets persistd run
+    end to end on any OS. Programs aren't actually launched, they only
+    get a made up pid.
+    """
+    desktop_id = None
+    desktop_name = None
+    window_handles = None
+
+    # how long operations take and how often they fail, e.g. for benchmarks
+    behavior = FakeBehavior()
+
+    # shared by all fake desktops in the process, like the real desktops are
+    backend = FakeDesktopBackend()
+    _lock = threading.Lock()
+    state_cache = DesktopStateCache()
+    pool = DesktopPool(_run_on_backend, cache=state_cache)
+    _pids = itertools.count(1000)
+
+    @property
+    def object_persist_path(self):
+        """ The path where this object will be persisted
+        """
+        return os.path.join(self.persist_path, 'fake_desktop.json')
+
+    @property
+    def os(self):
+        return 'any'
+
+    @property
+    def position(self):
+        return self.desktop_id
+
+    def _perform(self, operation):
+        if self.behavior.perform(operation):
+            return True
+        logger.error("Fake desktop failed to %s", operation)
+        return False
+
+    def setup(self):
+        return self._perform('setup')
+
+    def create_desktop(self):
+        if not self._perform('create_desktop'):
+            return False
+        acquired = self.pool.acquire(project_desktop_name(self.project_name))
+        if acquired is None:
+            return False
+        self.desktop_id, self.desktop_name = acquired
+        self.program_pids = {}
+        logger.info("Created fake desktop %d", self.desktop_id)
+        return True
+
+    def warm_up(self):
+        return self.pool.warm_up()
+
+    def _locate(self):
+        if self.desktop_name is not None:
+            snapshot = self.state_cache.get(_run_on_backend)
+            self.desktop_id = None if snapshot is None else snapshot.position(self.desktop_name)
+        return self.desktop_id
+
+    def switch_to_desktop(self, desktop_id=None):
+        desktop_id = self._locate() if desktop_id is None else desktop_id
+        if desktop_id is None or not self._perform('switch_to_desktop'):
+            return False
+        with self._lock:
+            self.backend.switch(desktop_id)
+        return True
+
+    def persist_desktop(self, desktop_id=None):
+        if not self._perform('persist_desktop'):
+            return False
+        snapshot = self.state_cache.refresh(_run_on_backend)
+        if snapshot is None:
+            return False
+        if desktop_id is not None:
+            position = desktop_id
+        elif self.desktop_name is not None:
+            position = snapshot.position(self.desktop_name)
+        else:
+            position = self.desktop_id
+        if position is None:
+            logger.error("Could not find the fake desktop of %s", self.project_name)
+            return False
+        self.desktop_id = position
+        self.window_handles = {program: sorted(handle for handles in snapshot.window_handles(pids, position).values()
+                                               for handle in handles)
+                               for program, pids in (self.program_pids or {}).items()}
+        return True
+
+    def close_desktop(self, desktop_id=None):
+        if desktop_id is None and self.desktop_name is not None:
+            if not self._perform('close_desktop') or not self.pool.release(self.desktop_name):
+                return False
+            self.desktop_id = None
+            self.desktop_name = None
+            return True
+        desktop_id = self.desktop_id if desktop_id is None else desktop_id
+        if desktop_id is None or not self._perform('close_desktop'):
+            return False
+        with self._lock:
+            self.backend.remove(desktop_id)
+        if desktop_id == self.desktop_id:
+            self.desktop_id = None
+        return True
+
+    def close_current_desktop(self):
+        if not self._perform('close_current_desktop'):
+            return False
+        with self._lock:
+            self.backend.remove_current()
+        return True
+
+    def launch_program(self, command, input=None, desktop_id=None, open_async=False, max_tries=3, timeout=None,
+                       wait_for_new_window=False, window_class=None):
+        desktop_id = self.desktop_id if desktop_id is None else desktop_id
+        if not self._perform('launch_program'):
+            return None
+        with self._lock:
+            pid = next(self._pids)
+            if max_tries > 0 and desktop_id is not None:
+                self.backend.move(desktop_id, pid)
+        self.record_launch(command, pid)
+        logger.info("Launched fake program %s (pid=%d)", command[0], pid)
+        return pid
+
+    def destroy(self):
+        pass
+
+
+CODE_NAME = 'fake_desktop'
+HUMAN_READABLE_NAME = 'Fake desktop'
+DESKTOP_CLASS = FakeDesktop
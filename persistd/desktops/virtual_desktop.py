@@ -1,20 +1,58 @@
-from io import BytesIO
+import contextlib
 import logging
 import os
 import platform
-import requests
-from shutil import rmtree
-import time
-from zipfile import ZipFile
+import threading
 
 from persistd.util.command_line import run_on_command_line
+from persistd.util.integrity import IntegrityCache
 from persistd.util.paths import DESKTOPS_PATH
-from persistd.util.savers import save_dict_to_json, load_dict_from_json
+from persistd.util.settings import SETTINGS
+from persistd.util.tracing import TRACER, sleep, traced
 
 from persistd.desktops.base_desktop import BaseDesktop
+from persistd.desktops.desktop_helper import DesktopHelperError, get_helper_client
+from persistd.desktops.desktop_pool import DesktopPool, project_desktop_name
+from persistd.desktops.desktop_state import DesktopStateCache
+from persistd.desktops.window_probe import get_window_probe
 
 logger = logging.getLogger(__name__)
 
+# Hashes of the helper binaries, so they are only re-hashed when they change
+INTEGRITY_CACHE = IntegrityCache(os.path.join(DESKTOPS_PATH, 'integrity.json'))
+
+# The names of the desktops that are kept warm for projects
+POOL_PATH = os.path.join(DESKTOPS_PATH, 'pool.json')
+
+# The desktops and windows, shared by all projects in the process
+STATE_CACHE = DesktopStateCache()
+
+
+def _parse_desktop_list(stdout):
+    """ Parses the names of the desktops out of the output of
+    `VirtualDesktop.exe -List`, which looks like:
+
+        Virtual desktops:
+        -----------------
+        Desktop 1 (visible)
+        Desktop 2
+
+        Count of desktops: 2
+    """
+    names = []
+    lines = iter(stdout.splitlines())
+    for line in lines:
+        if line.startswith('---'):
+            break
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('Count of desktops'):
+            break
+        if line.endswith(' (visible)'):
+            line = line[:-len(' (visible)')]
+        names.append(line)
+    return names
+
 
 class VirtualDesktop(BaseDesktop):
 
@@ -22,6 +60,24 @@ class VirtualDesktop(BaseDesktop):
     # Note that this may change if another desktop is
     # closed
     virtual_desktop_id = None
+    # Name of the currently used virtual desktop, which is
+    # used to find its current id
+    desktop_name = None
+    # The handles of the windows of the programs on the
+    # desktop, by program, as of the last persist
+    window_handles = None
+
+    # The probe used to wait for program windows.
+    # If None, the probe for this OS is used
+    window_probe = None
+    # The (pid, desktop id) of the programs waiting to be moved
+    # by `batch_moves`, or None if moves aren't batched
+    _move_batch = None
+    _move_lock = threading.Lock()
+
+    @property
+    def probe(self):
+        return self.window_probe or get_window_probe()
 
     @property
     def exe_path(self):
@@ -38,21 +94,35 @@ class VirtualDesktop(BaseDesktop):
     def os(self):
         return ('Windows', '10')
 
+    @property
+    def position(self):
+        # desktops are numbered by position
+        return self.virtual_desktop_id
+
     def setup(self):
         self._check_md5()
         if not os.path.exists(self.exe_path):
             return self._setup()
         return True
 
+    @traced
     def _check_md5(self):
         if os.path.exists(self.exe_path):
             true_md5 = "cf7756c006d3841c3ed5a66429b92e26"
-            _, stdout, _ = run_on_command_line(['certutil', '-hashfile', self.exe_path, 'md5'])
-            md5 = stdout.split('\n')[1].strip()
+            md5 = INTEGRITY_CACHE.file_hash(self.exe_path, 'md5')
             if md5 != true_md5:
+                INTEGRITY_CACHE.forget(self.exe_path, 'md5')
                 os.remove(self.exe_path)
 
+    @traced
     def _setup(self):
+        # Only needed once, so these aren't imported with the module
+        from io import BytesIO
+        from shutil import rmtree
+        from zipfile import ZipFile
+
+        import requests
+
         logger.info("Downloading VirtualDesktop from Github...")
         package_url = 'https://github.com/MScholtes/VirtualDesktop/archive/ca765148bcbca5b0675e8b151e2a76fc299460f1.zip'
         zip_raw = requests.get(package_url)
@@ -82,31 +152,153 @@ class VirtualDesktop(BaseDesktop):
         logger.info("VirtualDesktop is ready to go!")
         return True
 
+    @property
+    def helper(self):
+        """ The shared desktop helper client, or None if desktop
+        operations should each run their own VirtualDesktop.exe
+        """
+        if SETTINGS.desktop_helper_command:
+            return get_helper_client(SETTINGS.desktop_helper_command)
+        return None
+
+    def _run_exe_op(self, op):
+        """ Runs a single desktop operation with its own VirtualDesktop.exe
+        """
+        name = op['op']
+        if name == 'new':
+            return_code, stdout, _ = run_on_command_line([self.exe_path, '-new'])
+            # TODO find a better way to do this
+            # return_code is the new desktop id no matter if it succeeded or not
+            # stdout is an error object if the command failed or timed out
+            return {'ok': isinstance(stdout, str) and "error" not in stdout, 'value': return_code}
+        elif name == 'remove_current':
+            return_code, stdout, _ = run_on_command_line([self.exe_path, '-GetCurrentDesktop', '-Remove'])
+            # return_code is the current desktop id no matter if it succeeded or not
+            return {'ok': isinstance(stdout, str) and "error" not in stdout, 'value': return_code}
+        elif name == 'list':
+            _, stdout, _ = run_on_command_line([self.exe_path, '-List'])
+            if not isinstance(stdout, str):
+                return {'ok': False, 'value': None, 'error': str(stdout)}
+            return {'ok': True, 'value': _parse_desktop_list(stdout)}
+        elif name == 'enumerate':
+            # VirtualDesktop.exe can only find the desktop of one window per run, so windows aren't enumerated
+            result = self._run_exe_op({'op': 'list'})
+            if result['ok']:
+                result['value'] = {'desktops': result['value'], 'windows': None}
+            return result
+        elif name == 'rename':
+            args = ['-GetDesktop:%s' % op['desktop'], '-Name:%s' % op['name']]
+        elif name in ('switch', 'remove') and op.get('name') is not None:
+            # VirtualDesktop.exe can't target a desktop by name, so the name is checked before acting
+            listed = self._run_exe_op({'op': 'list'})
+            if not listed['ok']:
+                return listed
+            names = listed['value']
+            if not 0 <= op['desktop'] < len(names) or names[op['desktop']] != op['name']:
+                return {'ok': False, 'value': None,
+                        'error': "Desktop #%s is not %s" % (op['desktop'], op['name'])}
+            return self._run_exe_op({key: value for key, value in op.items() if key != 'name'})
+        elif name == 'switch':
+            args = ['-Switch:%s' % op['desktop']]
+        elif name == 'remove':
+            args = ['-Remove:%s' % op['desktop']]
+        elif name == 'move':
+            args = ['-GetDesktop:%s' % op['desktop'], '-MoveWindow:%d' % op['pid']]
+        else:
+            raise ValueError("Unknown desktop operation %s" % name)
+        return_code, _, _ = run_on_command_line([self.exe_path] + args)
+        return {'ok': return_code == op['desktop'], 'value': return_code}
+
+    def _run_ops(self, ops):
+        """ Runs a batch of desktop operations, in a single round trip
+        if a desktop helper is configured.
+
+        Returns:
+            results::list(dict)
+                One {"ok": bool, "value": ...} per operation
+        """
+        helper = self.helper
+        if helper is not None:
+            try:
+                return helper.request(ops)
+            except DesktopHelperError as err:
+                logger.error("%s", err)
+                return [{'ok': False, 'value': None, 'error': str(err)} for _ in ops]
+        return [self._run_exe_op(op) for op in ops]
+
+    @property
+    def pool(self):
+        """ The pool of desktops that are kept warm for projects
+        """
+        return DesktopPool(self._run_ops, POOL_PATH, cache=STATE_CACHE)
+
+    def _locate(self, refresh=False):
+        """ Returns the current id of the created desktop, looking it up
+        by name, since the saved id goes stale when desktops before it
+        are removed. Returns None if the desktop is gone.
+
+        Args:
+            refresh::bool
+                Whether to enumerate the desktops again, instead of using
+                a recent snapshot of them
+        """
+        if self.desktop_name is None:
+            return self.virtual_desktop_id
+        snapshot = STATE_CACHE.refresh(self._run_ops) if refresh else STATE_CACHE.get(self._run_ops)
+        if snapshot is None:
+            logger.warning("Could not check the id of virtual desktop %s, using #%s",
+                           self.desktop_name, self.virtual_desktop_id)
+            return self.virtual_desktop_id
+        position = snapshot.position(self.desktop_name)
+        if position is None:
+            logger.error("Virtual desktop %s is gone", self.desktop_name)
+        elif position != self.virtual_desktop_id:
+            logger.info("Virtual desktop %s moved from #%s to #%s", self.desktop_name, self.virtual_desktop_id,
+                        position)
+        self.virtual_desktop_id = position
+        return position
+
     def create_desktop(self):
-        """ Creates a new desktop and saves the id to self
+        """ Takes a desktop from the pool, or creates a new one, and
+        saves the id to self
 
         Returns:
             success::bool
-                Whether a new virtual desktop was created
-        """
-        return_code, stdout, _ = run_on_command_line([self.exe_path, "-new"])
-        # TODO find a better way to do this
-        # return_code is the new desktop id no matter if it succeeded or not
-        if "error" not in stdout:
-            self.virtual_desktop_id = return_code
-            logger.info("Created virtual desktop #%s", self.virtual_desktop_id)
+                Whether there is a virtual desktop for the project
+        """
+        acquired = self.pool.acquire(project_desktop_name(self.project_name))
+        if acquired is not None:
+            self.virtual_desktop_id, self.desktop_name = acquired
+            self.program_pids = {}
+            self.window_handles = {}
             return True
         else:
             logger.error("Could not create virtual desktop")
             return False
 
+    def warm_up(self):
+        """ Fills the pool of desktops for the projects that open later
+        """
+        return self.pool.warm_up()
+
     def switch_to_desktop(self, desktop_id=None):
         """ Switches to the given desktop. If desktop_id
         is None, should switch to the created desktop.
         """
-        desktop_id = desktop_id if desktop_id is not None else self.virtual_desktop_id
-        return_code, stdout, _ = run_on_command_line([self.exe_path, '-Switch:%s' % desktop_id])
-        if return_code is desktop_id:
+        if desktop_id is not None:
+            result, = self._run_ops([{'op': 'switch', 'desktop': desktop_id}])
+        else:
+            desktop_id = self._locate()
+            if desktop_id is None:
+                return False
+            # fails instead of switching to another desktop, if the cached id is stale
+            result, = self._run_ops([{'op': 'switch', 'desktop': desktop_id, 'name': self.desktop_name}])
+            if not result['ok'] and self.desktop_name is not None:
+                desktop_id = self._locate(refresh=True)
+                if desktop_id is None:
+                    return False
+                result, = self._run_ops([{'op': 'switch', 'desktop': desktop_id, 'name': self.desktop_name}])
+        if result['ok']:
             logger.info("Switched to virtual desktop #%s", desktop_id)
             return True
         else:
@@ -116,18 +308,52 @@ class VirtualDesktop(BaseDesktop):
     def persist_desktop(self, desktop_id=None):
         """ Persists a given desktop. If desktop_id
         is None, should persist the created desktop.
+
+        Finds which desktop the project is using now by its name, and
+        saves its id and the handles of the windows of each program on
+        it. A desktop that lost its name is never claimed by where the
+        windows of the project are, since they may have been moved to
+        another desktop of the user.
+
+        Returns:
+            success::bool
+                Whether the desktop of the project was found
         """
-        # Nothing to do for now
-        # TODO find which desktop is now being used for this project and save that
-        pass
+        snapshot = STATE_CACHE.refresh(self._run_ops)
+        if snapshot is None:
+            return False
+        if desktop_id is not None:
+            position = desktop_id
+        elif self.desktop_name is not None:
+            position = snapshot.position(self.desktop_name)
+        else:
+            # the project opened before desktops were named
+            position = self.virtual_desktop_id
+        if position is None or not 0 <= position < len(snapshot.names):
+            logger.error("Could not find the virtual desktop of %s; its windows are on desktops %s",
+                         self.project_name, snapshot.window_positions(self.launched_pids))
+            return False
+        self.virtual_desktop_id = position
+        self.window_handles = {}
+        for program, pids in (self.program_pids or {}).items():
+            handles = snapshot.window_handles(pids, position)
+            self.window_handles[program] = sorted(handle for pid in pids for handle in handles.get(pid, []))
+        return True
 
     def close_desktop(self, desktop_id=None):
         """ Closes a given desktop. If desktop_id
-        is None, should close the created desktop.
+        is None, should close the created desktop, which
+        goes back to the pool if the pool isn't full.
         """
+        if desktop_id is None and self.desktop_name is not None:
+            if not self.pool.release(self.desktop_name):
+                return False
+            self.virtual_desktop_id = None
+            self.desktop_name = None
+            return True
         desktop_id = desktop_id if desktop_id is not None else self.virtual_desktop_id
-        return_code, stdout, _ = run_on_command_line([self.exe_path, '-Remove:%s' % desktop_id])
-        if return_code is desktop_id:
+        result, = self._run_ops([{'op': 'remove', 'desktop': desktop_id}])
+        if result['ok']:
             logger.info("Removed virtual desktop #%s", desktop_id)
             return True
         else:
@@ -137,18 +363,19 @@ class VirtualDesktop(BaseDesktop):
     def close_current_desktop(self):
         """ Closes the current desktop
         """
-        return_code, stdout, _ = run_on_command_line([self.exe_path, '-GetCurrentDesktop', '-Remove'])
-        # TODO find a better way to do this
-        # return_code is the current desktop id no matter if it succeeded or not
-        if "error" not in stdout:
+        result, = self._run_ops([{'op': 'remove_current'}])
+        if result['ok']:
             logger.info("Removed current virtual desktop")
             return True
         else:
             logger.error("Could not remove current virtual desktop")
             return False
 
-    def move_program(self, pid, desktop_id=None, max_tries=3, sleep=None):
+    def move_program(self, pid, desktop_id=None, max_tries=3, timeout=None):
         """ Moves a program to a given desktop using its process id.
+        Waits for the window of the program to appear first, and then
+        retries the move with exponential backoff. Within `batch_moves`,
+        the program is only moved once it exits.
 
         Args:
             pid::int
@@ -158,8 +385,9 @@ class VirtualDesktop(BaseDesktop):
                 the created desktop
             max_tries::int
                 The max # of times this action should be tried
-            sleep::float
-                The amount of time to sleep before moving the process
+            timeout::float
+                The max # of seconds to wait for the window of the
+                program. If None, uses the `window_timeout` setting.
 
         Returns:
             pid::int
@@ -167,21 +395,72 @@ class VirtualDesktop(BaseDesktop):
                 if the process was not successfully launched.
         """
         desktop_id = desktop_id if desktop_id is not None else self.virtual_desktop_id
-        return_code = -1
-        counter = 0
-        while return_code != self.virtual_desktop_id and counter < max_tries:
-            return_code, stdout, _ = run_on_command_line([self.exe_path, '-GetDesktop:%s' % desktop_id, '-MoveWindow:%d' % pid])
-            if return_code is self.virtual_desktop_id:
+        timeout = SETTINGS.window_timeout if timeout is None else timeout
+        probe = self.probe
+        if probe is not None and not probe.wait_for_window(pid, timeout):
+            logger.warning("Could not find a window for program (pid=%d) after %.1fs.", pid, timeout)
+        with self._move_lock:
+            if self._move_batch is not None:
+                self._move_batch.append((pid, desktop_id))
+                return pid
+        return self._move_with_retries(pid, desktop_id, max_tries)
+
+    def _move_with_retries(self, pid, desktop_id, max_tries):
+        """ Moves a program, retrying with exponential backoff
+        """
+        delay = 0.05
+        for counter in range(max_tries):
+            result, = self._run_ops([{'op': 'move', 'desktop': desktop_id, 'pid': pid}])
+            if result['ok']:
                 logger.info("Moved program (pid=%d) to virtual desktop %s successfully.", pid, desktop_id)
                 return pid
-            else:
-                counter += 1
-            if sleep:
-                time.sleep(sleep)
+            if counter + 1 < max_tries:
+                TRACER.count('retries')
+                sleep(delay)
+                delay *= 2
         logger.error("Could not move program (pid=%d) to virtual desktop %s.", pid, desktop_id)
         return None
 
-    def launch_program(self, command, input=None, desktop_id=None, open_async=False, max_tries=3, sleep=None):
+    @contextlib.contextmanager
+    def batch_moves(self):
+        """ Moves the programs that are launched within it all at once,
+        when it exits, in a round trip per desktop. The windows are still
+        waited for as each program is launched. The programs that can't
+        be moved at once are moved one by one.
+        """
+        with self._move_lock:
+            self._move_batch = []
+        try:
+            yield
+        finally:
+            with self._move_lock:
+                batch, self._move_batch = self._move_batch, None
+            pids_by_desktop = {}
+            for pid, desktop_id in batch:
+                pids_by_desktop.setdefault(desktop_id, []).append(pid)
+            for desktop_id, pids in pids_by_desktop.items():
+                moved = self.move_programs(pids, desktop_id)
+                for pid in pids:
+                    if pid not in moved:
+                        self._move_with_retries(pid, desktop_id, max_tries=2)
+
+    def move_programs(self, pids, desktop_id=None):
+        """ Moves several programs to a given desktop, in a single round
+        trip if a desktop helper is configured. Does not wait for windows.
+
+        Returns:
+            moved::list(int)
+                The process ids of the programs that were moved
+        """
+        desktop_id = desktop_id if desktop_id is not None else self.virtual_desktop_id
+        results = self._run_ops([{'op': 'move', 'desktop': desktop_id, 'pid': pid} for pid in pids])
+        moved = [pid for pid, result in zip(pids, results) if result['ok']]
+        for pid in set(pids) - set(moved):
+            logger.error("Could not move program (pid=%d) to virtual desktop %s.", pid, desktop_id)
+        return moved
+
+    def launch_program(self, command, input=None, desktop_id=None, open_async=False, max_tries=3, timeout=None,
+                       wait_for_new_window=False, window_class=None):
         """ Launches a program, with optional args, at a given desktop.
 
         Args:
@@ -200,14 +479,24 @@ class VirtualDesktop(BaseDesktop):
             max_tries::int
                 The # of times moving the program should be tried. If 0,
                 it won't be tried to move.
-            sleep::float
-                The amount of time to sleep before moving the process
+            timeout::float
+                The max # of seconds to wait for the window of the
+                program. If None, uses the `window_timeout` setting.
+            wait_for_new_window::bool
+                Whether to wait until a new window appears. Useful for
+                programs whose launcher hands off to another process.
+            window_class::str
+                The class of the new window to wait for. If None, any
+                new window will do.
 
         Returns:
             pid::int
                 The process id of the created process. May be None
                 if the process was not successfully launched.
         """
+        timeout = SETTINGS.window_timeout if timeout is None else timeout
+        probe = self.probe
+        known_windows = probe.list_windows() if probe is not None and wait_for_new_window else None
         return_code, stdout, pid = run_on_command_line(command, input=input, open_async=open_async)
         if return_code is 0 or (return_code is None and open_async):
             logger.info("Launched program (pid=%d) successfully. Trying to move it to desktop %s.", pid, desktop_id)
@@ -215,25 +504,18 @@ class VirtualDesktop(BaseDesktop):
             logger.error("Could not run command. Error: %s", stdout)
             return None
 
-        if sleep:
-            time.sleep(sleep)
+        if known_windows is not None and not probe.wait_for_new_window(known_windows, timeout, window_class):
+            logger.warning("No new window appeared for program (pid=%d) after %.1fs.", pid, timeout)
 
+        self.record_launch(command, pid)
         if max_tries > 0:
-            return self.move_program(pid, desktop_id, max_tries, sleep)
+            return self.move_program(pid, desktop_id, max_tries, timeout)
         else:
             return pid
 
     def destroy(self):
         pass
 
-    def save(self, path=None):
-        path = path or self.object_persist_path
-        save_dict_to_json(self, path)
-
-    def load(self, path=None):
-        path = path or self.object_persist_path
-        load_dict_from_json(self, path)
-
 
 CODE_NAME = 'virtual_desktop'
 HUMAN_READABLE_NAME = 'VirtualDesktop'
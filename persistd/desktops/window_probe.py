@@ -0,0 +1,175 @@
+import itertools
+import platform
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Set, Tuple
+
+from persistd.util import tracing
+
+
+def wait_until(predicate: Callable[[], bool], timeout: float, initial_delay: float = 0.02, factor: float = 2.0,
+               max_delay: float = 0.5, sleep: Callable[[float], None] = tracing.sleep) -> bool:
+    """ Polls `predicate` with exponential backoff until it is true or
+    `timeout` seconds have passed.
+
+    Returns:
+        ready::bool
+            Whether the predicate became true before the deadline
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        if predicate():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
+
+
+class WindowProbe(ABC):
+    """ Tells whether the top level window of a process exists yet
+    """
+
+    @abstractmethod
+    def list_windows(self) -> Set[Tuple[int, int]]:
+        """ Lists the visible top level windows
+
+        Returns:
+            windows::set((int, int))
+                The (window handle, process id) of each window
+        """
+        pass
+
+    def window_class(self, hwnd) -> Optional[str]:
+        """ The class name of the window with the given handle, or None if
+        it isn't known
+        """
+        return None
+
+    def window_exists(self, pid):
+        """ Whether the process with the given id has a visible window
+        """
+        return any(window_pid == pid for _, window_pid in self.list_windows())
+
+    def wait_for_window(self, pid, timeout):
+        """ Waits until the process with the given id has a visible window
+
+        Returns:
+            ready::bool
+                Whether the window appeared before the deadline
+        """
+        return wait_until(lambda: self.window_exists(pid), timeout)
+
+    def wait_for_new_window(self, known_windows, timeout, window_class=None):
+        """ Waits until a window that is not in `known_windows` appears.
+        Useful for programs like Chrome, whose launcher process hands the
+        window over to an already running process.
+
+        Args:
+            known_windows::set((int, int))
+                The windows that were there before, from `list_windows`
+            timeout::float
+                The max # of seconds to wait
+            window_class::str
+                If given, only new windows of this class count, so that
+                e.g. a dialog of another program isn't taken for it
+
+        Returns:
+            ready::bool
+                Whether a new window appeared before the deadline
+        """
+        def appeared():
+            return any(window_class is None or self.window_class(hwnd) == window_class
+                       for hwnd, _ in self.list_windows() - known_windows)
+
+        return wait_until(appeared, timeout)
+
+
+class Win32WindowProbe(WindowProbe):
+    """ Enumerates windows through the Win32 API
+    """
+
+    def list_windows(self):
+        import ctypes
+        from ctypes import wintypes
+
+        user32 = ctypes.windll.user32
+        windows = set()
+
+        def callback(hwnd, _):
+            if user32.IsWindowVisible(hwnd):
+                pid = wintypes.DWORD()
+                user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+                windows.add((hwnd, pid.value))
+            return True
+
+        enum_windows_proc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
+        user32.EnumWindows(enum_windows_proc(callback), 0)
+        return windows
+
+    def window_class(self, hwnd):
+        import ctypes
+
+        # class names are at most 256 characters
+        buffer = ctypes.create_unicode_buffer(257)
+        if not ctypes.windll.user32.GetClassNameW(hwnd, buffer, len(buffer)):
+            return None
+        return buffer.value
+
+
+class FakeWindowProbe(WindowProbe):
+    """ An in-memory probe that simulates windows appearing some time
+    after their process is launched. Used for testing on any OS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = itertools.count(1)
+        # window handle -> (pid, time at which the window appears)
+        self._windows = {}
+        # window handle -> window class
+        self._classes = {}
+
+    def add_window(self, pid, latency=0.0, window_class=None):
+        """ Simulates a window for the process that appears in `latency`
+        seconds, optionally of the given class
+
+        Returns:
+            hwnd::int
+                The handle of the new window
+        """
+        with self._lock:
+            hwnd = next(self._handles)
+            self._windows[hwnd] = (pid, time.monotonic() + latency)
+            if window_class is not None:
+                self._classes[hwnd] = window_class
+        return hwnd
+
+    def remove_window(self, hwnd):
+        with self._lock:
+            self._windows.pop(hwnd, None)
+            self._classes.pop(hwnd, None)
+
+    def list_windows(self):
+        now = time.monotonic()
+        with self._lock:
+            return {(hwnd, pid) for hwnd, (pid, appears_at) in self._windows.items() if appears_at <= now}
+
+    def window_class(self, hwnd):
+        with self._lock:
+            return self._classes.get(hwnd)
+
+
+_default_probe = None
+
+
+def get_window_probe() -> Optional[WindowProbe]:
+    """ Returns the window probe for this OS, or None if there is none
+    """
+    global _default_probe
+    if _default_probe is None and platform.system() == 'Windows':
+        _default_probe = Win32WindowProbe()
+    return _default_probe
@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 
 import argparse
+import functools
+import os
+import shlex
 import sys
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 import persistd.programs as programs
-from persistd.util.projects import get_all_projects
+from persistd.util.batch import run_on_projects
+from persistd.util.daemon import PROJECT_ACTIONS, DaemonClient, DaemonError, PersistDaemon
+from persistd.util.projects import get_all_projects, is_pattern, iter_projects, match_projects
+from persistd.util.scheduler import AutoPersister
+from persistd.util.tracing import TRACER
+from persistd.util.scanner import is_initialized
 from persistd.util.settings import SETTINGS
 from persistd.util.command_line import askyn
 from persistd.util.persister import DEFAULT_PROJECT_NAME, Persister
@@ -81,19 +89,73 @@ def get_action(include_interactive: bool = False) -> PersistAction:
         sys.exit('The specified index is not valid.')
 
 
+@functools.lru_cache(maxsize=None)
+def get_daemon_client() -> Optional[DaemonClient]:
+    """ Connects to the persistd daemon once, or returns None if it isn't running
+    """
+    return DaemonClient.connect()
+
+
+def run_project_action(action: str, project_name: str, program: Optional[str] = None):
+    """ Runs a project action (see `PROJECT_ACTIONS`) on the daemon if it
+    is running, or in this process otherwise
+    """
+    client = get_daemon_client()
+    # projects that aren't initialized yet need to ask questions, so they're handled here
+    if client is not None and is_initialized(os.path.join(SETTINGS.base_path, project_name)):
+        try:
+            return client.request(action, project=project_name, program=program)
+        except DaemonError as err:
+            sys.exit(f"Error: {err}")
+    persister = Persister(SETTINGS.base_path, project_name)
+    method = getattr(persister, PROJECT_ACTIONS[action])
+    return method(program) if program else method()
+
+
+def run_batch_action(action: str, project_names: List[str]):
+    """ Opens, persists or closes many projects at once, on the daemon if
+    it is running, and reports how each one went
+    """
+    if not project_names:
+        sys.exit("Error: there are no projects to %s." % action)
+    client = get_daemon_client()
+    if client is not None:
+        try:
+            results = client.request(action, projects=project_names)
+        except DaemonError as err:
+            sys.exit(f"Error: {err}")
+    else:
+        results = run_on_projects(action, project_names)
+    for project_name, result in results.items():
+        if result.success:
+            print(f"{project_name}: {action} done in {result.duration:.1f}s")
+        else:
+            print(f"{project_name}: could not {action}" + (f" ({result.error})" if result.error else ""))
+
+
 def list_projects(project_status: ProjectStatus = ProjectStatus.UnInitialized) -> List[str]:
     print('Available projects:')
-    if project_status == ProjectStatus.UnInitialized:
-        all_projects = get_all_projects()
+    client = get_daemon_client()
+    if client is not None and project_status != ProjectStatus.NoProject:
+        # the daemon already has the catalog in memory
+        try:
+            projects = client.request('list', status=project_status.value)
+        except DaemonError as err:
+            sys.exit(f"Error: {err}")
+    elif project_status == ProjectStatus.UnInitialized:
+        projects = iter_projects()
     elif project_status == ProjectStatus.Initialized:
-        all_projects = get_all_projects(only_initialized=True)
+        projects = iter_projects(only_initialized=True)
     elif project_status == ProjectStatus.Open:
-        all_projects = SETTINGS.open_projects
+        projects = SETTINGS.open_projects
     else:
         raise ValueError(f"Invalid project status {project_status}!")
 
-    for i, project in enumerate(all_projects, start=1):
+    # print the projects as they are found
+    all_projects = []
+    for i, project in enumerate(projects, start=1):
         print('{0:d}. {1:s}'.format(i, project))
+        all_projects.append(project)
 
     return all_projects
 
@@ -157,8 +219,14 @@ def get_setting():
     ind = int(input('Please enter the index of the project you want to launch, or 0 to exit: ')) - 1
     if -1 < ind < len(all_settings):
         setting = all_settings[ind]
-        setattr(SETTINGS, setting, input("Please enter the new value: "))
-        SETTINGS.save()
+        value = input("Please enter the new value: ")
+        # keep numeric settings numeric
+        current = getattr(SETTINGS, setting)
+        if isinstance(current, (int, float)):
+            value = type(current)(value)
+        elif isinstance(current, list):
+            value = shlex.split(value)
+        SETTINGS.update(lambda settings: setattr(settings, setting, value))
         print("Input saved.")
     elif ind == -1:
         sys.exit(0)
@@ -167,53 +235,78 @@ def get_setting():
 
 
 def main(args):
-    persister = Persister(SETTINGS.base_path, args.project_name)
-
     # First, take care of options that don't need the project_name
-    if args.interactive:
+    if args.daemon:
+        PersistDaemon().serve_forever()
+    elif args.auto_persist:
+        if SETTINGS.auto_persist_interval <= 0:
+            sys.exit("Error: set auto_persist_interval in the settings first.")
+        print(f"Persisting the open projects every {SETTINGS.auto_persist_interval:.0f}s, press Ctrl+C to stop.")
+        try:
+            AutoPersister().run_forever()
+        except KeyboardInterrupt:
+            pass
+    elif args.stop_daemon:
+        client = get_daemon_client()
+        if client is None:
+            sys.exit("The persistd daemon is not running.")
+        client.request('shutdown')
+        print("Stopped the persistd daemon.")
+    elif args.interactive:
         interactive()
     elif args.list_open:
         projects = list_projects(project_status=ProjectStatus.Open)
         if askyn("Do you want to close a project?"):
             project_name = choose_project(projects)
             print(f'Closing {project_name}')
-            persister = Persister(SETTINGS.base_path, project_name)
-            persister.close_project()
+            run_project_action('close', project_name)
     elif args.list_initialized:
         projects = list_projects(project_status=ProjectStatus.Initialized)
         if askyn("Do you want to open a project?"):
             project_name = choose_project(projects)
             print(f'Opening {project_name}')
-            persister = Persister(SETTINGS.base_path, project_name)
-            persister.launch_project()
+            run_project_action('open', project_name)
     elif args.list_projects:
         projects = list_projects(project_status=ProjectStatus.UnInitialized)
         if askyn("Do you want to open a project?"):
             project_name = choose_project(projects)
             print(f'Opening {project_name}')
-            persister = Persister(SETTINGS.base_path, project_name)
-            persister.launch_project()
+            run_project_action('open', project_name)
     elif args.settings:
         get_setting()
     elif args.new:
-        persister.create_project()
+        Persister(SETTINGS.base_path, args.project_name).create_project()
+    elif args.close_all:
+        run_batch_action('close', list(SETTINGS.open_projects))
+    elif args.persist_all:
+        run_batch_action('persist', list(SETTINGS.open_projects))
+    # Many projects, given by name or by glob patterns
+    elif len(args.project_names) > 1 or any(is_pattern(name) for name in args.project_names):
+        if args.delete or args.add or args.remove:
+            sys.exit("Error: only open, persist and close can take more than one project.")
+        action = 'close' if args.close else 'persist' if args.persist else 'open'
+        if action == 'open':
+            candidates = get_all_projects(SETTINGS.base_path, only_initialized=True)
+        else:
+            candidates = SETTINGS.open_projects
+        run_batch_action(action, match_projects(args.project_names, candidates))
     # Then, check if project_name is set
     elif args.project_name and args.project_name != DEFAULT_PROJECT_NAME:
         if args.close:
-            persister.close_project()
+            run_project_action('close', args.project_name)
         elif args.persist:
-            persister.persist_project()
+            run_project_action('persist', args.project_name)
         elif args.delete:
             if askyn("Deleting a project cannot be undone. Are you sure you want to delete %s?" % args.project_name):
-                persister.delete_project()
+                Persister(SETTINGS.base_path, args.project_name).delete_project()
             else:
                 print("Project not deleted.")
         elif args.add:
-            persister.add_program_to_project(args.add)
+            run_project_action('add', args.project_name, args.add)
         elif args.remove:
-            persister.remove_program_from_project(args.remove)
+            run_project_action('remove', args.project_name, args.remove)
         else:
-            persister.launch_project()
+            run_project_action('open', args.project_name)
     # If we reach this, an incorrect configuration was given
     else:
         print('Error: project_name is required')
@@ -237,10 +330,29 @@ def parse_args(args):
     parser.add_argument('-l', '--list-projects', action='store_true', help="list all projects under the base path")
     parser.add_argument('--list-open', action='store_true', help="list all open projects")
     parser.add_argument('--list-initialized', action='store_true', help="list all persistd projects")
-    parser.add_argument('project_name', nargs='?', default=DEFAULT_PROJECT_NAME)
+    parser.add_argument('--close-all', action='store_true', help="close & persist all open projects")
+    parser.add_argument('--persist-all', action='store_true', help="persist all open projects")
+    parser.add_argument('--daemon', action='store_true', help="run the persistd daemon, which serves other commands")
+    parser.add_argument('--stop-daemon', action='store_true', help="stop the persistd daemon")
+    parser.add_argument('--auto-persist', action='store_true', help="persist the open projects periodically")
+    parser.add_argument('--profile', action='store_true', help="print where the time went at the end")
+    parser.add_argument('--trace', metavar='TRACE_PATH', help="append a json line per traced call to a file")
+    parser.add_argument('project_names', nargs='*', metavar='project_name',
+                        help="the project, or many projects and glob patterns to open, persist or close")
     parsed_args = parser.parse_args(args)
+    parsed_args.project_name = parsed_args.project_names[0] if parsed_args.project_names else DEFAULT_PROJECT_NAME
     parsed_args.parser = parser
-    main(parsed_args)
+    trace_path = parsed_args.trace or SETTINGS.trace_path
+    if not (parsed_args.profile or trace_path):
+        return main(parsed_args)
+    TRACER.enable(trace_path)
+    try:
+        with TRACER.span('persist', args=' '.join(args)):
+            main(parsed_args)
+    finally:
+        if parsed_args.profile:
+            print(TRACER.format_summary())
+        TRACER.disable()
 
 
 def main_cmd():
@@ -1,22 +1,27 @@
-import persistd.programs.chrome as chrome
-import persistd.programs.conemu as conemu
-import persistd.programs.sublime_text as sublime_text
-import persistd.programs.vscode as vscode
+from persistd.util.registry import LazyClassMap, LazyPlugin
 
-all_programs = [chrome,
-                conemu,
-                sublime_text,
-                vscode,
+# The program modules are only imported once their class is needed
+all_programs = [LazyPlugin('persistd.programs.chrome', 'chrome', 'Google Chrome'),
+                LazyPlugin('persistd.programs.conemu', 'conemu', 'ConEmu'),
+                LazyPlugin('persistd.programs.sublime_text', 'sublime_text', 'Sublime Text'),
+                LazyPlugin('persistd.programs.vscode', 'vscode', 'VSCode'),
                 ]
 
-code_name_to_class = {program.CODE_NAME: program.PROGRAM_CLASS
-                      for program in all_programs
-                      if program.PROGRAM_CLASS}
+# These can be used by projects, but aren't offered when creating one
+hidden_programs = [LazyPlugin('persistd.programs.fake', 'fake', 'Fake program'),
+                   ]
 
-class_to_code_name = {kls: name for name, kls in code_name_to_class.items()}
+code_name_to_class = LazyClassMap(all_programs + hidden_programs, 'PROGRAM_CLASS')
 
-human_readable_name_to_class = {program.HUMAN_READABLE_NAME: program.PROGRAM_CLASS
-                                for program in all_programs
-                                if program.PROGRAM_CLASS}
 
-class_to_human_readable_name = {kls: name for name, kls in human_readable_name_to_class.items()}
+def __getattr__(name):
+    # These need every program module, so they are only built on access
+    if name == 'class_to_code_name':
+        return {kls: name for name, kls in code_name_to_class.items()}
+    elif name == 'human_readable_name_to_class':
+        return {program.HUMAN_READABLE_NAME: program.PROGRAM_CLASS
+                for program in all_programs
+                if program.PROGRAM_CLASS}
+    elif name == 'class_to_human_readable_name':
+        return {kls: name for name, kls in __getattr__('human_readable_name_to_class').items()}
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,9 +1,27 @@
 from abc import ABC, abstractmethod
 
 from persistd.util.persistable import Persistable
+from persistd.util.templates import provision_templates
+from persistd.util.tracing import trace_methods
 
 
 class BaseProgram(Persistable, ABC):
+    # Whether the program calls `state_changed` whenever its state
+    # changes. If not, it is always assumed to have changed. Programs
+    # whose `persist` has nothing to save never change, and set it too.
+    TRACKS_CHANGES = False
+    _changed = True
+    # The folder of the program under `programs/`, which holds its templates
+    TEMPLATE_FOLDER = None
+    # Whether the desktop moves the window of the program once it is
+    # launched. Programs whose window isn't moved open on the current
+    # desktop, so they are started while the project's desktop is current.
+    MOVES_WINDOW = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # every program is traced the same way
+        trace_methods(cls, ['setup', 'start', 'persist', 'close', 'destroy'])
 
     def __init__(self, project_name, project_path, persist_path, desktop):
         """ Initializes a program.
@@ -17,12 +35,57 @@ class BaseProgram(Persistable, ABC):
                 The path to the directory wherein a program will
                 be persisted
             desktop::BaseDesktop
-                A desktop object that supports virtual desktop ops
+                A desktop object that supports virtual desktop ops, or a
+                callable that returns one when the program first needs it
         """
         self.project_name = project_name
         self.project_path = project_path
         self.persist_path = persist_path
-        self.desktop = desktop
+        self._desktop = desktop
+
+    @property
+    def desktop(self):
+        """ The desktop object, resolved on first access if a callable
+        was given
+        """
+        if callable(self._desktop):
+            self._desktop = self._desktop()
+        return self._desktop
+
+    @property
+    def templates(self):
+        """ The templates the program renders into the project, as a
+        mapping from template file name to the path it is rendered to
+        """
+        return {}
+
+    def provision_templates(self):
+        """ Renders the templates into the project. Only the files whose
+        content changed are written.
+
+        Returns:
+            written::list(str)
+                The paths that were written
+        """
+        variables = {'project_name': self.project_name, 'project_path': self.project_path,
+                     'persist_path': self.persist_path}
+        return provision_templates(self.TEMPLATE_FOLDER, self.templates, variables)
+
+    def state_changed(self):
+        """ Notes that the state of the program changed, so that it is
+        persisted by the next auto-persist.
+        """
+        self._changed = True
+
+    def has_changed(self):
+        """ Whether the program may have changed since it was last persisted
+        """
+        return self._changed or not self.TRACKS_CHANGES
+
+    def mark_persisted(self):
+        """ Notes that the current state of the program was persisted
+        """
+        self._changed = False
 
     @abstractmethod
     def setup(self):
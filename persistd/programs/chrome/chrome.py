@@ -4,16 +4,35 @@ import shutil
 
 from persistd.util.settings import SETTINGS
 from persistd.util.command_line import run_on_command_line
-from persistd.util.savers import save_dict_to_json, load_dict_from_json
 
 from persistd.programs.base_program import BaseProgram
+from persistd.programs.chrome.native_host import ChromeHostClient, NativeMessagingError, install_host
 
 logger = logging.getLogger(__name__)
 
 BASE_URL = "http://idontthinkthis.domainwilleverexist?project_name=%s&action=%s"
 
+# The ways the extension can restore the tabs of a project, see the
+# `chrome_restore_mode` setting
+RESTORE_MODES = ['eager', 'lazy', 'waves']
+
+# The class of the top level windows of Chrome
+WINDOW_CLASS = 'Chrome_WidgetWin_1'
+
 
 class Chrome(BaseProgram):
+    # with the native host, the synced tabs say whether the tabs changed
+    TRACKS_CHANGES = True
+    _persisted_signature = None
+    # Chrome hands its windows over to the running Chrome process, so
+    # they can't be moved by pid and open on the current desktop
+    MOVES_WINDOW = False
+
+    # The tabs of the project, as of the last time the extension saved them
+    tabs = None
+    # How the tabs of this project are restored. If None, uses the
+    # `chrome_restore_mode` setting
+    restore_mode = None
 
     @property
     def object_persist_path(self):
@@ -21,6 +40,34 @@ class Chrome(BaseProgram):
         """
         return os.path.join(self.persist_path, 'chrome.json')
 
+    @property
+    def synced_tabs_path(self):
+        """ The tabs of the project, which the native host keeps in sync
+        with the extension
+        """
+        return os.path.join(self.persist_path, 'tabs.json')
+
+    def _synced_signature(self):
+        try:
+            stat = os.stat(self.synced_tabs_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def has_changed(self):
+        """ Whether the tabs may have changed since they were last
+        persisted. Without the native host there is no telling, and
+        persisting would open a window in Chrome, so the tabs are only
+        persisted when asked to, not by `only_changed` snapshots.
+        """
+        if not SETTINGS.chrome_extension_id:
+            return False
+        return super().has_changed() or self._synced_signature() != self._persisted_signature
+
+    def mark_persisted(self):
+        super().mark_persisted()
+        self._persisted_signature = self._synced_signature()
+
     def setup(self):
         """ Sets up the program for first use in this project.
         """
@@ -29,16 +76,68 @@ class Chrome(BaseProgram):
                     "The instructions can be found at: https://github.com/dorukkilitcioglu/persistd#getting-started\n"
                     )
         print(warnings)
+        if SETTINGS.chrome_extension_id:
+            install_host(SETTINGS.chrome_extension_id)
+
+    def get_url(self, action, **options):
+        return BASE_URL % (self.project_name, action) + ''.join('&%s=%s' % item for item in options.items())
 
-    def get_url(self, action):
-        return BASE_URL % (self.project_name, action)
+    def get_restore_options(self):
+        """ How the extension restores the tabs, and unloads the idle ones
+
+        Returns:
+            options::dict
+                The `restore_mode`, `max_loading_tabs` and `discard_after`
+        """
+        restore_mode = self.restore_mode or SETTINGS.chrome_restore_mode
+        if restore_mode not in RESTORE_MODES:
+            logger.warning("Unknown Chrome restore mode %s, using lazy instead", restore_mode)
+            restore_mode = 'lazy'
+        return {'restore_mode': restore_mode,
+                'max_loading_tabs': max(SETTINGS.chrome_max_loading_tabs, 1),
+                'discard_after': SETTINGS.chrome_discard_after}
+
+    def _send(self, action, **options):
+        """ Sends an action to the extension through the native host, and
+        waits until it completed
+
+        Returns:
+            success::bool
+                Whether the action succeeded, or None if the extension
+                isn't connected to the host
+        """
+        client = ChromeHostClient.connect()
+        if client is None:
+            return None
+        try:
+            with client:
+                response = client.request(action, self.project_name, **options)
+        except NativeMessagingError as err:
+            logger.error("Chrome could not %s: %s", action, err)
+            return False
+        if response.get('tabs') is not None:
+            self.tabs = response['tabs']
+        return True
+
+    def _open_url(self, action):
+        """ Sends an action to the extension by opening a URL that it
+        intercepts, for when it isn't connected to the host
+        """
+        return_code, _, _ = run_on_command_line([SETTINGS.chrome_path, "--new-window", self.get_url(action)])
+        return return_code == 0
 
     def start(self):
         """ Starts a new instance of this program
         """
-        pid = self.desktop.launch_program([SETTINGS.chrome_path, "--new-window", self.get_url('start')],
-                                          open_async=True, sleep=2, max_tries=0)
-        if pid is not None:
+        options = self.get_restore_options()
+        started = self._send('start', **options)
+        if started is None:
+            url = self.get_url('start', **options)
+            pid = self.desktop.launch_program([SETTINGS.chrome_path, "--new-window", url],
+                                              open_async=True, max_tries=0, wait_for_new_window=True,
+                                              window_class=WINDOW_CLASS)
+            started = pid is not None
+        if started:
             logger.info("Started Chrome.")
             return True
         else:
@@ -48,8 +147,10 @@ class Chrome(BaseProgram):
     def persist(self):
         """ Persists the state without closing
         """
-        return_code, _, _ = run_on_command_line([SETTINGS.chrome_path, "--new-window", self.get_url('persist')])
-        if return_code is 0:
+        persisted = self._send('persist')
+        if persisted is None:
+            persisted = self._open_url('persist')
+        if persisted:
             logger.info("Persisted Chrome window")
             return True
         else:
@@ -59,8 +160,10 @@ class Chrome(BaseProgram):
     def close(self):
         """ Closes the program, persisting the state
         """
-        return_code, _, _ = run_on_command_line([SETTINGS.chrome_path, "--new-window", self.get_url('close')])
-        if return_code is 0:
+        closed = self._send('close')
+        if closed is None:
+            closed = self._open_url('close')
+        if closed:
             logger.info("Closed Chrome window")
             return True
         else:
@@ -71,22 +174,12 @@ class Chrome(BaseProgram):
         """ Deletes all info regarding this program from the project
         """
         shutil.rmtree(self.persist_path)
-        return_code, _, _ = run_on_command_line([SETTINGS.chrome_path, "--new-window", self.get_url('destroy')])
-        if return_code is 0:
+        destroyed = self._send('destroy')
+        if destroyed is None:
+            destroyed = self._open_url('destroy')
+        if destroyed:
             logger.info("Destroyed Chrome storage for this project")
             return True
         else:
             logger.error("Could not destroy Chrome storage for this project")
             return False
-
-    def save(self, path=None):
-        """ Saves the variables to json
-        """
-        path = path or self.object_persist_path
-        save_dict_to_json(self, path, ['desktop'])
-
-    def load(self, path=None):
-        """ Loads variables from json
-        """
-        path = path or self.object_persist_path
-        load_dict_from_json(self, path)
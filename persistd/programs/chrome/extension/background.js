@@ -1,23 +1,168 @@
 // Example URL to test stuff:
-// http://idontthinkthis.domainwilleverexist?project_name=proh_joo&action=start
+// http://idontthinkthis.domainwilleverexist?project_name=proh_joo&action=start&restore_mode=lazy
+
+// The page that stands in for a tab until it is loaded
+const PLACEHOLDER_URL = chrome.runtime.getURL('placeholder.html');
+// The # of milliseconds after which a tab that is still loading stops holding up the next wave
+const TAB_LOAD_TIMEOUT = 30 * 1000;
+// The # of milliseconds between checks for idle tabs
+const DISCARD_CHECK_INTERVAL = 60 * 1000;
+
+// How the tabs of a project are restored, as sent by persistd:
+// restore_mode is 'eager', 'lazy' or 'waves', max_loading_tabs bounds the
+// waves, and discard_after is the # of minutes after which idle tabs are
+// unloaded, or 0 to never unload them
+var restoreOptions = {restore_mode: 'eager', max_loading_tabs: 4, discard_after: 0};
+
+// tabId -> the time the tab was last looked at
+var lastActive = {};
+// windowId -> the # of milliseconds after which its idle tabs are unloaded
+var discardPolicies = {};
+
+// The URL that a tab is restored with: either the tab itself, or a
+// placeholder that loads it once it is looked at
+function restoreUrl(url, options) {
+    if(options.restore_mode == 'eager') {
+        return url;
+    }
+    return PLACEHOLDER_URL + '#' + encodeURIComponent(url);
+}
+
+// The URL of a tab, or the URL a placeholder tab stands in for
+function realUrl(url) {
+    if(url && url.startsWith(PLACEHOLDER_URL + '#')) {
+        return decodeURIComponent(url.slice(PLACEHOLDER_URL.length + 1));
+    }
+    return url;
+}
+
+// Calls callback once a tab has loaded, was closed, or took too long
+function waitUntilLoaded(tabId, callback) {
+    var done = false;
+    function finish() {
+        if(!done) {
+            done = true;
+            clearTimeout(timer);
+            chrome.tabs.onUpdated.removeListener(onUpdated);
+            chrome.tabs.onRemoved.removeListener(onRemoved);
+            callback();
+        }
+    }
+    function onUpdated(id, changeInfo, tab) {
+        if(id == tabId && changeInfo.status == 'complete' && realUrl(tab.url) == tab.url) {
+            finish();
+        }
+    }
+    function onRemoved(id) {
+        if(id == tabId) {
+            finish();
+        }
+    }
+    var timer = setTimeout(finish, TAB_LOAD_TIMEOUT);
+    chrome.tabs.onUpdated.addListener(onUpdated);
+    chrome.tabs.onRemoved.addListener(onRemoved);
+}
+
+// Loads placeholder tabs, at most maxLoading of them at the same time
+function loadInWaves(tabIds, urls, maxLoading) {
+    var next = 0;
+    var loading = 0;
+    function loadNext() {
+        while(loading < maxLoading && next < tabIds.length) {
+            var tabId = tabIds[next];
+            var url = urls[next];
+            next++;
+            loading++;
+            waitUntilLoaded(tabId, function() {
+                loading--;
+                loadNext();
+            });
+            chrome.tabs.update(tabId, {url: url}, function() {
+                if(chrome.runtime.lastError) {
+                    console.log('Could not load tab: ' + chrome.runtime.lastError.message);
+                }
+            });
+        }
+    }
+    loadNext();
+}
+
+// Applies the restore options to the tabs of a new project window. The
+// first tab is the active one, and is loaded right away
+function restoreTabs(windowId, tabIds, urls, options) {
+    if(options.restore_mode == 'waves') {
+        loadInWaves(tabIds.slice(1), urls.slice(1), Math.max(options.max_loading_tabs, 1));
+    }
+    if(options.discard_after > 0) {
+        discardPolicies[windowId] = options.discard_after * 60 * 1000;
+    }
+}
+
+// Unloads the tabs of project windows that weren't looked at for a while
+function discardIdleTabs() {
+    var now = Date.now();
+    Object.keys(discardPolicies).forEach(function(windowId) {
+        var discardAfter = discardPolicies[windowId];
+        chrome.tabs.query({windowId: Number(windowId), active: false, discarded: false, audible: false},
+                          function(tabs) {
+            if(chrome.runtime.lastError) {
+                return;
+            }
+            tabs.forEach(function(tab) {
+                if(!(tab.id in lastActive)) {
+                    // start counting from when the tab was first seen
+                    lastActive[tab.id] = now;
+                } else if(now - lastActive[tab.id] > discardAfter) {
+                    chrome.tabs.discard(tab.id, function() {
+                        if(chrome.runtime.lastError) {
+                            console.log('Could not discard tab: ' + chrome.runtime.lastError.message);
+                        }
+                    });
+                }
+            });
+        });
+    });
+}
+
+chrome.tabs.onActivated.addListener(function(activeInfo) { lastActive[activeInfo.tabId] = Date.now(); });
+chrome.tabs.onRemoved.addListener(function(tabId) { delete lastActive[tabId]; });
+chrome.tabs.onReplaced.addListener(function(addedTabId, removedTabId) {
+    if(lastActive[removedTabId] != undefined) {
+        lastActive[addedTabId] = lastActive[removedTabId];
+        delete lastActive[removedTabId];
+    }
+});
+chrome.windows.onRemoved.addListener(function(windowId) { delete discardPolicies[windowId]; });
+setInterval(discardIdleTabs, DISCARD_CHECK_INTERVAL);
 
 // Launches the tabs associated with a project and saved the windowId
 function launchTabs(project) {
     project = project[projectName];
-    if(project && project.tabs) {
-        for(i=0; i < project.tabs.length; i++) {
-            tabUrl = project.tabs[i];
-            if(i==0) {
-                chrome.tabs.update(tabId, { url: tabUrl}, function(tab) { console.log('Successfully updated'); });
-            } else {
-                chrome.tabs.create({
-                    windowId: windowId,
-                    url: tabUrl
-                }, function(tab) { console.log('Created tab for: ' + tab.url)});
-            }
+    var options = restoreOptions;
+    if(project && project.tabs && project.tabs.length) {
+        var tabIds = [tabId];
+        chrome.tabs.update(tabId, { url: project.tabs[0]}, function(tab) { console.log('Successfully updated'); });
+        var created = 1;
+        for(i=1; i < project.tabs.length; i++) {
+            chrome.tabs.create({
+                windowId: windowId,
+                index: i,
+                active: false,
+                url: restoreUrl(project.tabs[i], options)
+            }, function(tab) {
+                tabIds[tab.index] = tab.id;
+                created++;
+                if(created == project.tabs.length) {
+                    restoreTabs(windowId, tabIds, project.tabs, options);
+                }
+            });
+        }
+        if(project.tabs.length == 1) {
+            restoreTabs(windowId, tabIds, project.tabs, options);
         }
     } else {
         chrome.tabs.update(tabId, { url: 'https:///www.google.com/'}, function(tab) { console.log('Successfully updated'); });
+        restoreTabs(windowId, [tabId], [], options);
     }
     obj = {};
     newProjectObject = {windowId: windowId};
@@ -25,7 +170,10 @@ function launchTabs(project) {
         newProjectObject['tabs'] = project.tabs;
     }
     obj[projectName] = newProjectObject;
-    chrome.storage.local.set(obj, function() { console.log('Saved windowId'); });
+    chrome.storage.local.set(obj, function() {
+        console.log('Saved windowId');
+        trackWindow(projectName, windowId);
+    });
 }
 
 // Starts a new instance of this program
@@ -36,14 +184,7 @@ function start(windowId) {
 
 // Saves the tabs, closes the triggering tab, and closes the window
 function saveTabs(tabs) {
-    tabUrls = []
-    for(i in tabs) {
-        tab = tabs[i];
-        if(tab.url && !tab.url.startsWith('http://idontthinkthis.domainwilleverexist')) {
-            tabUrls.push(tab.url);
-            console.log('Saved tab: ' + tab.url);
-        }
-    }
+    tabUrls = getTabUrls(tabs);
     obj = {};
     if(should_close) {
         obj[projectName] = {tabs: tabUrls};
@@ -122,6 +263,12 @@ chrome.webRequest.onBeforeRequest.addListener(
             matches = details.url.match("project_name=([^&]*)&action=([^&]*)");
             projectName = matches[1]
             action = matches[2]
+            var params = new URL(details.url).searchParams;
+            restoreOptions = {
+                restore_mode: params.get('restore_mode') || 'eager',
+                max_loading_tabs: Number(params.get('max_loading_tabs') || 4),
+                discard_after: Number(params.get('discard_after') || 0)
+            };
             tabId = details.tabId;
             chrome.tabs.get(tabId, launchAction);
         }
@@ -132,3 +279,336 @@ chrome.webRequest.onBeforeRequest.addListener(
     },
     ["blocking"]
 );
+
+// The native messaging host of persistd, see native_host.py
+const HOST_NAME = 'com.persistd.chrome';
+// The # of milliseconds to wait before connecting to the host again
+const RECONNECT_DELAY = 60 * 1000;
+
+// The # of milliseconds that tab changes are collected for before they are synced
+const SYNC_DELAY = 1000;
+
+// The connection to the host, or null if there is none
+var hostPort = null;
+
+// Keeps the extension connected to persistd. persistd sends it
+// {id, action, project} messages, each of which is acknowledged with
+// {id, ok, tabs, error} once the action is completed.
+function connectHost() {
+    var port = chrome.runtime.connectNative(HOST_NAME);
+    hostPort = port;
+    // the host only knows the tabs that are synced from now on
+    Object.keys(projectStates).forEach(function(name) {
+        projectStates[name].reset = true;
+        scheduleSync(name);
+    });
+    port.onMessage.addListener(function(message) {
+        runHostAction(message, function(response) {
+            response.id = message.id;
+            port.postMessage(response);
+        });
+    });
+    port.onDisconnect.addListener(function() {
+        // e.g. the host isn't installed yet
+        console.log('Disconnected from the host: ' + (chrome.runtime.lastError ? chrome.runtime.lastError.message : ''));
+        hostPort = null;
+        setTimeout(connectHost, RECONNECT_DELAY);
+    });
+}
+
+// windowId -> the name of the project in the window
+var windowProjects = {};
+// project name -> the tabs of its window, kept up to date from tab events:
+// {windowId, tabs: {tabId: {index, url}}, changed: {tabId: true},
+//  removed: {tabId: true}, reset, reindex, timer}
+var projectStates = {};
+
+// Starts keeping the tabs of a project window up to date
+function trackWindow(name, windowId) {
+    windowProjects[windowId] = name;
+    projectStates[name] = {windowId: windowId, tabs: {}, changed: {}, removed: {}, reset: true, reindex: true,
+                           timer: null};
+    scheduleSync(name);
+}
+
+// Stops keeping the tabs of a window up to date, e.g. once it is closed
+function untrackWindow(windowId) {
+    var name = windowProjects[windowId];
+    if(name != undefined) {
+        clearTimeout(projectStates[name].timer);
+        delete projectStates[name];
+        delete windowProjects[windowId];
+    }
+}
+
+// The state of the project in a window, if there is one
+function windowState(windowId) {
+    var name = windowProjects[windowId];
+    return name == undefined ? null : projectStates[name];
+}
+
+// The URLs of the tabs of a project, in order
+function trackedUrls(state) {
+    var tabs = Object.keys(state.tabs).map(function(tabId) { return state.tabs[tabId]; });
+    tabs.sort(function(a, b) { return a.index - b.index; });
+    return getTabUrls(tabs);
+}
+
+// Syncs a project once its tabs stop changing for a moment
+function scheduleSync(name) {
+    var state = projectStates[name];
+    if(state && state.timer == null) {
+        state.timer = setTimeout(function() { syncProject(name); }, SYNC_DELAY);
+    }
+}
+
+// Notes that tabs were added, removed or moved in a window, which shifts
+// the indices of the other tabs, so they are looked up again on sync
+function windowChanged(windowId) {
+    var state = windowState(windowId);
+    if(state) {
+        state.reindex = true;
+        scheduleSync(windowProjects[windowId]);
+    }
+}
+
+// Notes that a tab navigated somewhere else
+function tabUpdated(tab) {
+    var state = windowState(tab.windowId);
+    if(!state) {
+        return;
+    }
+    var entry = state.tabs[tab.id];
+    var url = realUrl(tab.url);
+    if(!entry) {
+        windowChanged(tab.windowId);
+    } else if(entry.url != url) {
+        entry.url = url;
+        state.changed[tab.id] = true;
+        scheduleSync(windowProjects[tab.windowId]);
+    }
+}
+
+// Writes the tabs of a project to storage, and sends the ones that changed
+// since the last sync to the host. Calls callback once it is done
+function syncProject(name, callback) {
+    var state = projectStates[name];
+    if(!state) {
+        return callback && callback();
+    }
+    clearTimeout(state.timer);
+    state.timer = null;
+    if(!state.reindex) {
+        return writeSync(name, state, callback);
+    }
+    state.reindex = false;
+    chrome.tabs.query({windowId: state.windowId}, function(tabs) {
+        if(chrome.runtime.lastError) {
+            return callback && callback();
+        }
+        var seen = {};
+        tabs.forEach(function(tab) {
+            seen[tab.id] = true;
+            var entry = state.tabs[tab.id];
+            var url = realUrl(tab.url || tab.pendingUrl);
+            if(!entry || entry.index != tab.index || entry.url != url) {
+                state.tabs[tab.id] = {index: tab.index, url: url};
+                state.changed[tab.id] = true;
+            }
+        });
+        Object.keys(state.tabs).forEach(function(tabId) {
+            if(!seen[tabId]) {
+                delete state.tabs[tabId];
+                delete state.changed[tabId];
+                state.removed[tabId] = true;
+            }
+        });
+        writeSync(name, state, callback);
+    });
+}
+
+function writeSync(name, state, callback) {
+    var changed = Object.keys(state.changed);
+    var removed = Object.keys(state.removed);
+    if(!state.reset && changed.length == 0 && removed.length == 0) {
+        return callback && callback();
+    }
+    var delta = {event: 'tabs', project: name, reset: state.reset, tabs: {}, removed: removed.map(Number)};
+    (state.reset ? Object.keys(state.tabs) : changed).forEach(function(tabId) {
+        delta.tabs[tabId] = state.tabs[tabId];
+    });
+    state.reset = false;
+    state.changed = {};
+    state.removed = {};
+    if(hostPort) {
+        hostPort.postMessage(delta);
+    }
+    var obj = {};
+    obj[name] = {windowId: state.windowId, tabs: trackedUrls(state)};
+    chrome.storage.local.set(obj, function() { callback && callback(); });
+}
+
+chrome.tabs.onCreated.addListener(function(tab) { windowChanged(tab.windowId); });
+chrome.tabs.onRemoved.addListener(function(tabId, removeInfo) {
+    // the tabs of a closing window are kept, so that they are restored next time
+    if(!removeInfo.isWindowClosing) {
+        windowChanged(removeInfo.windowId);
+    }
+});
+chrome.tabs.onMoved.addListener(function(tabId, moveInfo) { windowChanged(moveInfo.windowId); });
+chrome.tabs.onAttached.addListener(function(tabId, attachInfo) { windowChanged(attachInfo.newWindowId); });
+chrome.tabs.onDetached.addListener(function(tabId, detachInfo) { windowChanged(detachInfo.oldWindowId); });
+chrome.tabs.onUpdated.addListener(function(tabId, changeInfo, tab) {
+    if(changeInfo.url) {
+        tabUpdated(tab);
+    }
+});
+// Discarding or prerendering a tab replaces it with a tab with a new id
+chrome.tabs.onReplaced.addListener(function(addedTabId, removedTabId) {
+    Object.keys(projectStates).forEach(function(name) {
+        var state = projectStates[name];
+        if(state.tabs[removedTabId]) {
+            state.tabs[addedTabId] = state.tabs[removedTabId];
+            delete state.tabs[removedTabId];
+            delete state.changed[removedTabId];
+            state.removed[removedTabId] = true;
+            state.changed[addedTabId] = true;
+            scheduleSync(name);
+        }
+    });
+});
+chrome.windows.onRemoved.addListener(function(windowId) {
+    var name = windowProjects[windowId];
+    if(name != undefined) {
+        syncProject(name, function() {
+            untrackWindow(windowId);
+            // the sync saves the id of the window, which is gone now
+            chrome.storage.local.get(name, function(items) {
+                var project = items[name];
+                if(project && project.windowId == windowId) {
+                    var obj = {};
+                    obj[name] = {tabs: project.tabs || []};
+                    chrome.storage.local.set(obj);
+                }
+            });
+        });
+    }
+});
+
+// Picks up the project windows that were open before the extension started
+function trackOpenProjects() {
+    chrome.storage.local.get(null, function(items) {
+        Object.keys(items).forEach(function(name) {
+            var windowId = items[name] && items[name].windowId;
+            if(windowId != undefined) {
+                chrome.windows.get(windowId, function() {
+                    if(!chrome.runtime.lastError) {
+                        trackWindow(name, windowId);
+                    }
+                });
+            }
+        });
+    });
+}
+
+// The URLs of the tabs that are worth saving. Tabs that weren't
+// loaded yet are saved with the URL they stand in for
+function getTabUrls(tabs) {
+    var tabUrls = [];
+    for(var i = 0; i < tabs.length; i++) {
+        var url = realUrl(tabs[i].url);
+        if(url && !url.startsWith('http://idontthinkthis.domainwilleverexist')) {
+            tabUrls.push(url);
+        }
+    }
+    return tabUrls;
+}
+
+// Runs an action sent by the host, and calls respond once it is done
+function runHostAction(message, respond) {
+    var name = message.project;
+    function fail(error) {
+        console.log('Could not ' + message.action + ' ' + name + ': ' + error);
+        respond({ok: false, tabs: null, error: error});
+    }
+    var state = projectStates[name];
+    if(state && ['persist', 'close', 'destroy'].indexOf(message.action) >= 0) {
+        // the tabs are already up to date, so there is nothing to look up
+        var windowId = state.windowId;
+        syncProject(name, function() {
+            var tabUrls = trackedUrls(state);
+            function done() {
+                respond({ok: true, tabs: tabUrls, error: null});
+            }
+            if(message.action == 'persist') {
+                return done();
+            }
+            untrackWindow(windowId);
+            function closeWindow() {
+                chrome.windows.remove(windowId, done);
+            }
+            if(message.action == 'close') {
+                var obj = {};
+                obj[name] = {tabs: tabUrls};
+                chrome.storage.local.set(obj, closeWindow);
+            } else {
+                chrome.storage.local.remove(name, closeWindow);
+            }
+        });
+        return;
+    }
+    chrome.storage.local.get(name, function(items) {
+        var project = items[name] || {};
+        if(message.action == 'start') {
+            var tabs = project.tabs && project.tabs.length ? project.tabs : ['https://www.google.com/'];
+            var urls = tabs.map(function(url, i) { return i == 0 ? url : restoreUrl(url, message); });
+            chrome.windows.create({url: urls}, function(window) {
+                if(chrome.runtime.lastError) {
+                    return fail(chrome.runtime.lastError.message);
+                }
+                restoreTabs(window.id, window.tabs.map(function(tab) { return tab.id; }), tabs, message);
+                trackWindow(name, window.id);
+                var obj = {};
+                obj[name] = {windowId: window.id, tabs: project.tabs || []};
+                chrome.storage.local.set(obj, function() {
+                    respond({ok: true, tabs: obj[name].tabs, error: null});
+                });
+            });
+        } else if(['persist', 'close', 'destroy'].indexOf(message.action) >= 0) {
+            if(project.windowId == undefined) {
+                if(message.action == 'destroy') {
+                    chrome.storage.local.remove(name, function() { respond({ok: true, tabs: [], error: null}); });
+                    return;
+                }
+                return fail("can't find any window for this project");
+            }
+            chrome.tabs.query({windowId: project.windowId}, function(tabs) {
+                if(chrome.runtime.lastError) {
+                    return fail(chrome.runtime.lastError.message);
+                }
+                var tabUrls = getTabUrls(tabs);
+                function done() {
+                    respond({ok: true, tabs: tabUrls, error: null});
+                }
+                function closeWindow() {
+                    chrome.windows.remove(project.windowId, done);
+                }
+                var obj = {};
+                if(message.action == 'persist') {
+                    obj[name] = {windowId: project.windowId, tabs: tabUrls};
+                    chrome.storage.local.set(obj, done);
+                } else if(message.action == 'close') {
+                    obj[name] = {tabs: tabUrls};
+                    chrome.storage.local.set(obj, closeWindow);
+                } else {
+                    chrome.storage.local.remove(name, closeWindow);
+                }
+            });
+        } else {
+            fail('not a valid action');
+        }
+    });
+}
+
+trackOpenProjects();
+connectHost();
@@ -0,0 +1,13 @@
+// Stands in for a tab that isn't loaded yet, and loads it once it is looked at.
+// The URL of the tab is in the hash, e.g. placeholder.html#https%3A%2F%2Fgithub.com%2F
+var url = decodeURIComponent(location.hash.slice(1));
+document.title = url;
+
+function loadIfVisible() {
+    if(document.visibilityState == 'visible') {
+        location.replace(url);
+    }
+}
+
+document.addEventListener('visibilitychange', loadIfVisible);
+loadIfVisible();
@@ -0,0 +1,424 @@
+""" The native messaging host that connects persistd to its Chrome
+extension.
+
+The extension starts the host with `chrome.runtime.connectNative` and
+keeps it connected. They talk over the stdin and stdout of the host, in
+json messages that are each prefixed by their length as a 4 byte integer
+in native byte order:
+
+    -> {'id': 1, 'action': 'close', 'project': 'my_project'}
+    <- {'id': 1, 'ok': True, 'tabs': ['https://github.com/'], 'error': None}
+
+persistd sends its commands to the host over a Unix domain socket (a
+named pipe on Windows), and the host relays them to the extension and
+the acknowledgements back, once the extension has actually completed
+the command.
+
+The extension also keeps the host up to date with the tabs of the open
+projects. Whenever tabs change, it sends the changed and removed tabs,
+or all of them after it (re)connects:
+
+    <- {'event': 'tabs', 'project': 'my_project', 'reset': False,
+        'tabs': {'12': {'index': 0, 'url': 'https://github.com/'}}, 'removed': [13]}
+
+which the host writes to `.persistd/chrome/tabs.json` in the project.
+
+Chrome runs the host through a manifest that is registered for the
+browser, see `install_host`.
+"""
+import getpass
+import itertools
+import json
+import logging
+import os
+import platform
+import secrets
+import shutil
+import stat
+import struct
+import sys
+import threading
+
+from persistd.util.daemon import address_family, connect_with_key
+from persistd.util.paths import CODE_PATH, PERSISTD_PATH, PROGRAMS_PATH
+from persistd.util.savers import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# The name the extension connects to
+HOST_NAME = 'com.persistd.chrome'
+
+# The folder with the manifest, launcher, key and log of the host
+HOST_PATH = os.path.join(PROGRAMS_PATH, 'chrome')
+
+# Chrome doesn't accept larger messages from a host
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+# Where Chrome looks for the manifests of hosts on Linux and macOS
+MANIFEST_DIRS = {
+    'Linux': ['~/.config/google-chrome/NativeMessagingHosts', '~/.config/chromium/NativeMessagingHosts'],
+    'Darwin': ['~/Library/Application Support/Google/Chrome/NativeMessagingHosts',
+               '~/Library/Application Support/Chromium/NativeMessagingHosts'],
+}
+
+# The registry key Chrome looks up the manifests of hosts in on Windows
+REGISTRY_KEY = 'Software\\Google\\Chrome\\NativeMessagingHosts\\' + HOST_NAME
+
+
+class NativeMessagingError(Exception):
+    pass
+
+
+def read_message(stream):
+    """ Reads a message from a binary stream
+
+    Returns:
+        message::dict
+            The message, or None if the stream was closed
+    """
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    length = struct.unpack('=I', header)[0]
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def write_message(stream, message):
+    """ Writes a message to a binary stream
+    """
+    data = json.dumps(message).encode('utf-8')
+    if len(data) > MAX_MESSAGE_SIZE:
+        raise NativeMessagingError("Message of %d bytes is too large" % len(data))
+    stream.write(struct.pack('=I', len(data)) + data)
+    stream.flush()
+
+
+def get_host_address():
+    """ Returns the address the host of the current user listens on
+    """
+    if platform.system() == 'Windows':
+        return r'\\.\pipe\persistd-chrome-%s' % getpass.getuser()
+    return os.path.join(PERSISTD_PATH, 'chrome.sock')
+
+
+def get_key_path():
+    return os.path.join(HOST_PATH, 'host.key')
+
+
+def get_project_tabs_path(project_name):
+    """ Returns the file that the tabs of a project are synced to, or
+    None if there is no such persistd project
+    """
+    from persistd.util.settings import SETTINGS
+
+    SETTINGS.refresh()
+    persister_folder_path = os.path.join(SETTINGS.base_path, project_name, '.persistd')
+    if not os.path.isdir(persister_folder_path):
+        return None
+    return os.path.join(persister_folder_path, 'chrome', 'tabs.json')
+
+
+class NativeHost:
+
+    def __init__(self, stdin, stdout, address=None, key_path=None, timeout=30.0, get_tabs_path=None):
+        """ Initializes the host. It starts relaying in `serve_forever`.
+
+        Args:
+            stdin::binary stream
+                The messages from the extension
+            stdout::binary stream
+                The messages to the extension
+            address::str
+                The socket path or pipe name that persistd connects to.
+                If None, uses `get_host_address`.
+            key_path::str
+                The file to write the authentication key of persistd to
+            timeout::float
+                The max # of seconds the extension may take to complete
+                a command
+            get_tabs_path::callable
+                Returns the file that the tabs of a project are written
+                to, or None if it isn't a persistd project. If None, uses
+                `get_project_tabs_path`.
+        """
+        self.stdin = stdin
+        self.stdout = stdout
+        self.address = address or get_host_address()
+        self.key_path = key_path or get_key_path()
+        self.timeout = timeout
+        self.get_tabs_path = get_tabs_path or get_project_tabs_path
+        # project name -> tab id -> {'index': int, 'url': str}
+        self.project_tabs = {}
+        self._ids = itertools.count(1)
+        # message id -> [event, response]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._listener = None
+        self._key = None
+        self._running = False
+
+    def request(self, message):
+        """ Sends a command to the extension and waits for it to complete
+
+        Returns:
+            response::dict
+                The acknowledgement of the extension
+        """
+        message_id = next(self._ids)
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self._pending[message_id] = waiter
+        try:
+            with self._write_lock:
+                write_message(self.stdout, dict(message, id=message_id))
+            if not waiter[0].wait(self.timeout):
+                raise NativeMessagingError("Chrome did not complete %s in %.1fs" % (message.get('action'),
+                                                                                     self.timeout))
+        finally:
+            with self._lock:
+                self._pending.pop(message_id, None)
+        if waiter[1] is None:
+            raise NativeMessagingError("The Chrome extension disconnected")
+        return waiter[1]
+
+    def _receive(self, message):
+        if message.get('event') == 'tabs':
+            self._sync_tabs(message)
+            return
+        with self._lock:
+            waiter = self._pending.get(message.get('id'))
+        if waiter is None:
+            logger.warning("Unexpected message from the extension: %s", message)
+            return
+        waiter[1] = message
+        waiter[0].set()
+
+    def _sync_tabs(self, delta):
+        """ Applies the tabs that changed in a project, and writes them
+        """
+        project_name = delta['project']
+        tabs = {} if delta.get('reset') else self.project_tabs.get(project_name, {})
+        tabs.update(delta.get('tabs', {}))
+        for tab_id in delta.get('removed', []):
+            tabs.pop(str(tab_id), None)
+        self.project_tabs[project_name] = tabs
+        tabs_path = self.get_tabs_path(project_name)
+        if tabs_path is None:
+            return
+        urls = [tab['url'] for tab in sorted(tabs.values(), key=lambda tab: tab['index']) if tab.get('url')]
+        try:
+            atomic_write(tabs_path, json.dumps({'tabs': urls}))
+        except OSError:
+            logger.exception("Could not write the tabs of %s", project_name)
+
+    def serve_forever(self):
+        """ Relays commands until the extension disconnects
+        """
+        from multiprocessing.connection import Listener
+
+        if address_family(self.address) == 'AF_UNIX':
+            os.makedirs(os.path.dirname(self.address), exist_ok=True)
+            if os.path.exists(self.address):
+                # left over from a host that didn't exit cleanly
+                os.remove(self.address)
+        self._key = secrets.token_bytes(32)
+        self._listener = Listener(self.address, family=address_family(self.address), authkey=self._key)
+        atomic_write(self.key_path, self._key.hex())
+        self._running = True
+        accept_thread = threading.Thread(target=self._accept_clients, daemon=True)
+        accept_thread.start()
+        logger.info("persistd Chrome host listening on %s", self.address)
+        try:
+            while True:
+                message = read_message(self.stdin)
+                if message is None:
+                    break
+                self._receive(message)
+        finally:
+            logger.info("The Chrome extension disconnected")
+            self._running = False
+            # fails the commands that are still waiting
+            with self._lock:
+                for waiter in self._pending.values():
+                    waiter[0].set()
+            if os.path.exists(self.key_path):
+                os.remove(self.key_path)
+            self._wake_up()
+            accept_thread.join(self.timeout)
+
+    def _accept_clients(self):
+        from multiprocessing.connection import AuthenticationError
+
+        try:
+            while self._running:
+                try:
+                    connection = self._listener.accept()
+                except (OSError, AuthenticationError) as err:
+                    logger.warning("Could not accept a client: %s", err)
+                    continue
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            self._listener.close()
+
+    def _serve_connection(self, connection):
+        with connection:
+            while self._running:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    response = self.request(message)
+                except NativeMessagingError as err:
+                    response = {'ok': False, 'error': str(err)}
+                connection.send(response)
+
+    def _wake_up(self):
+        """ Unblocks the listener, which is waiting for the next client
+        """
+        from multiprocessing.connection import Client
+
+        try:
+            Client(self.address, family=address_family(self.address), authkey=self._key).close()
+        except OSError:
+            pass
+
+
+class ChromeHostClient:
+
+    def __init__(self, connection):
+        """ Initializes a client over an open connection. Use `connect`
+        to connect to a running host.
+        """
+        self._connection = connection
+
+    @classmethod
+    def connect(cls, address=None, key_path=None):
+        """ Connects to the host
+
+        Returns:
+            client::ChromeHostClient
+                The client, or None if the extension isn't connected
+        """
+        connection = connect_with_key(address or get_host_address(), key_path or get_key_path())
+        return cls(connection) if connection is not None else None
+
+    def request(self, action, project_name, **options):
+        """ Sends a command to the extension and waits until it completed
+
+        Args:
+            action::str
+                One of start, persist, close and destroy
+            project_name::str
+                The name of the project
+            options::dict
+                Extra options of the action, e.g. `restore_mode`
+
+        Returns:
+            response::dict
+                The acknowledgement of the extension, e.g. with the `tabs`
+                of the project
+
+        Raises:
+            NativeMessagingError
+                If the command failed
+        """
+        try:
+            self._connection.send(dict(options, action=action, project=project_name))
+            response = self._connection.recv()
+        except (EOFError, OSError) as err:
+            raise NativeMessagingError("Lost the connection to the Chrome host: %s" % err)
+        if not response.get('ok'):
+            raise NativeMessagingError(response.get('error') or "Chrome could not %s" % action)
+        return response
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_host_files(extension_id, python=sys.executable):
+    """ Writes the launcher and the manifest of the host
+
+    Args:
+        extension_id::str
+            The id of the persistd extension, which is the only one
+            that may connect to the host
+        python::str
+            The python executable that runs the host
+
+    Returns:
+        manifest_path::str
+            The path to the manifest
+    """
+    root_path = os.path.dirname(CODE_PATH)
+    if platform.system() == 'Windows':
+        launcher_path = os.path.join(HOST_PATH, 'native_host.bat')
+        launcher = '@echo off\r\ncd /d "%s"\r\n"%s" -m persistd.programs.chrome.native_host %%*\r\n' % (root_path,
+                                                                                                       python)
+    else:
+        launcher_path = os.path.join(HOST_PATH, 'native_host.sh')
+        launcher = '#!/bin/sh\ncd "%s" && exec "%s" -m persistd.programs.chrome.native_host "$@"\n' % (root_path,
+                                                                                                      python)
+    atomic_write(launcher_path, launcher.encode('utf-8'))
+    os.chmod(launcher_path, os.stat(launcher_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    manifest = {'name': HOST_NAME,
+                'description': 'persistd',
+                'path': launcher_path,
+                'type': 'stdio',
+                'allowed_origins': ['chrome-extension://%s/' % extension_id]}
+    manifest_path = os.path.join(HOST_PATH, '%s.json' % HOST_NAME)
+    atomic_write(manifest_path, json.dumps(manifest, indent=4))
+    return manifest_path
+
+
+def register_host(manifest_path):
+    """ Lets Chrome find the manifest of the host
+    """
+    if platform.system() == 'Windows':
+        import winreg
+        with winreg.CreateKey(winreg.HKEY_CURRENT_USER, REGISTRY_KEY) as key:
+            winreg.SetValue(key, '', winreg.REG_SZ, manifest_path)
+        return
+    for manifest_dir in MANIFEST_DIRS.get(platform.system(), []):
+        manifest_dir = os.path.expanduser(manifest_dir)
+        # only for the browsers that are installed
+        if os.path.isdir(os.path.dirname(manifest_dir)):
+            os.makedirs(manifest_dir, exist_ok=True)
+            shutil.copyfile(manifest_path, os.path.join(manifest_dir, os.path.basename(manifest_path)))
+
+
+def install_host(extension_id):
+    """ Installs the host for the persistd extension with the given id
+    """
+    manifest_path = write_host_files(extension_id)
+    register_host(manifest_path)
+    logger.info("Installed the Chrome host %s", manifest_path)
+    return manifest_path
+
+
+def main():
+    # stdout belongs to the extension, so log to a file
+    os.makedirs(HOST_PATH, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(HOST_PATH, 'host.log'), level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if platform.system() == 'Windows':
+        import msvcrt
+        msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+    from persistd.util.settings import SETTINGS
+    NativeHost(sys.stdin.buffer, sys.stdout.buffer, timeout=SETTINGS.program_timeout).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
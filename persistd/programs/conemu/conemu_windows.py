@@ -4,8 +4,6 @@ import shutil
 
 from persistd.util.settings import SETTINGS
 from persistd.util.command_line import run_on_command_line
-from persistd.util.paths import CODE_PATH, PROGRAMS_PATH
-from persistd.util.savers import copy_file, save_dict_to_json, load_dict_from_json
 
 from persistd.programs.base_program import BaseProgram
 
@@ -13,6 +11,8 @@ logger = logging.getLogger(__name__)
 
 
 class ConEmuWindows(BaseProgram):
+    TRACKS_CHANGES = True
+    TEMPLATE_FOLDER = 'conemu'
 
     # The process id of ConEmu instance
     conemu_pid = None
@@ -29,6 +29,12 @@ class ConEmuWindows(BaseProgram):
         """
         return os.path.join(self.persist_path, self.startfile_filename)
 
+    @property
+    def templates(self):
+        """ The startfile is rendered from a template
+        """
+        return {'startfile_windows.txt': self.startfile_path}
+
     @property
     def object_persist_path(self):
         """ The path where this object will be persisted
@@ -38,11 +44,7 @@ class ConEmuWindows(BaseProgram):
     def setup(self):
         """ Sets up the program for first use in this project.
         """
-        default_startfile_path = os.path.join(PROGRAMS_PATH, 'conemu', 'startfile_windows.txt')
-        # put the default in the data path
-        if not os.path.exists(default_startfile_path):
-            copy_file(os.path.join(CODE_PATH, 'programs', 'conemu', 'startfile_windows.txt'), default_startfile_path)
-        copy_file(default_startfile_path, self.startfile_path)
+        self.provision_templates()
 
     def start(self):
         """ Starts a new instance of this program
@@ -78,15 +80,3 @@ class ConEmuWindows(BaseProgram):
         """ Deletes all info regarding this program from the project
         """
         shutil.rmtree(self.persist_path)
-
-    def save(self, path=None):
-        """ Saves the variables to json
-        """
-        path = path or self.object_persist_path
-        save_dict_to_json(self, path, ['desktop'])
-
-    def load(self, path=None):
-        """ Loads variables from json
-        """
-        path = path or self.object_persist_path
-        load_dict_from_json(self, path)
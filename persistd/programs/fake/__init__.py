@@ -0,0 +1,5 @@
+from persistd.programs.fake.fake_program import FakeProgram
+
+CODE_NAME = 'fake'
+HUMAN_READABLE_NAME = 'Fake program'
+PROGRAM_CLASS = FakeProgram
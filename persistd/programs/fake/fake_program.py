@@ -0,0 +1,69 @@
+import logging
+import os
+import shutil
+
+from persistd.programs.base_program import BaseProgram
+from persistd.util.fakes import FakeBehavior
+
+logger = logging.getLogger(__name__)
+
+
+class FakeProgram(BaseProgram):
+    """ A program that is only launched on the desktop it is given, which
+    lets persistd run end to end on any OS.
+    """
+    TRACKS_CHANGES = True
+
+    # how long operations take and how often they fail, e.g. for benchmarks
+    behavior = FakeBehavior()
+
+    pid = None
+    persist_count = 0
+
+    @property
+    def object_persist_path(self):
+        """ The path where this object will be persisted
+        """
+        return os.path.join(self.persist_path, 'fake.json')
+
+    def _perform(self, operation):
+        if self.behavior.perform(operation):
+            return True
+        logger.error("Fake program failed to %s", operation)
+        return False
+
+    def setup(self):
+        """ Sets up the program for first use in this project.
+        """
+        self._perform('setup')
+
+    def start(self):
+        """ Starts a new instance of this program
+        """
+        if not self._perform('start'):
+            return False
+        self.pid = self.desktop.launch_program(['fake', self.project_path], open_async=True)
+        return self.pid is not None
+
+    def persist(self):
+        """ Persists the state without closing
+        """
+        if not self._perform('persist'):
+            return False
+        self.persist_count += 1
+        return True
+
+    def close(self):
+        """ Closes the program, persisting the state
+        """
+        if not self._perform('close'):
+            return False
+        self.persist_count += 1
+        self.pid = None
+        return True
+
+    def destroy(self):
+        """ Deletes all info regarding this program from the project
+        """
+        if os.path.exists(self.persist_path):
+            shutil.rmtree(self.persist_path)
@@ -4,15 +4,20 @@ import shutil
 
 from persistd.util.settings import SETTINGS
 from persistd.util.command_line import run_on_command_line, kill_mutant
-from persistd.util.paths import CODE_PATH, PROGRAMS_PATH
-from persistd.util.savers import copy_file, save_dict_to_json, load_dict_from_json
+from persistd.util.exe_cache import ExecutableCache
+from persistd.util.paths import PROGRAMS_PATH
 
 from persistd.programs.base_program import BaseProgram
 
 logger = logging.getLogger(__name__)
 
+# The executables of all projects share a single copy of SublimeText
+EXE_CACHE = ExecutableCache(os.path.join(PROGRAMS_PATH, 'sublime_text', 'integrity.json'))
+
 
 class SublimeTextWindows(BaseProgram):
+    TRACKS_CHANGES = True
+    TEMPLATE_FOLDER = 'sublime_text'
 
     # The process id of the SublimeText instance
     sublime_pid = None
@@ -31,17 +36,23 @@ class SublimeTextWindows(BaseProgram):
 
     @property
     def sublime_exe_filename(self):
-        """ Filename of the copied SublimeText executable
+        """ Filename of the SublimeText executable of this project
         """
         return 'sublime_text_%s.exe' % self.project_name
 
     @property
     def sublime_exe_path(self):
-        """ Path of the copied SublimeText executable
+        """ Path of the SublimeText executable of this project
         """
         standard_exe_path = SETTINGS.sublime_text_path
         return os.path.join(os.path.dirname(standard_exe_path), self.sublime_exe_filename)
 
+    @property
+    def templates(self):
+        """ The sublime-project file is rendered from a template
+        """
+        return {'default.sublime-project': self.sublimeproj_path}
+
     @property
     def object_persist_path(self):
         """ The path where this object will be persisted
@@ -59,21 +70,22 @@ class SublimeTextWindows(BaseProgram):
                     "The instructions can be found at: https://github.com/dorukkilitcioglu/persistd#sublimetext-windows\n"
                     )
         print(warnings)
-        default_proj_path = os.path.join(PROGRAMS_PATH, 'sublime_text', 'default.sublime-project')
-        # put the default in the data path
-        if not os.path.exists(default_proj_path):
-            copy_file(os.path.join(CODE_PATH, 'programs', 'sublime_text', 'default.sublime-project'), default_proj_path)
-        copy_file(default_proj_path, self.sublimeproj_path)
-        copy_file(SETTINGS.sublime_text_path, self.sublime_exe_path)
+        self.provision_templates()
+        EXE_CACHE.link(SETTINGS.sublime_text_path, self.sublime_exe_path)
 
     def start(self):
         """ Starts a brand new instance of SublimeText
         """
-        if not os.path.exists(self.sublime_exe_path):
-            copy_file(SETTINGS.sublime_text_path, self.sublime_exe_path)
-        # TODO make this more deterministic
-        # It seems like you need some waiting before switching sublimetext
-        # So just sleep for 2 secs
+        # also updates the executable if SublimeText was updated
+        try:
+            EXE_CACHE.link(SETTINGS.sublime_text_path, self.sublime_exe_path)
+        except OSError as err:
+            if not os.path.exists(self.sublime_exe_path):
+                logger.error("Could not create the SublimeText executable: %s", err)
+                return False
+            logger.warning("Could not update the SublimeText executable: %s", err)
+        # SublimeText can only be moved once its window exists,
+        # the desktop waits for that before moving it
         pid = self.desktop.launch_program([self.sublime_exe_path, self.project_path, "--project", self.sublimeproj_path], open_async=True)
         if pid is not None:
             logger.info("Started SublimeText on path %s", self.project_path)
@@ -127,15 +139,5 @@ class SublimeTextWindows(BaseProgram):
         """
         shutil.rmtree(self.persist_path)
         os.remove(self.sublime_exe_path)
-
-    def save(self, path=None):
-        """ Saves the variables to json
-        """
-        path = path or self.object_persist_path
-        save_dict_to_json(self, path, ['desktop'])
-
-    def load(self, path=None):
-        """ Loads variables from json
-        """
-        path = path or self.object_persist_path
-        load_dict_from_json(self, path)
+        # the blob of the executable may not be used by another project
+        EXE_CACHE.remove_unused_blobs(os.path.dirname(self.sublime_exe_path))
@@ -5,12 +5,12 @@ import shutil
 from persistd.programs.base_program import BaseProgram
 from persistd.util.settings import SETTINGS
 from persistd.util.command_line import run_on_command_line
-from persistd.util.savers import save_dict_to_json, load_dict_from_json
 
 logger = logging.getLogger(__name__)
 
 
 class VSCodeWindows(BaseProgram):
+    TRACKS_CHANGES = True
     vscode_pid = None
     full_path = None
     host_type = 'local'
@@ -67,15 +67,3 @@ class VSCodeWindows(BaseProgram):
         """ Deletes all info regarding this program from the project
         """
         shutil.rmtree(self.persist_path)
-
-    def save(self, path=None):
-        """ Saves the variables to json
-        """
-        path = path or self.object_persist_path
-        save_dict_to_json(self, path, ['desktop'])
-
-    def load(self, path=None):
-        """ Loads variables from json
-        """
-        path = path or self.object_persist_path
-        load_dict_from_json(self, path)
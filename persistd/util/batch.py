@@ -0,0 +1,107 @@
+import logging
+from typing import Callable, Dict, Iterable, Optional
+
+from persistd.util.parallel import TaskResult, run_in_parallel
+from persistd.util.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# The project actions that can run on many projects at once
+BATCH_ACTIONS = ['open', 'persist', 'close']
+
+
+def run_on_projects(action: str, project_names: Iterable[str],
+                    get_persister: Optional[Callable] = None,
+                    max_workers: Optional[int] = None) -> Dict[str, TaskResult]:
+    """ Opens, persists or closes many projects concurrently.
+
+    Projects run on a bounded pool of threads and share the desktop helper
+    session of the process. The open projects are updated with a single
+    settings write at the end.
+
+    Args:
+        action::str
+            One of `BATCH_ACTIONS`
+        project_names::iterable(str)
+            The projects to run the action on
+        get_persister::callable
+            Returns the persister of a project name. If None, a new
+            persister is loaded for each project.
+        max_workers::int
+            The max # of projects that are handled at the same time. If
+            None, uses the `max_workers` setting.
+
+    Returns:
+        results::dict(str, TaskResult)
+            The result of each project. A project is only successful if
+            all of its programs were.
+    """
+    if action not in BATCH_ACTIONS:
+        raise ValueError("Can't %s many projects at once" % action)
+    if get_persister is None:
+        from persistd.util.persister import Persister
+
+        def get_persister(project_name):
+            return Persister(SETTINGS.base_path, project_name)
+
+    open_projects = set(SETTINGS.open_projects)
+    # the projects whose open state changed, even if some of their programs failed
+    done = []
+    # the (desktop position, persister) of the projects whose desktops are
+    # closed once all the programs are
+    closing = []
+
+    def desktop_position(persister):
+        # setting up the desktop reports errors by exiting
+        try:
+            desktop = persister.used_desktop_obj
+            return None if desktop is None else desktop.position
+        except (Exception, SystemExit) as err:
+            logger.error("Could not find the desktop of %s: %s", persister.project_name, err)
+            return None
+
+    def run(project_name):
+        if action == 'open' and project_name in open_projects:
+            raise ValueError("%s is already open" % project_name)
+        if action != 'open' and project_name not in open_projects:
+            raise ValueError("%s is not open" % project_name)
+        persister = get_persister(project_name)
+        if not persister.is_initialized:
+            raise ValueError("%s is not a persistd project" % project_name)
+        try:
+            if action == 'open':
+                results = persister.launch_project(update_settings=False)
+            elif action == 'close':
+                results = persister.close_project(update_settings=False, close_desktop=False)
+                closing.append((desktop_position(persister), persister))
+            else:
+                results = persister.persist_project()
+        except SystemExit as err:
+            # persister reports errors by exiting, which would end only this thread
+            raise RuntimeError(err.code)
+        done.append(project_name)
+        return all(result.success for result in results.values())
+
+    results = run_in_parallel({project_name: (lambda project_name=project_name: run(project_name))
+                               for project_name in project_names},
+                              max_workers=max_workers or SETTINGS.max_workers)
+
+    # closing a desktop moves the ones after it, so start from the last one, and
+    # leave the desktops whose position isn't known to the end
+    closing.sort(key=lambda item: -1 if item[0] is None else item[0], reverse=True)
+    for _, persister in closing:
+        try:
+            persister.close_desktop()
+        except (Exception, SystemExit) as err:
+            logger.error("Could not close the desktop of %s: %s", persister.project_name, err)
+
+    def update(settings):
+        for project_name in done:
+            if action == 'open' and project_name not in settings.open_projects:
+                settings.open_projects.append(project_name)
+            elif action == 'close' and project_name in settings.open_projects:
+                settings.open_projects.remove(project_name)
+
+    if action != 'persist' and done:
+        SETTINGS.update(update)
+    return results
@@ -0,0 +1,264 @@
+import contextlib
+import dataclasses
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set
+
+from persistd.util.paths import CATALOGS_PATH
+from persistd.util.savers import atomic_write, file_lock
+from persistd.util.scanner import ProjectEntry, list_project_names, scan_projects
+
+# The version of the catalog file
+CATALOG_VERSION = 1
+
+# The min # of changes in the journal before it is compacted into the
+# catalog file. It is compacted once it has more changes than the catalog
+# has projects, so each change costs a constant amount of writing overall.
+MIN_COMPACT_CHANGES = 64
+
+
+class ProjectCatalog:
+
+    def __init__(self, base_path: str, catalog_path: Optional[str] = None):
+        """ Initializes the catalog of all projects under a base path.
+
+        The catalog is kept in a single file and only rescanned when the
+        mtime of the base path changes, i.e. when a project folder was
+        added or removed. Persister keeps the entries up to date.
+
+        Changes to single entries are appended to a journal next to the
+        catalog file instead of rewriting it, and the journal is folded
+        into the catalog file once it grows as large as the catalog.
+        Changes are made under a file lock, after reading the changes
+        other processes appended, so that e.g. the daemon and the command
+        line don't overwrite each other.
+
+        Args:
+            base_path::str
+                The path to the base directory of all projects
+            catalog_path::str
+                The path to the catalog file. If None, a file under
+                CATALOGS_PATH that is unique to the base path is used.
+        """
+        self.base_path = base_path
+        if catalog_path is None:
+            key = hashlib.sha1(os.path.abspath(base_path).encode('utf-8')).hexdigest()[:16]
+            catalog_path = os.path.join(CATALOGS_PATH, '%s.json' % key)
+        self.catalog_path = catalog_path
+        self.journal_path = catalog_path + '.log'
+        self._lock = threading.RLock()
+        # mtime of the base path when it was last scanned
+        self.mtime_ns = None
+        self.entries: Dict[str, ProjectEntry] = {}
+        # the catalog file and the journal that belongs to it share a
+        # generation, which changes every time the journal is compacted
+        self.generation = 0
+        # the # of bytes of the journal that were read, or None if the
+        # journal belongs to another generation
+        self._journal_offset = None
+        self._journal_changes = 0
+        with self._locked():
+            self._load()
+            self._catch_up()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock, file_lock(self.catalog_path):
+            yield
+
+    def _load(self):
+        """ Reads the catalog file, without the journal
+        """
+        self.mtime_ns = None
+        self.entries = {}
+        self.generation = 0
+        self._journal_offset = None
+        self._journal_changes = 0
+        try:
+            with open(self.catalog_path, 'r') as fp:
+                content = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if content.get('version') != CATALOG_VERSION or content.get('base_path') != self.base_path:
+            return
+        self.generation = content.get('generation', 0)
+        self.mtime_ns = content['mtime_ns']
+        self.entries = {name: ProjectEntry(**entry) for name, entry in content['projects'].items()}
+
+    def _apply(self, change) -> str:
+        if change['op'] == 'update':
+            entry = ProjectEntry(**change['entry'])
+            self.entries[entry.name] = entry
+            return entry.name
+        self.entries.pop(change['name'], None)
+        return change['name']
+
+    def _catch_up(self) -> Set[str]:
+        """ Applies the changes that were appended to the journal since it
+        was last read. Must be called with the lock held.
+
+        Returns:
+            changed::set(str)
+                The names of the projects that changed
+        """
+        try:
+            fp = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return set()
+        with fp:
+            header = fp.readline()
+            try:
+                generation = json.loads(header)['generation']
+            except (ValueError, KeyError, TypeError):
+                return set()
+            if generation > self.generation:
+                # another process compacted the journal, so the catalog file is newer
+                changed = set(self.entries)
+                self._load()
+                changed |= set(self.entries)
+                if generation != self.generation:
+                    return changed
+                return changed | self._catch_up()
+            if generation < self.generation:
+                # left over from a compaction that didn't finish, and already in the catalog file
+                return set()
+            fp.seek(max(self._journal_offset or 0, len(header)))
+            data = fp.read()
+        changed = set()
+        # a line that is still being appended is read the next time
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            changed.add(self._apply(json.loads(line)))
+            self._journal_changes += 1
+        self._journal_offset = max(self._journal_offset or 0, len(header)) + len(complete)
+        return changed
+
+    def _append(self, change):
+        """ Appends a change to the journal. Must be called with the lock
+        held, after catching up.
+        """
+        if self._journal_offset is None:
+            header = (json.dumps({'generation': self.generation}) + '\n').encode('utf-8')
+            atomic_write(self.journal_path, header)
+            self._journal_offset = len(header)
+        line = (json.dumps(change) + '\n').encode('utf-8')
+        with open(self.journal_path, 'ab') as fp:
+            fp.write(line)
+        self._journal_offset += len(line)
+        self._journal_changes += 1
+        if self._journal_changes > max(MIN_COMPACT_CHANGES, len(self.entries)):
+            self.save()
+
+    def save(self):
+        """ Writes the whole catalog to the catalog file, and empties the
+        journal
+        """
+        with self._locked():
+            self.generation += 1
+            content = {'version': CATALOG_VERSION,
+                       'generation': self.generation,
+                       'base_path': self.base_path,
+                       'mtime_ns': self.mtime_ns,
+                       'projects': {name: dataclasses.asdict(entry) for name, entry in self.entries.items()}}
+            # the catalog file goes first, so that a journal of the old generation is ignored if this is cut short
+            atomic_write(self.catalog_path, json.dumps(content))
+            header = (json.dumps({'generation': self.generation}) + '\n').encode('utf-8')
+            atomic_write(self.journal_path, header)
+            self._journal_offset = len(header)
+            self._journal_changes = 0
+
+    def _scan(self, full: bool = False) -> Iterator[ProjectEntry]:
+        """ Rescans the base path if it changed since the last scan.
+
+        Yields:
+            entry::ProjectEntry
+                Each project entry, as soon as it is known. Known projects
+                come first, then the new ones as they are read.
+        """
+        with self._locked():
+            self._catch_up()
+            known = dict(self.entries)
+            mtime_ns = os.stat(self.base_path).st_mtime_ns
+            up_to_date = not full and mtime_ns == self.mtime_ns
+        if up_to_date:
+            yield from (known[name] for name in sorted(known))
+            return
+        names = list_project_names(self.base_path)
+        to_read = names if full else [name for name in names if name not in known]
+        entries = {}
+        for name in sorted(set(names) - set(to_read)):
+            entries[name] = known[name]
+            yield entries[name]
+        for entry in scan_projects(self.base_path, to_read):
+            # last_opened isn't stored in the project files
+            if entry.name in known:
+                entry.last_opened = known[entry.name].last_opened
+            entries[entry.name] = entry
+            yield entry
+        with self._locked():
+            # keeps what other threads and processes changed during the scan
+            for name in self._catch_up():
+                if name in self.entries and name in entries:
+                    entries[name] = self.entries[name]
+            self.entries = entries
+            self.mtime_ns = mtime_ns
+            self.save()
+
+    def refresh(self, full: bool = False):
+        """ Brings the catalog up to date with the base path. Only new
+        project folders are read, unless a full rescan is requested.
+        """
+        for _ in self._scan(full=full):
+            pass
+
+    def iter_projects(self, only_initialized: bool = False) -> Iterator[str]:
+        """ Yields the names of the projects under the base path as soon
+        as they are known, which is useful when the base path needs to
+        be rescanned.
+        """
+        for entry in self._scan():
+            if entry.initialized or not only_initialized:
+                yield entry.name
+
+    def projects(self, only_initialized: bool = False) -> List[str]:
+        """ Returns the sorted names of the projects under the base path
+        """
+        return sorted(self.iter_projects(only_initialized=only_initialized))
+
+    def update(self, entry: ProjectEntry, opened: bool = False):
+        """ Adds or replaces the entry of a project, optionally marking
+        it as opened now
+        """
+        with self._locked():
+            self._catch_up()
+            previous = self.entries.get(entry.name)
+            if opened:
+                entry.last_opened = time.time()
+            elif previous is not None and entry.last_opened is None:
+                entry.last_opened = previous.last_opened
+            self.entries[entry.name] = entry
+            self._append({'op': 'update', 'entry': dataclasses.asdict(entry)})
+
+    def remove(self, name: str):
+        """ Removes the entry of a project
+        """
+        with self._locked():
+            self._catch_up()
+            if self.entries.pop(name, None) is not None:
+                self._append({'op': 'remove', 'name': name})
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(base_path: str) -> ProjectCatalog:
+    """ Returns the catalog of the given base path, shared by the process
+    """
+    with _catalogs_lock:
+        if base_path not in _catalogs:
+            _catalogs[base_path] = ProjectCatalog(base_path)
+        return _catalogs[base_path]
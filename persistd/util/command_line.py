@@ -2,9 +2,10 @@ import os
 import subprocess
 
 from persistd.util import const
+from persistd.util.tracing import TRACER
 
 
-def run_on_command_line(command, input=None, open_async=False):
+def run_on_command_line(command, input=None, open_async=False, timeout=None, env=None):
     """ Runs a command on command line
 
     Args:
@@ -17,23 +18,41 @@ def run_on_command_line(command, input=None, open_async=False):
             Whether to open the process as asynchronous. If set,
             there will not be any communication through stdin and
             stdout, and the return code may not be set.
+        timeout::float
+            The max # of seconds the command may run before it is
+            killed. If None, uses the `command_timeout` setting. Not
+            used if `open_async` is set.
+        env::dict(str, str)
+            The environment variables of the command. If None, it
+            inherits the ones of this process.
 
     Returns:
         return_code::int
-            The return code of the executed command
+            The return code of the executed command, or None if it
+            timed out
         stdout::str
             The output of the command as a string, or an error object
             if the command was not executed successfully
         pid::int
             The process id of the created process
     """
-    sub = subprocess.Popen(command, stdin=subprocess.PIPE if input else None, stdout=subprocess.PIPE)
-    (stdout, stderr) = (None, None) if open_async else sub.communicate(input=input)
-    sub.poll()  # Try polling it to see if process has terminated
+    # imported here, so that commands that don't run any don't pay for asyncio
+    from persistd.util.processes import get_runner
+
+    with TRACER.span('run_on_command_line', command=os.path.basename(command[0]), open_async=open_async):
+        TRACER.count('subprocesses')
+        if open_async:
+            # the program outlives this call, so it isn't tied to the runner
+            sub = subprocess.Popen(command, stdin=subprocess.PIPE if input else None, stdout=subprocess.PIPE, env=env)
+            sub.poll()  # Try polling it to see if process has terminated
+            return sub.returncode, None, sub.pid
+        result = get_runner().run(command, input=input, timeout=timeout, env=env)
+    if result.timed_out:
+        return None, TimeoutError("%s timed out" % command[0]), result.pid
     try:
-        return sub.returncode, stdout.decode('utf-8') if stdout else None, sub.pid
-    except (AttributeError, UnicodeDecodeError) as err:
-        return sub.returncode, err, -1
+        return result.return_code, result.stdout.decode('utf-8') if result.stdout else None, result.pid
+    except UnicodeDecodeError as err:
+        return result.return_code, err, -1
 
 
 def kill_mutant(process_name, object_name):
@@ -41,18 +60,15 @@ def kill_mutant(process_name, object_name):
     up at the right window.
     """
 
-    # First, set up the environmental variables that the script needs
-    os.environ[const.ENV_MUTANT_PROCESS_NAME] = process_name
-    os.environ[const.ENV_MUTANT_OBJECT_NAME] = object_name
+    # The script gets its arguments as environmental variables, which are
+    # only set for it, so that concurrent calls don't see each other's
+    env = dict(os.environ)
+    env[const.ENV_MUTANT_PROCESS_NAME] = process_name
+    env[const.ENV_MUTANT_OBJECT_NAME] = object_name
 
-    # Then, run the actual batch script
     util_dir = os.path.dirname(os.path.realpath(__file__))
     file_path = os.path.join(util_dir, 'windows', 'kill_mutant.bat')
-    return_code, _, _ = run_on_command_line([file_path])
-
-    # Even if there was an error, we first unset the environmental variables
-    os.environ[const.ENV_MUTANT_PROCESS_NAME] = ""
-    os.environ[const.ENV_MUTANT_OBJECT_NAME] = ""
+    return_code, _, _ = run_on_command_line([file_path], env=env)
 
     # Return true if there wasn't any errors
     return return_code == 0
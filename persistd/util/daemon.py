@@ -0,0 +1,298 @@
+""" A resident persistd daemon and its client.
+
+The daemon keeps the settings, the project catalog and the loaded
+persisters in memory, and owns the desktop helper session, so that a
+command only costs a round trip over a Unix domain socket (a named pipe
+on Windows). Requests and responses are dicts:
+
+    {'action': 'close', 'project': 'my_project'}
+    {'ok': True, 'value': {'chrome': True}, 'output': 'Closing...', 'error': None}
+
+Opening, persisting and closing also take a list of projects, e.g.
+{'action': 'close', 'projects': ['a', 'b']}, which are run as a batch.
+
+Every client gets its own thread, but requests are served one at a
+time, so that no two commands operate on the same project at once. If
+the `auto_persist_interval` setting is set, the daemon also persists the
+open projects periodically, in between requests.
+"""
+import getpass
+import io
+import logging
+import os
+import platform
+import secrets
+import threading
+
+from persistd.util.batch import BATCH_ACTIONS, run_on_projects
+from persistd.util.catalog import get_catalog
+from persistd.util.output import capture_stdout
+from persistd.util.paths import PERSISTD_PATH
+from persistd.util.savers import atomic_write, file_mtime
+from persistd.util.scheduler import AutoPersister
+from persistd.util.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# The file that holds the key clients authenticate with
+DAEMON_KEY_PATH = os.path.join(PERSISTD_PATH, 'daemon.key')
+
+# The persister method that serves each project action
+PROJECT_ACTIONS = {'open': 'launch_project',
+                   'persist': 'persist_project',
+                   'close': 'close_project',
+                   'add': 'add_program_to_project',
+                   'remove': 'remove_program_from_project'}
+
+
+class DaemonError(Exception):
+    pass
+
+
+def get_daemon_address():
+    """ Returns the address the daemon of the current user listens on
+    """
+    if platform.system() == 'Windows':
+        return r'\\.\pipe\persistd-%s' % getpass.getuser()
+    return os.path.join(PERSISTD_PATH, 'daemon.sock')
+
+
+def address_family(address):
+    """ The multiprocessing.connection family of a socket path or pipe name
+    """
+    return 'AF_PIPE' if address.startswith('\\\\') else 'AF_UNIX'
+
+
+def connect_with_key(address, key_path):
+    """ Connects to a listener whose authentication key is in a file
+
+    Returns:
+        connection::multiprocessing.connection.Connection
+            The connection, or None if there is no key or the listener
+            isn't reachable
+    """
+    # checking for the key first keeps the common case cheap
+    try:
+        with open(key_path, 'r') as fp:
+            key = bytes.fromhex(fp.read())
+    except (OSError, ValueError):
+        return None
+    from multiprocessing.connection import Client, AuthenticationError
+    try:
+        return Client(address, family=address_family(address), authkey=key)
+    except (OSError, AuthenticationError) as err:
+        logger.debug("%s is not reachable: %s", address, err)
+        return None
+
+
+class PersistDaemon:
+
+    def __init__(self, address=None, key_path=DAEMON_KEY_PATH):
+        """ Initializes the daemon. It starts listening in `serve_forever`.
+
+        Args:
+            address::str
+                The socket path or pipe name to listen on. If None, uses
+                `get_daemon_address`.
+            key_path::str
+                The file to write the authentication key of clients to
+        """
+        self.address = address or get_daemon_address()
+        self.key_path = key_path
+        # project name -> (persister, mtime of its state file)
+        self._persisters = {}
+        self._listener = None
+        self._key = None
+        self._running = False
+        # held while a request is served
+        self._lock = threading.Lock()
+
+    def get_persister(self, project_name):
+        """ Returns the persister of a project, reloading it only if its
+        state was changed by another process.
+        """
+        # imported here, so that the client side doesn't pay for it
+        from persistd.util.persister import Persister
+
+        cached = self._persisters.get(project_name)
+        if cached is not None:
+            persister, mtime = cached
+            if mtime == file_mtime(persister.state_path):
+                return persister
+        persister = Persister(SETTINGS.base_path, project_name)
+        self._persisters[project_name] = (persister, file_mtime(persister.state_path))
+        return persister
+
+    def handle(self, request):
+        """ Serves a single request
+
+        Returns:
+            response::dict
+                The response, see the module docstring
+        """
+        output = io.StringIO()
+        with self._lock:
+            return self._handle(request, output)
+
+    def _handle(self, request, output):
+        try:
+            base_path = SETTINGS.base_path
+            if SETTINGS.refresh() and SETTINGS.base_path != base_path:
+                logger.info("Base path changed to %s", SETTINGS.base_path)
+                self._persisters.clear()
+            with capture_stdout(output):
+                value = self._dispatch(request)
+            return {'ok': True, 'value': value, 'output': output.getvalue(), 'error': None}
+        except SystemExit as err:
+            # persister reports user errors by exiting
+            return {'ok': False, 'value': None, 'output': output.getvalue(), 'error': str(err.code)}
+        except Exception as err:
+            logger.exception("Could not serve %s", request)
+            return {'ok': False, 'value': None, 'output': output.getvalue(), 'error': str(err)}
+
+    def _dispatch(self, request):
+        action = request.get('action')
+        if action == 'ping':
+            return os.getpid()
+        elif action == 'shutdown':
+            self._running = False
+            self._wake_up()
+            return None
+        elif action == 'list':
+            if request.get('status') == 'open':
+                return list(SETTINGS.open_projects)
+            return get_catalog(SETTINGS.base_path).projects(only_initialized=request.get('status') == 'initialized')
+        elif action in BATCH_ACTIONS and 'projects' in request:
+            results = run_on_projects(action, request['projects'], get_persister=self.get_persister)
+            for project_name in request['projects']:
+                if project_name in self._persisters:
+                    persister = self._persisters[project_name][0]
+                    self._persisters[project_name] = (persister, file_mtime(persister.state_path))
+            return results
+        elif action in PROJECT_ACTIONS:
+            project_name = request['project']
+            persister = self.get_persister(project_name)
+            if not persister.is_initialized:
+                raise DaemonError("Project %s is not initialized" % project_name)
+            args = [request['program']] if action in ['add', 'remove'] else []
+            results = getattr(persister, PROJECT_ACTIONS[action])(*args)
+            # the state file was written by this process
+            self._persisters[project_name] = (persister, file_mtime(persister.state_path))
+            return {name: result.success for name, result in results.items()} if results else None
+        raise DaemonError("Unknown action %s" % action)
+
+    def _write_key(self):
+        key = secrets.token_bytes(32)
+        atomic_write(self.key_path, key.hex())
+        return key
+
+    def serve_forever(self):
+        """ Serves clients until a shutdown request arrives
+        """
+        from multiprocessing.connection import Listener, AuthenticationError
+
+        if address_family(self.address) == 'AF_UNIX':
+            os.makedirs(os.path.dirname(self.address), exist_ok=True)
+            if os.path.exists(self.address):
+                # left over from a daemon that didn't exit cleanly
+                os.remove(self.address)
+        os.makedirs(os.path.dirname(self.key_path), exist_ok=True)
+        self._key = self._write_key()
+        self._listener = Listener(self.address, family=address_family(self.address), authkey=self._key)
+        self._running = True
+        logger.info("persistd daemon listening on %s", self.address)
+        auto_persister = None
+        if SETTINGS.auto_persist_interval > 0:
+            auto_persister = AutoPersister(get_persister=self.get_persister, lock=self._lock).start()
+        try:
+            while self._running:
+                try:
+                    connection = self._listener.accept()
+                except (OSError, AuthenticationError) as err:
+                    # e.g. a client that failed to authenticate
+                    logger.warning("Could not accept a client: %s", err)
+                    continue
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            if auto_persister is not None:
+                auto_persister.stop()
+            self._listener.close()
+            self._listener = None
+            if os.path.exists(self.key_path):
+                os.remove(self.key_path)
+
+    def _serve_connection(self, connection):
+        """ Serves the requests of a client until it disconnects
+        """
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    break
+                connection.send(self.handle(request))
+
+    def _wake_up(self):
+        """ Unblocks `serve_forever`, which is waiting for the next client
+        """
+        from multiprocessing.connection import Client
+
+        def connect():
+            try:
+                Client(self.address, family=address_family(self.address), authkey=self._key).close()
+            except OSError:
+                pass
+
+        threading.Thread(target=connect, daemon=True).start()
+
+
+class DaemonClient:
+
+    def __init__(self, connection):
+        """ Initializes a client over an open connection. Use `connect`
+        to connect to a running daemon.
+        """
+        self._connection = connection
+
+    @classmethod
+    def connect(cls, address=None, key_path=DAEMON_KEY_PATH):
+        """ Connects to the daemon
+
+        Returns:
+            client::DaemonClient
+                The client, or None if the daemon isn't running
+        """
+        connection = connect_with_key(address or get_daemon_address(), key_path)
+        return cls(connection) if connection is not None else None
+
+    def request(self, action, **kwargs):
+        """ Sends a request to the daemon and waits for its response.
+        Anything the daemon printed is printed here.
+
+        Returns:
+            value::object
+                The value the request returned
+
+        Raises:
+            DaemonError
+                If the request failed on the daemon
+        """
+        try:
+            self._connection.send(dict(kwargs, action=action))
+            response = self._connection.recv()
+        except (EOFError, OSError) as err:
+            raise DaemonError("Lost the connection to the persistd daemon: %s" % err)
+        if response['output']:
+            print(response['output'], end='')
+        if not response['ok']:
+            raise DaemonError(response['error'])
+        return response['value']
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
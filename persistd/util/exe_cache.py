@@ -0,0 +1,182 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from persistd.util.integrity import IntegrityCache, hash_file
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# The folder, next to the aliases, that holds the shared copies
+BLOBS_FOLDER = '.persistd-blobs'
+
+# ioctl that clones a file on Linux copy-on-write file systems, e.g. btrfs or xfs
+FICLONE = 0x40049409
+
+
+def _reflink(src, dest):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError("Reflinks are not supported on %s" % sys.platform)
+    with open(src, 'rb') as src_fp, open(dest, 'wb') as dest_fp:
+        fcntl.ioctl(dest_fp.fileno(), FICLONE, src_fp.fileno())
+
+
+def _copy(src, dest):
+    shutil.copyfile(src, dest)
+
+
+class ExecutableCache:
+
+    def __init__(self, integrity_cache_path):
+        """ Initializes a content addressed cache of executables.
+
+        Programs such as SublimeText need a differently named executable
+        per project. Instead of copying the executable for every project,
+        a single copy of it (a blob) is kept per content, and every
+        project gets an alias of the blob: a reflink or a hard link where
+        the file system supports them, and a copy otherwise.
+
+        Args:
+            integrity_cache_path::str
+                The json file of the IntegrityCache that keeps the hashes
+                of the executables, so that they are only hashed again
+                when their size or mtime change
+        """
+        self.integrity_cache = IntegrityCache(integrity_cache_path)
+
+    def blob_path(self, source, blobs_path):
+        """ Returns the blob with the content of `source`, copying it in
+        the first time.
+
+        Args:
+            source::str
+                The path to the executable
+            blobs_path::str
+                The folder that holds the blobs
+
+        Returns:
+            blob_path::str
+                The path to the blob
+        """
+        digest = self.integrity_cache.file_hash(source, 'sha256')
+        blob_path = os.path.join(blobs_path, digest + os.path.splitext(source)[1])
+        if os.path.exists(blob_path) and os.path.getsize(blob_path) == os.path.getsize(source):
+            return blob_path
+        os.makedirs(blobs_path, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=blobs_path, prefix='.tmp-')
+        os.close(fd)
+        try:
+            shutil.copy2(source, temp_path)
+            os.replace(temp_path, blob_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        logger.info("Cached %s as %s", source, blob_path)
+        return blob_path
+
+    @staticmethod
+    def _is_alias(alias_path, blob_path):
+        """ Whether the alias already has the content of the blob, which
+        only takes a stat of each. A copy is taken to have the content if
+        its size and mtime match, so an edited copy whose mtime was kept
+        passes too.
+        """
+        try:
+            alias_stat = os.stat(alias_path)
+        except OSError:
+            return False
+        blob_stat = os.stat(blob_path)
+        if os.path.samestat(alias_stat, blob_stat):
+            return True
+        # reflinks and copies get the mtime of the blob
+        return alias_stat.st_size == blob_stat.st_size and alias_stat.st_mtime_ns == blob_stat.st_mtime_ns
+
+    def remove_unused_blobs(self, aliases_path):
+        """ Removes the blobs that no file in `aliases_path` has the
+        content of, e.g. once the executable was updated or an alias was
+        removed. Unlike `_is_alias`, the content of copies is compared by
+        their hash, since a blob that is removed can't be brought back.
+
+        Args:
+            aliases_path::str
+                The folder of the aliases, which holds their blobs
+
+        Returns:
+            removed::list(str)
+                The paths of the blobs that were removed
+        """
+        blobs_path = os.path.join(aliases_path, BLOBS_FOLDER)
+        try:
+            blobs = [entry for entry in os.scandir(blobs_path)
+                     # temporary files are blobs that are still being copied in
+                     if entry.is_file() and not entry.name.startswith('.tmp-')]
+        except FileNotFoundError:
+            return []
+        # DirEntry.stat() has no inode on Windows, which samestat needs
+        aliases = {entry.path: os.stat(entry.path) for entry in os.scandir(aliases_path) if entry.is_file()}
+        # alias path -> its sha256, only hashed if it could be a copy of a blob
+        digests = {}
+
+        def has_content(alias_path, alias_stat, blob):
+            blob_stat = os.stat(blob.path)
+            if os.path.samestat(alias_stat, blob_stat):
+                return True
+            if alias_stat.st_size != blob_stat.st_size:
+                return False
+            if alias_path not in digests:
+                digests[alias_path] = hash_file(alias_path, 'sha256')
+            return digests[alias_path] == os.path.splitext(blob.name)[0]
+
+        removed = []
+        for blob in blobs:
+            if not any(has_content(alias_path, alias_stat, blob) for alias_path, alias_stat in aliases.items()):
+                os.remove(blob.path)
+                logger.info("Removed unused blob %s", blob.path)
+                removed.append(blob.path)
+        return removed
+
+    def link(self, source, alias_path):
+        """ Makes `alias_path` an executable with the content of `source`
+
+        Args:
+            source::str
+                The path to the executable
+            alias_path::str
+                The path of the alias. Its blob is kept in a folder next
+                to it, so that they are on the same file system.
+
+        Returns:
+            method::str
+                How the alias was made: 'existing', 'reflink', 'hardlink'
+                or 'copy'
+        """
+        blob_path = self.blob_path(source, os.path.join(os.path.dirname(alias_path), BLOBS_FOLDER))
+        if self._is_alias(alias_path, blob_path):
+            return 'existing'
+        relinked = os.path.lexists(alias_path)
+        if relinked:
+            # the executable changed since the alias was made
+            os.remove(alias_path)
+        for method, make in [('reflink', _reflink), ('hardlink', os.link), ('copy', _copy)]:
+            try:
+                make(blob_path, alias_path)
+            except OSError as err:
+                logger.debug("Could not %s %s to %s: %s", method, blob_path, alias_path, err)
+                if os.path.lexists(alias_path):
+                    os.remove(alias_path)
+                continue
+            if method != 'hardlink':
+                blob_stat = os.stat(blob_path)
+                os.utime(alias_path, ns=(blob_stat.st_atime_ns, blob_stat.st_mtime_ns))
+            logger.info("Made %s a %s of %s", alias_path, method, blob_path)
+            if relinked:
+                # the blob of the old executable may not be needed anymore
+                self.remove_unused_blobs(os.path.dirname(alias_path))
+            return method
+        raise OSError("Could not make %s an alias of %s" % (alias_path, blob_path))
@@ -0,0 +1,46 @@
+import dataclasses
+import random
+import threading
+from typing import Dict, Optional
+
+from persistd.util.tracing import sleep
+
+
+@dataclasses.dataclass
+class FakeBehavior:
+    """ How long the operations of a fake desktop or program take, and
+    how often they fail.
+    """
+    # the # of seconds every operation takes
+    latency: float = 0.0
+    # the # of seconds specific operations take instead, e.g. {'start': 0.5}
+    latencies: Dict[str, float] = dataclasses.field(default_factory=dict)
+    # the fraction by which each latency is randomly stretched or shrunk
+    jitter: float = 0.0
+    # the probability that an operation fails
+    failure_rate: float = 0.0
+    # the probability that specific operations fail instead, e.g. {'close': 1.0}
+    failure_rates: Dict[str, float] = dataclasses.field(default_factory=dict)
+    # the seed of the random numbers, so that runs can be repeated
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    def perform(self, operation: str) -> bool:
+        """ Waits for as long as the operation takes
+
+        Returns:
+            success::bool
+                Whether the operation succeeded
+        """
+        latency = self.latencies.get(operation, self.latency)
+        failure_rate = self.failure_rates.get(operation, self.failure_rate)
+        with self._lock:
+            if self.jitter:
+                latency *= 1 + self._random.uniform(-self.jitter, self.jitter)
+            failed = failure_rate > 0 and self._random.random() < failure_rate
+        if latency > 0:
+            sleep(latency)
+        return not failed
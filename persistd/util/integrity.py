@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import threading
+
+from persistd.util.savers import atomic_write
+
+
+def hash_file(path, algorithm='md5', chunk_size=1 << 20):
+    """ Hashes a file in chunks, without reading it into memory at once
+
+    Returns:
+        digest::str
+            The hex digest of the file
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IntegrityCache:
+
+    def __init__(self, cache_path):
+        """ Initializes a cache of file hashes, which only re-hashes a
+        file when its path, size, mtime or inode changes.
+
+        Args:
+            cache_path::str
+                The path to the json file that stores the hashes
+        """
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.cache_path, 'r') as fp:
+                    self._entries = json.load(fp)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        atomic_write(self.cache_path, json.dumps(self._entries))
+
+    def file_hash(self, path, algorithm='md5'):
+        """ Returns the hash of a file, re-hashing it only if it changed
+        since it was last hashed.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        key = '%s:%s' % (algorithm, path)
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry and entry['signature'] == signature:
+                return entry['digest']
+            digest = hash_file(path, algorithm)
+            entries[key] = {'signature': signature, 'digest': digest}
+            self._save()
+            return digest
+
+    def forget(self, path, algorithm='md5'):
+        """ Removes a file from the cache
+        """
+        key = '%s:%s' % (algorithm, os.path.abspath(path))
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
@@ -0,0 +1,64 @@
+""" Per thread capture of what is printed.
+
+`contextlib.redirect_stdout` swaps the process-wide `sys.stdout`, so
+while the daemon serves a request, whatever another thread prints, e.g.
+the auto-persister, would end up in the response. `capture_stdout`
+instead installs a stand-in for `sys.stdout` once, which sends what each
+thread prints to the stream set for that thread, or to the real stdout.
+The tasks of `run_in_parallel` print to the stream of the thread that
+started them.
+"""
+import contextlib
+import sys
+import threading
+from typing import Optional, TextIO
+
+_local = threading.local()
+_install_lock = threading.Lock()
+
+
+class _ThreadStdout:
+    """ Stands in for `sys.stdout`, writing to the stream of the current
+    thread if it has one
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+    def _target(self):
+        stream = _local.__dict__.get('stream')
+        return stream if stream is not None else self.stdout
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+def current_stdout() -> Optional[TextIO]:
+    """ The stream this thread's output is captured in, if any
+    """
+    return _local.__dict__.get('stream')
+
+
+@contextlib.contextmanager
+def capture_stdout(stream: Optional[TextIO]):
+    """ Sends what this thread prints to `stream`. If None, this thread
+    prints to the real stdout.
+    """
+    if stream is None and current_stdout() is None:
+        yield None
+        return
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+    previous = current_stdout()
+    _local.stream = stream
+    try:
+        yield stream
+    finally:
+        _local.stream = previous
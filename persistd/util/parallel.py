@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from persistd.util.output import capture_stdout, current_stdout
+from persistd.util.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TaskResult:
+    """ The outcome of a single task run by `run_in_parallel`
+    """
+    name: str
+    success: bool
+    duration: float = 0.0
+    error: Optional[str] = None
+    timed_out: bool = False
+
+
+class _Task:
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.result = None
+        # monotonic time at which the task got a worker slot
+        self.started = None
+        self.finished = False
+        # set when the task timed out and its slot was given away
+        self.abandoned = False
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            success = bool(self.func())
+            self.result = TaskResult(self.name, success, time.monotonic() - start)
+        except Exception as err:
+            logger.exception("Task %s raised an error", self.name)
+            self.result = TaskResult(self.name, False, time.monotonic() - start, error=repr(err))
+
+
+def run_in_parallel(tasks: Dict[str, Callable[[], bool]], max_workers: Optional[int] = None,
+                    timeout: Optional[float] = None) -> Dict[str, TaskResult]:
+    """ Runs the given tasks concurrently on a bounded pool of threads
+
+    Tasks run on daemon threads. A task that is still running `timeout`
+    seconds after it started is reported as timed out and its slot is
+    handed to the next task, so a single hung task cannot hold up the
+    others or the interpreter exit.
+
+    Args:
+        tasks::dict(str, callable)
+            A mapping from task name to a callable that takes no
+            arguments. A task is successful if it returns a truthy
+            value and does not raise.
+        max_workers::int
+            The max # of tasks that run at the same time. If None or
+            less than 1, every task gets its own thread.
+        timeout::float
+            The max # of seconds a single task may run. If None, tasks
+            are waited on indefinitely.
+
+    Returns:
+        results::dict(str, TaskResult)
+            The result of each task, in the same order as `tasks`
+    """
+    pending = [_Task(name, func) for name, func in tasks.items()]
+    if not max_workers or max_workers < 1:
+        max_workers = len(pending)
+    condition = threading.Condition()
+    free_slots = [max(max_workers, 1)]
+    # the tasks are traced, and print, as part of the caller
+    parent_span = TRACER.current()
+    stdout = current_stdout()
+
+    def worker(task):
+        with condition:
+            while free_slots[0] == 0:
+                condition.wait()
+            free_slots[0] -= 1
+            task.started = time.monotonic()
+        with TRACER.attach(parent_span), capture_stdout(stdout):
+            task.run()
+        with condition:
+            if not task.abandoned:
+                free_slots[0] += 1
+                task.finished = True
+            condition.notify_all()
+
+    for task in pending:
+        threading.Thread(target=worker, args=(task,), name='persistd-%s' % task.name, daemon=True).start()
+
+    results = {}
+    with condition:
+        while len(results) < len(pending):
+            now = time.monotonic()
+            wait = None
+            for task in pending:
+                if task.name in results:
+                    continue
+                if task.finished:
+                    results[task.name] = task.result
+                elif timeout is not None and task.started is not None:
+                    remaining = task.started + timeout - now
+                    if remaining > 0:
+                        wait = remaining if wait is None else min(wait, remaining)
+                        continue
+                    logger.error("Task %s timed out after %.1fs", task.name, timeout)
+                    task.abandoned = True
+                    free_slots[0] += 1
+                    condition.notify_all()
+                    results[task.name] = TaskResult(task.name, False, now - task.started,
+                                                    error='timed out after %.1fs' % timeout, timed_out=True)
+            if len(results) < len(pending):
+                condition.wait(wait)
+    return {task.name: results[task.name] for task in pending}
@@ -7,6 +7,8 @@ def _get_persistd_path():
     """
     if platform.system() == 'Windows':
         return os.path.join(os.getenv('LOCALAPPDATA'), 'persistd')
+    data_home = os.getenv('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data_home, 'persistd')
 
 
 # Path to the base persistd folder.
@@ -21,5 +23,8 @@ PROGRAMS_PATH = os.path.join(PERSISTD_PATH, 'programs')
 # Path to desktops folder
 DESKTOPS_PATH = os.path.join(PERSISTD_PATH, 'desktops')
 
+# Path to the project catalogs folder
+CATALOGS_PATH = os.path.join(PERSISTD_PATH, 'catalogs')
+
 # Path to the actual code
 CODE_PATH = os.path.abspath(os.path.join(__file__, '..', '..'))
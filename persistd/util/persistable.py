@@ -1,18 +1,45 @@
-from abc import ABC, abstractmethod
+import copy
+import json
+from abc import ABC
+
+from persistd.util.savers import atomic_write, object_state
 
 
 class Persistable(ABC):
 
-    @abstractmethod
     def save(self, path=None):
-        """ Saves the current object to file path. If path is None,
-        should save to self.path.
+        """ Saves the state of the current object to a json file at path.
+        If path is None, saves to self.object_persist_path.
         """
-        pass
+        atomic_write(path or self.object_persist_path, json.dumps(self.get_state()))
 
-    @abstractmethod
     def load(self, path=None):
-        """ Loads the current object from file path. If path is None,
-        should load from self.path.
+        """ Loads the state of the current object from a json file at
+        path. If path is None, loads from self.object_persist_path.
+        """
+        with open(path or self.object_persist_path, 'r') as fp:
+            self.set_state(json.load(fp))
+
+    def get_state(self):
+        """ Returns the state of the current object as a json
+        serializable dictionary.
+        """
+        return object_state(self)
+
+    def set_state(self, state):
+        """ Restores the current object from a dictionary returned
+        by `get_state`.
+        """
+        self.__dict__.update(state)
+
+    def is_dirty(self):
+        """ Whether the state of the current object changed since
+        the last call to `mark_clean`.
+        """
+        return self.get_state() != self.__dict__.get('_clean_state')
+
+    def mark_clean(self):
+        """ Takes a snapshot of the current state, against which
+        `is_dirty` compares.
         """
-        pass
+        self._clean_state = copy.deepcopy(self.get_state())
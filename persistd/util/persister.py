@@ -1,19 +1,45 @@
+import json
+import logging
 import os
 import shutil
 import sys
+import threading
+from dataclasses import dataclass
 
 import persistd.desktops as desktops
 import persistd.programs as programs
+from persistd.util.catalog import ProjectEntry, get_catalog
 from persistd.util.command_line import askyn
+from persistd.util.parallel import run_in_parallel
 from persistd.util.persistable import Persistable
-from persistd.util.savers import save_dict_to_json, load_dict_from_json
+from persistd.util.savers import atomic_write
+from persistd.util.tracing import traced
 
 # this should never be the name of a project
 # if it is, shame on you
 from persistd.util.settings import SETTINGS
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_PROJECT_NAME = '|||||||'
 
+# The version of the project state file
+STATE_VERSION = 1
+
+# Desktops are numbered by position, so creating or closing desktops of
+# several projects at once could leave them with the wrong ids
+_desktop_lock = threading.Lock()
+
+
+@dataclass
+class SaveReport:
+    """ How much work a `Persister.save` did
+    """
+    files_written: int = 0
+    bytes_written: int = 0
+    objects_serialized: int = 0
+    bytes_serialized: int = 0
+
 
 class Persister(Persistable):
 
@@ -25,10 +51,23 @@ class Persister(Persistable):
     def persister_folder_path(self):
         return os.path.join(self.project_path, '.persistd')
 
+    @property
+    def state_path(self):
+        # The single file that holds the state of the whole project
+        return os.path.join(self.persister_folder_path, 'state.json')
+
     @property
     def persister_obj_path(self):
+        # Legacy layout, where each object had its own json file
         return os.path.join(self.persister_folder_path, 'pd.json')
 
+    def _legacy_obj_path(self, code_name):
+        return os.path.join(self.persister_folder_path, code_name, '%s.json' % code_name)
+
+    @property
+    def is_initialized(self):
+        return os.path.exists(self.state_path) or os.path.exists(self.persister_obj_path)
+
     def __init__(self, base_path, project_name):
         """ Initializes a persister that takes care of project files
 
@@ -44,16 +83,54 @@ class Persister(Persistable):
         self.project_name = project_name
         # the desktop being used
         self.used_desktop = None
-        # the desktop object
-        self.used_desktop_obj = None
         # the programs being used
         self.used_programs = []
-        # the program objects
-        self.used_program_objs = {}
+        # the desktop and program objects, initialized on first access
+        self._used_desktop_obj = None
+        self._used_program_objs = {}
+        # the persisted states of the desktop and programs
+        self._desktop_state = None
+        self._program_states = {}
+        # whether the project was loaded from the legacy layout
+        self._legacy = False
+        # the json of each object's state as of the last save
+        self._fragments = {}
 
-        if self.project_name != DEFAULT_PROJECT_NAME and os.path.exists(self.persister_obj_path):
+        if self.project_name != DEFAULT_PROJECT_NAME and self.is_initialized:
             self.load()
 
+    @property
+    def used_desktop_obj(self):
+        """ The desktop object. It is initialized, set up and loaded
+        on first access.
+        """
+        if self._used_desktop_obj is None and self.used_desktop:
+            self._initialize_desktop_obj()
+            if self._desktop_state is not None:
+                self._used_desktop_obj.set_state(self._desktop_state)
+                self._used_desktop_obj.mark_clean()
+        return self._used_desktop_obj
+
+    @property
+    def used_program_objs(self):
+        """ The program objects. Each one is initialized and loaded
+        on first access.
+        """
+        for program_name in self.used_programs:
+            self.get_program_obj(program_name)
+        return self._used_program_objs
+
+    def get_program_obj(self, program_name):
+        """ Returns a single program object, initializing and loading
+        only that program if it is not initialized yet.
+        """
+        if program_name not in self._used_program_objs:
+            program = self._initialize_program_obj(program_name)
+            if program_name in self._program_states:
+                program.set_state(self._program_states[program_name])
+                program.mark_clean()
+        return self._used_program_objs[program_name]
+
     def _initialize_project(self):
         # Initialize a desktop
         if len(desktops.all_desktops) == 0:
@@ -80,17 +157,19 @@ class Persister(Persistable):
         self.setup()
         # Save the project
         self.save()
+        self._update_catalog()
         print("Project successfully initialized.")
         if askyn("Do you want to open the project?"):
             self.launch_project()
 
+    @traced
     def _initialize_desktop_obj(self):
         """ Initializes the desktop object using the `self.used_desktop` string
         """
         desktop_class = desktops.code_name_to_class[self.used_desktop]
         persist_path = os.path.join(self.persister_folder_path, self.used_desktop)
-        self.used_desktop_obj = desktop_class(self.project_name, self.project_path, persist_path)
-        if not self.used_desktop_obj.setup():
+        self._used_desktop_obj = desktop_class(self.project_name, self.project_path, persist_path)
+        if not self._used_desktop_obj.setup():
             sys.exit(f"Error: could not set up {self.used_desktop}. "
                      f"Make sure you have correct access rights and internet.")
 
@@ -99,8 +178,9 @@ class Persister(Persistable):
         """
         program_class = programs.code_name_to_class[program_name]
         persist_path = os.path.join(self.persister_folder_path, program_name)
-        program = program_class(self.project_name, self.project_path, persist_path, self.used_desktop_obj)
-        self.used_program_objs[program_name] = program
+        # the desktop is only set up once the program needs it
+        program = program_class(self.project_name, self.project_path, persist_path, lambda: self.used_desktop_obj)
+        self._used_program_objs[program_name] = program
         return program
 
     def _initialize_program_objects(self):
@@ -109,6 +189,45 @@ class Persister(Persistable):
         for program_name in self.used_programs:
             self._initialize_program_obj(program_name)
 
+    def _update_catalog(self, opened=False):
+        """ Writes the current state of the project through to the catalog
+        """
+        entry = ProjectEntry(name=self.project_name, initialized=self.is_initialized,
+                             desktop=self.used_desktop, programs=list(self.used_programs))
+        get_catalog(self.base_path).update(entry, opened=opened)
+
+    def _run_on_programs(self, action, timeout=-1, program_names=None):
+        """ Runs a program method (e.g. `start`, `close`) on all programs
+        concurrently and logs the per-program results.
+
+        Args:
+            action::str
+                The name of the `BaseProgram` method to call
+            timeout::float
+                The max # of seconds each program may take. If -1, uses
+                the `program_timeout` setting. If None, waits forever.
+            program_names::list(str)
+                The programs to run the method on. If None, runs it on
+                all programs.
+
+        Returns:
+            results::dict(str, TaskResult)
+                The result of the action for each program
+        """
+        timeout = SETTINGS.program_timeout if timeout == -1 else timeout
+        results = run_in_parallel({program_name: getattr(program_obj, action)
+                                   for program_name, program_obj in self.used_program_objs.items()
+                                   if program_names is None or program_name in program_names},
+                                  max_workers=SETTINGS.max_workers, timeout=timeout)
+        for program_name, result in results.items():
+            if result.success:
+                logger.info("%s: %s %s in %.2fs", self.project_name, action, program_name, result.duration)
+            else:
+                logger.error("%s: could not %s %s%s", self.project_name, action, program_name,
+                             " (%s)" % result.error if result.error else "")
+        return results
+
+    @traced
     def create_project(self):
         """ Creates a new project. See _initialize_project for how to
         initialize a project.
@@ -138,11 +257,14 @@ class Persister(Persistable):
             os.makedirs(self.persister_folder_path)
             return self._initialize_project()
 
+    @traced
     def add_program_to_project(self, program_name):
         """ Adds a program to the project
         """
         if os.path.exists(self.persister_folder_path):
-            if program_name in [program.CODE_NAME for program in programs.all_programs]:
+            # hidden programs, e.g. the fake one, can't be added, and neither can the ones not on this OS
+            if program_name in [program.CODE_NAME for program in programs.all_programs] \
+                    and program_name in programs.code_name_to_class:
                 if program_name in self.used_programs:
                     print('Program is already being used')
                 else:
@@ -150,22 +272,42 @@ class Persister(Persistable):
                     program = self._initialize_program_obj(program_name)
                     program.setup()
                     self.save()
+                    self._update_catalog()
                     print('Program successfully added to %s' % self.project_name)
             else:
                 sys.exit("No program with codename %s is available." % program_name)
         else:
             sys.exit("Error: project with the name %s does not exist" % self.project_name)
 
-    def launch_project(self):
+    @traced
+    def launch_project(self, update_settings=True):
         """ Opens a project
+
+        Args:
+            update_settings::bool
+                Whether to add the project to the open projects. Batches
+                of projects update them once at the end instead.
         """
         if os.path.exists(self.persister_folder_path):
-            self.used_desktop_obj.create_desktop()
-            self.used_desktop_obj.switch_to_desktop()
-            for program_name, program_obj in self.used_program_objs.items():
-                program_obj.start()
+            pinned = [program_name for program_name, program_obj in self.used_program_objs.items()
+                       if not program_obj.MOVES_WINDOW]
+            with _desktop_lock:
+                self.used_desktop_obj.create_desktop()
+                self.used_desktop_obj.switch_to_desktop()
+                # no other project may switch desktops until these are up
+                results = self._run_on_programs('start', timeout=None, program_names=pinned) if pinned else {}
+            # the rest are moved to the desktop together, once they are all up
+            with self.used_desktop_obj.batch_moves():
+                results.update(self._run_on_programs('start', timeout=None, program_names=[
+                    program_name for program_name in self.used_program_objs if program_name not in pinned]))
+            # the programs are already up, so the next project pays for its desktop now
+            with _desktop_lock:
+                self.used_desktop_obj.warm_up()
             self.save()
-            SETTINGS.add_open_project(self.project_name)
+            self._update_catalog(opened=True)
+            if update_settings:
+                SETTINGS.add_open_project(self.project_name)
+            return results
         elif os.path.exists(self.project_path):
             if askyn("Folder %s already exists, do you want to turn it into a persistd project?" % self.project_name):
                 return self._initialize_project()
@@ -175,43 +317,81 @@ class Persister(Persistable):
         else:
             sys.exit("Error: project with the name %s does not exist" % self.project_name)
 
+    @traced
     def remove_program_from_project(self, program_name):
         """ Removes a program from the project
         """
         if os.path.exists(self.persister_folder_path):
             if program_name in self.used_programs:
+                program = self.get_program_obj(program_name)
                 self.used_programs.remove(program_name)
-                program = self.used_program_objs[program_name]
+                del self._used_program_objs[program_name]
                 program.destroy()
                 self.save()
+                self._update_catalog()
                 print('Program successfully deleted from %s' % self.project_name)
             else:
                 sys.exit("The program with codename %s is not being used." % program_name)
         else:
             sys.exit("Error: project with the name %s does not exist" % self.project_name)
 
-    def persist_project(self):
+    @traced
+    def persist_project(self, only_changed=False):
         """ Persists a project without closing it
+
+        Args:
+            only_changed::bool
+                Whether to skip the programs that haven't changed since
+                they were last persisted
         """
         if os.path.exists(self.persister_folder_path):
-            for program_name, program_obj in self.used_program_objs.items():
-                program_obj.persist()
+            program_objs = self.used_program_objs
+            program_names = [program_name for program_name, program_obj in program_objs.items()
+                             if not only_changed or program_obj.has_changed()]
+            results = self._run_on_programs('persist', program_names=program_names)
+            for program_name, result in results.items():
+                if result.success:
+                    program_objs[program_name].mark_persisted()
             self.used_desktop_obj.persist_desktop()
+            self.save()
+            return results
         else:
             sys.exit("Error: project with the name %s does not exist" % self.project_name)
 
-    def close_project(self):
+    @traced
+    def close_project(self, update_settings=True, close_desktop=True):
         """ Closes a project
+
+        Args:
+            update_settings::bool
+                Whether to remove the project from the open projects.
+                Batches of projects update them once at the end instead.
+            close_desktop::bool
+                Whether to close the desktop too. If not, it should be
+                closed later with `close_desktop`.
         """
         if os.path.exists(self.persister_folder_path):
-            for program_name, program_obj in self.used_program_objs.items():
-                program_obj.close()
-            self.used_desktop_obj.close_desktop()
+            results = self._run_on_programs('close')
+            if close_desktop:
+                with _desktop_lock:
+                    self.used_desktop_obj.close_desktop()
             self.save()
-            SETTINGS.remove_open_project(self.project_name)
+            self._update_catalog()
+            if update_settings:
+                SETTINGS.remove_open_project(self.project_name)
+            return results
         else:
             sys.exit("Error: project with the name %s does not exist" % self.project_name)
 
+    @traced
+    def close_desktop(self):
+        """ Closes the desktop of the project, once its programs are closed
+        """
+        with _desktop_lock:
+            self.used_desktop_obj.close_desktop()
+        self.save()
+
+    @traced
     def delete_project(self):
         """ Deletes a project, given user input
         """
@@ -221,16 +401,19 @@ class Persister(Persistable):
             # only delete persistd files
             self.destroy()
             shutil.rmtree(self.persister_folder_path)
+            self._update_catalog()
             print("Deleted project files.")
         elif askyn("Are you sure you want to delete all files? This action cannot be undone!"):
             # delete all files
             self.destroy()
             shutil.rmtree(self.project_path)
+            get_catalog(self.base_path).remove(self.project_name)
             print("Deleted all files.")
         else:
             # chickened out
             print("Project not deleted.")
 
+    @traced
     def setup(self):
         """ Sets up the desktop and all the programs
         """
@@ -238,33 +421,141 @@ class Persister(Persistable):
         for used_program_key, used_program in self.used_program_objs.items():
             used_program.setup()
 
+    @traced
     def destroy(self):
         """ Destroys the desktop and all the programs
         """
         for used_program_key, used_program in self.used_program_objs.items():
             used_program.destroy()
-        if self.used_desktop_obj:
+        if self.used_desktop:
             self.used_desktop_obj.destroy()
 
+    def get_project_state(self):
+        """ Returns the state of the project, including the desktop and
+        all the programs. Objects that were never initialized keep the
+        state they were loaded with.
+        """
+        if self._used_desktop_obj is not None:
+            desktop_state = self._used_desktop_obj.get_state()
+        else:
+            desktop_state = self._desktop_state
+        program_states = {}
+        for program_name in self.used_programs:
+            if program_name in self._used_program_objs:
+                program_states[program_name] = self._used_program_objs[program_name].get_state()
+            elif program_name in self._program_states:
+                program_states[program_name] = self._program_states[program_name]
+        return {'version': STATE_VERSION,
+                'persister': self.get_state(),
+                'desktop': desktop_state,
+                'programs': program_states}
+
+    def _initialized_objs(self):
+        """ Returns the (key, object) pairs of the objects that may have changed
+        """
+        objs = [('persister', self)]
+        if self._used_desktop_obj is not None:
+            objs.append(('desktop', self._used_desktop_obj))
+        objs.extend(('program:%s' % program_name, program_obj)
+                    for program_name, program_obj in self._used_program_objs.items())
+        return objs
+
+    def _serialize(self, key, state, report):
+        """ Serializes a state to json, reusing the json from the last save
+        if the state has not changed since.
+        """
+        if key not in self._fragments:
+            self._fragments[key] = json.dumps(state)
+            report.objects_serialized += 1
+            report.bytes_serialized += len(self._fragments[key])
+        return self._fragments[key]
+
+    @traced
     def save(self, path=None):
-        """ Saves the variables to json
+        """ Saves the state of the project to a single json file. Does
+        nothing if no object changed since the last save, and only
+        serializes the objects that changed.
+
+        Returns:
+            report::SaveReport
+                How much was serialized and written
         """
-        path = path or self.persister_obj_path
-        save_dict_to_json(self, path, ['used_desktop_obj', 'used_program_objs'])
-        if self.used_desktop:
-            self.used_desktop_obj.save()
-        for program_name, program_obj in self.used_program_objs.items():
-            program_obj.save()
+        path = path or self.state_path
+        report = SaveReport()
+        dirty = [key for key, obj in self._initialized_objs() if obj.is_dirty()]
+        if not dirty and not self._legacy and path == self.state_path and os.path.exists(path):
+            logger.debug("%s: nothing changed, not saving", self.project_name)
+            return report
+        for key in dirty:
+            self._fragments.pop(key, None)
+
+        state = self.get_project_state()
+        programs_json = ', '.join('%s: %s' % (json.dumps(program_name),
+                                              self._serialize('program:%s' % program_name, program_state, report))
+                                  for program_name, program_state in state['programs'].items())
+        content = '{"version": %d, "persister": %s, "desktop": %s, "programs": {%s}}' % (
+            STATE_VERSION, self._serialize('persister', state['persister'], report),
+            self._serialize('desktop', state['desktop'], report), programs_json)
+        atomic_write(path, content)
+        report.files_written += 1
+        report.bytes_written += len(content)
 
+        for _, obj in self._initialized_objs():
+            obj.mark_clean()
+        self._desktop_state = state['desktop']
+        self._program_states = state['programs']
+        if self._legacy:
+            self._remove_legacy_files()
+            self._legacy = False
+        logger.info("%s: saved %d objects, %d bytes serialized, %d bytes written", self.project_name,
+                    report.objects_serialized, report.bytes_serialized, report.bytes_written)
+        return report
+
+    @traced
     def load(self, path=None):
-        """ Loads variables from json
+        """ Loads the state of the project. The desktop and program objects
+        are only initialized once they are accessed.
         """
-        path = path or self.persister_obj_path
-        load_dict_from_json(self, path)
-        if self.used_desktop:
-            self._initialize_desktop_obj()
-        self._initialize_program_objects()
-        if self.used_desktop:
-            self.used_desktop_obj.load()
-        for program_name, program_obj in self.used_program_objs.items():
-            program_obj.load()
+        path = path or self.state_path
+        if os.path.exists(path):
+            with open(path, 'r') as fp:
+                state = json.load(fp)
+            self._legacy = False
+        else:
+            state = self._read_legacy_state()
+            self._legacy = True
+        if state['version'] > STATE_VERSION:
+            raise ValueError("The project state at %s is from a newer version of persistd" % path)
+        self.set_state(state['persister'])
+        self.mark_clean()
+        self._used_desktop_obj = None
+        self._used_program_objs = {}
+        self._desktop_state = state['desktop']
+        self._program_states = state['programs']
+        self._fragments = {}
+
+    def _read_legacy_state(self):
+        """ Reads the state of a project that was saved with one json file
+        per object, in the same format as `get_state`.
+        """
+        def read(path):
+            with open(path, 'r') as fp:
+                return json.load(fp)
+
+        persister_state = read(self.persister_obj_path)
+        state = {'version': 0, 'persister': persister_state, 'desktop': None, 'programs': {}}
+        desktop = persister_state.get('used_desktop')
+        if desktop and os.path.exists(self._legacy_obj_path(desktop)):
+            state['desktop'] = read(self._legacy_obj_path(desktop))
+        for program_name in persister_state.get('used_programs', []):
+            if os.path.exists(self._legacy_obj_path(program_name)):
+                state['programs'][program_name] = read(self._legacy_obj_path(program_name))
+        return state
+
+    def _remove_legacy_files(self):
+        """ Removes the json files of the legacy layout once they are migrated
+        """
+        names = [name for name in [self.used_desktop] + self.used_programs if name]
+        for path in [self.persister_obj_path] + [self._legacy_obj_path(name) for name in names]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,235 @@
+""" Runs external commands on a shared asyncio event loop.
+
+The loop lives on a daemon thread, so commands can be started from any
+thread and waited on without blocking each other. Every command gets a
+timeout after which it is killed, at most `max_commands` of them run at
+the same time, and cancelling the future of a command kills it too.
+
+    runner = get_runner()
+    futures = [runner.submit(['taskkill', '-pid', str(pid)]) for pid in pids]
+    results = [future.result() for future in futures]
+"""
+import asyncio
+import functools
+import logging
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# The max length of a single line of output
+LINE_LIMIT = 2 ** 20
+
+
+@dataclass
+class CommandResult:
+    """ The outcome of a command run by `ProcessRunner`
+    """
+    return_code: Optional[int]
+    stdout: Optional[bytes]
+    pid: int
+    timed_out: bool = False
+
+
+class _ThreadedChildWatcher(asyncio.AbstractChildWatcher):
+    """ Waits for every command on a thread of its own, like the
+    ThreadedChildWatcher of Python 3.8+. The default watcher of Python 3.7
+    only works with the event loop of the main thread, and the loop of
+    `ProcessRunner` isn't on it.
+    """
+
+    def add_child_handler(self, pid, callback, *args):
+        loop = asyncio.get_event_loop()
+        threading.Thread(target=self._wait, args=(loop, pid, callback, args), name='persistd-waitpid-%d' % pid,
+                         daemon=True).start()
+
+    @staticmethod
+    def _wait(loop, pid, callback, args):
+        try:
+            _, status = os.waitpid(pid, 0)
+        except ChildProcessError:
+            # reaped by someone else, so its return code is unknown
+            logger.warning("Unknown child process (pid=%d)", pid)
+            return_code = 255
+        else:
+            if os.WIFSIGNALED(status):
+                return_code = -os.WTERMSIG(status)
+            elif os.WIFEXITED(status):
+                return_code = os.WEXITSTATUS(status)
+            else:
+                return_code = status
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(callback, pid, return_code, *args)
+
+    def remove_child_handler(self, pid):
+        return True
+
+    def attach_loop(self, loop):
+        pass
+
+    def is_active(self):
+        return True
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def _install_child_watcher():
+    asyncio.set_child_watcher(_ThreadedChildWatcher())
+
+
+class ProcessRunner:
+
+    def __init__(self, max_commands: Optional[int] = None):
+        """ Starts the event loop that runs the commands
+
+        Args:
+            max_commands::int
+                The max # of commands that run at the same time. If None,
+                uses the `max_commands` setting.
+        """
+        if max_commands is None:
+            from persistd.util.settings import SETTINGS
+            max_commands = SETTINGS.max_commands
+        self.max_commands = max(max_commands, 1)
+        # only the proactor loop can run subprocesses on Windows
+        self._loop = asyncio.ProactorEventLoop() if sys.platform == 'win32' else asyncio.new_event_loop()
+        if sys.platform != 'win32' and sys.version_info < (3, 8):
+            _install_child_watcher()
+        self._semaphore = None
+        self._thread = threading.Thread(target=self._run_loop, name='persistd-processes', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, command: List[str], input: Optional[bytes] = None, timeout: Optional[float] = None,
+               on_line: Optional[Callable[[str], None]] = None, env: Optional[Dict[str, str]] = None) -> Future:
+        """ Starts running a command
+
+        Args:
+            command::list(str)
+                The command to run. The first element in list is the
+                executable, the rest are the arguments
+            input::bytes
+                The input to be fed in as STDIN
+            timeout::float
+                The max # of seconds the command may run before it is
+                killed. If None, uses the `command_timeout` setting, and
+                if that is 0, waits indefinitely.
+            on_line::callable
+                Called with every line of the output as soon as it is
+                printed, on the thread of the event loop
+            env::dict(str, str)
+                The environment variables of the command. If None, it
+                inherits the ones of this process.
+
+        Returns:
+            future::concurrent.futures.Future
+                Resolves to a CommandResult. Cancelling it kills the
+                command.
+        """
+        if timeout is None:
+            from persistd.util.settings import SETTINGS
+            timeout = SETTINGS.command_timeout or None
+        return asyncio.run_coroutine_threadsafe(self._run(command, input, timeout, on_line, env), self._loop)
+
+    def run(self, command: List[str], input: Optional[bytes] = None, timeout: Optional[float] = None,
+            on_line: Optional[Callable[[str], None]] = None, env: Optional[Dict[str, str]] = None) -> CommandResult:
+        """ Runs a command and waits for it to finish. See `submit`.
+        """
+        future = self.submit(command, input=input, timeout=timeout, on_line=on_line, env=env)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. a KeyboardInterrupt, which shouldn't leave the command running
+            future.cancel()
+            raise
+
+    def close(self):
+        """ Kills the running commands and stops the event loop
+        """
+        def stop():
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.call_soon(self._loop.stop)
+
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(stop)
+            self._thread.join()
+        self._loop.close()
+
+    async def _run(self, command, input, timeout, on_line, env):
+        if self._semaphore is None:
+            # created here, so that it belongs to the loop
+            self._semaphore = asyncio.Semaphore(self.max_commands)
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=subprocess.PIPE if input else None, stdout=subprocess.PIPE, limit=LINE_LIMIT,
+                env=env)
+            try:
+                stdout = await asyncio.wait_for(self._communicate(process, input, on_line), timeout)
+            except asyncio.TimeoutError:
+                logger.error("%s (pid=%d) timed out after %.1fs", command[0], process.pid, timeout)
+                await self._kill(process)
+                return CommandResult(None, None, process.pid, timed_out=True)
+            except asyncio.CancelledError:
+                await self._kill(process)
+                raise
+            return CommandResult(process.returncode, stdout, process.pid)
+
+    @staticmethod
+    async def _communicate(process, input, on_line):
+        async def feed():
+            try:
+                process.stdin.write(input)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # the command exited without reading all of its input
+                pass
+            process.stdin.close()
+
+        feeder = asyncio.ensure_future(feed()) if input else None
+        lines = []
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            lines.append(line)
+            if on_line is not None:
+                try:
+                    on_line(line.decode('utf-8', errors='replace').rstrip('\r\n'))
+                except Exception:
+                    logger.exception("Could not handle a line of output")
+        if feeder is not None:
+            await feeder
+        await process.wait()
+        return b''.join(lines)
+
+    @staticmethod
+    async def _kill(process):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+
+@functools.lru_cache(maxsize=None)
+def get_runner() -> ProcessRunner:
+    """ Returns the process runner shared by the whole process
+    """
+    return ProcessRunner()
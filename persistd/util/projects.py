@@ -1,13 +1,35 @@
-import os
-from typing import List
+import fnmatch
+from typing import Iterable, Iterator, List
 
+from persistd.util.catalog import get_catalog
 from persistd.util.settings import SETTINGS
 
 
 def get_all_projects(base_path: str = SETTINGS.base_path, only_initialized: bool = False) -> List[str]:
-    projects = [d for d in next(os.walk(base_path))[1] if not d.startswith('.')]
-    if not only_initialized:
-        return projects
-    projects = [project_name for project_name in projects if
-                os.path.exists(os.path.join(base_path, project_name, '.persistd', 'pd.json'))]
-    return projects
+    return get_catalog(base_path).projects(only_initialized=only_initialized)
+
+
+def iter_projects(base_path: str = SETTINGS.base_path, only_initialized: bool = False) -> Iterator[str]:
+    """ Yields the projects as soon as they are known, instead of waiting
+    for a rescan of the base path to finish.
+    """
+    return get_catalog(base_path).iter_projects(only_initialized=only_initialized)
+
+
+def is_pattern(name: str) -> bool:
+    """ Whether a project name is a glob pattern, e.g. `work-*`
+    """
+    return any(char in name for char in '*?[')
+
+
+def match_projects(names: Iterable[str], candidates: Iterable[str]) -> List[str]:
+    """ Expands the glob patterns among the names against the candidate
+    projects. Plain names are kept as they are, and no project is listed twice.
+    """
+    candidates = list(candidates)
+    matched = []
+    for name in names:
+        for project in (fnmatch.filter(candidates, name) if is_pattern(name) else [name]):
+            if project not in matched:
+                matched.append(project)
+    return matched
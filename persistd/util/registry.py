@@ -0,0 +1,97 @@
+import importlib
+
+
+class LazyPlugin:
+
+    def __init__(self, module_name, code_name, human_readable_name):
+        """ A program or desktop plugin whose module is only imported once
+        something other than its names is needed.
+
+        Args:
+            module_name::str
+                The module that defines the plugin, e.g. its CODE_NAME,
+                HUMAN_READABLE_NAME and PROGRAM_CLASS or DESKTOP_CLASS
+            code_name::str
+                The CODE_NAME of the plugin
+            human_readable_name::str
+                The HUMAN_READABLE_NAME of the plugin
+        """
+        self.module_name = module_name
+        self.CODE_NAME = code_name
+        self.HUMAN_READABLE_NAME = human_readable_name
+
+    @property
+    def module(self):
+        return importlib.import_module(self.module_name)
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set above
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.module, name)
+
+    def __repr__(self):
+        return 'LazyPlugin(%r)' % self.module_name
+
+
+class LazyClassMap(dict):
+    """ A dict from code name to plugin class, which only imports the
+    module of a plugin when its class is looked up. Iterating over it
+    imports all the plugins. Plugins whose class is None (e.g. because
+    they are not available on this OS) are left out.
+    """
+
+    def __init__(self, plugins, class_attr):
+        super().__init__()
+        self._plugins = {plugin.CODE_NAME: plugin for plugin in plugins}
+        self._class_attr = class_attr
+
+    def __missing__(self, code_name):
+        plugin = self._plugins.get(code_name)
+        kls = getattr(plugin, self._class_attr) if plugin is not None else None
+        if kls is None:
+            raise KeyError(code_name)
+        self[code_name] = kls
+        return kls
+
+    def _load_all(self):
+        for code_name in self._plugins:
+            if not dict.__contains__(self, code_name):
+                try:
+                    self[code_name]
+                except KeyError:
+                    pass
+
+    def __contains__(self, code_name):
+        try:
+            self[code_name]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, code_name, default=None):
+        return self[code_name] if code_name in self else default
+
+    def __iter__(self):
+        self._load_all()
+        return super().__iter__()
+
+    def __len__(self):
+        self._load_all()
+        return super().__len__()
+
+    def keys(self):
+        self._load_all()
+        return super().keys()
+
+    def values(self):
+        self._load_all()
+        return super().values()
+
+    def items(self):
+        self._load_all()
+        return super().items()
+
+    def copy(self):
+        self._load_all()
+        return dict(super().items())
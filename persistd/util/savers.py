@@ -1,7 +1,18 @@
-import json
+import contextlib
 import os
+import tempfile
+import threading
 from shutil import copyfile
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
 
 def make_dirs(path):
     dest_dir = os.path.dirname(path)
@@ -10,22 +21,91 @@ def make_dirs(path):
     return True
 
 
-def save_dict_to_json(obj, path, excluded_keys=[]):
-    """ Saves the dictionary object of an object to a json file
+def file_mtime(path):
+    """ The mtime of a file in ns, or None if it doesn't exist
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def object_state(obj, excluded_keys=[]):
+    """ Returns the dictionary object of an object to be persisted
+
+    Optionally excludes the given keys. Private attributes, i.e. the ones
+    starting with an underscore, are never persisted.
+    """
+    return {key: value for key, value in obj.__dict__.items()
+            if key not in excluded_keys and not key.startswith('_')}
+
+
+def atomic_write(path, content):
+    """ Writes a string to a file atomically, so that readers and crashes
+    only ever see either the old or the new content.
 
-    Optionally excludes the given keys
+    The content is written to a temporary file in the same folder, synced
+    to disk, and then renamed over the destination. Bytes are written as
+    they are.
     """
     make_dirs(path)
-    persisted_dict = {key: value for key, value in obj.__dict__.items() if key not in excluded_keys}
-    with open(path, 'w') as fp:
-        json.dump(persisted_dict, fp)
+    fd, temp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), suffix='.tmp',
+                                     dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(content, bytes) else 'w') as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+# the lock files held by the current thread
+_held_file_locks = threading.local()
 
 
-def load_dict_from_json(obj, path):
-    """ Loads the dictionary object of an object from a json file
+@contextlib.contextmanager
+def file_lock(path):
+    """ Holds an exclusive lock on a file across processes and threads.
+    The lock is taken on a `.lock` file next to it, so that the file
+    itself can still be replaced atomically. A thread that already holds
+    the lock can take it again.
     """
-    with open(path, 'r') as fp:
-        obj.__dict__.update(json.load(fp))
+    lock_path = os.path.abspath(path) + '.lock'
+    held = _held_file_locks.__dict__.setdefault('paths', set())
+    if lock_path in held:
+        yield
+        return
+    with _file_locks_lock:
+        thread_lock = _file_locks.setdefault(lock_path, threading.Lock())
+    make_dirs(lock_path)
+    with thread_lock, open(lock_path, 'a+') as fp:
+        if msvcrt is not None:
+            fp.seek(0)
+            while True:
+                try:
+                    # gives up after ~10 secs, so keep trying
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        elif fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        held.add(lock_path)
+        try:
+            yield
+        finally:
+            held.discard(lock_path)
+            if msvcrt is not None:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+            elif fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
 
 
 def copy_file(src, dest):
@@ -0,0 +1,93 @@
+import dataclasses
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Optional
+
+# The # of threads that check project folders at the same time. Checks
+# mostly wait on the file system, so this can be well above the # of CPUs
+DEFAULT_SCAN_WORKERS = 16
+
+
+@dataclasses.dataclass
+class ProjectEntry:
+    name: str
+    initialized: bool = False
+    desktop: Optional[str] = None
+    programs: List[str] = dataclasses.field(default_factory=list)
+    last_opened: Optional[float] = None
+
+
+def is_initialized(project_path: str) -> bool:
+    """ Whether a persistd project has been initialized at the given path
+    """
+    persistd_path = os.path.join(project_path, '.persistd')
+    # pd.json is the legacy layout, from before state.json
+    return (os.path.exists(os.path.join(persistd_path, 'state.json'))
+            or os.path.exists(os.path.join(persistd_path, 'pd.json')))
+
+
+def read_project_entry(base_path: str, name: str) -> ProjectEntry:
+    """ Builds the catalog entry of a project from its files
+    """
+    persistd_path = os.path.join(base_path, name, '.persistd')
+    entry = ProjectEntry(name=name)
+    # Try the files directly instead of checking if they exist first,
+    # which saves a round trip per project on network file systems
+    for filename in ['state.json', 'pd.json']:
+        try:
+            with open(os.path.join(persistd_path, filename), 'r') as fp:
+                content = fp.read()
+        except OSError:
+            continue
+        entry.initialized = True
+        try:
+            persister_state = json.loads(content)
+            if filename == 'state.json':
+                persister_state = persister_state['persister']
+            entry.desktop = persister_state.get('used_desktop')
+            entry.programs = list(persister_state.get('used_programs', []))
+        except (ValueError, KeyError, AttributeError):
+            pass
+        break
+    return entry
+
+
+def list_project_names(base_path: str) -> List[str]:
+    """ Lists the (non-hidden) project folders under the base path
+
+    Uses the file types cached by `os.scandir`, so no folder is stat'ed
+    """
+    with os.scandir(base_path) as it:
+        return [entry.name for entry in it if not entry.name.startswith('.') and entry.is_dir()]
+
+
+def scan_projects(base_path: str, names: Optional[Iterable[str]] = None,
+                  max_workers: int = DEFAULT_SCAN_WORKERS) -> Iterator[ProjectEntry]:
+    """ Reads the entries of projects on a pool of threads, so that the
+    latency of a network file system overlaps.
+
+    Args:
+        base_path::str
+            The path to the base directory of all projects
+        names::iterable(str)
+            The projects to read. If None, reads all projects.
+        max_workers::int
+            The max # of projects that are read at the same time
+
+    Yields:
+        entry::ProjectEntry
+            The entry of each project, as soon as it has been read
+    """
+    names = list_project_names(base_path) if names is None else list(names)
+    if not names:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(read_project_entry, base_path, name) for name in names]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # the caller stopped early
+            for future in futures:
+                future.cancel()
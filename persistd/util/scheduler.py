@@ -0,0 +1,147 @@
+import dataclasses
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from persistd.util.savers import file_mtime
+from persistd.util.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class CycleReport:
+    """ What a single auto-persist cycle did
+    """
+    duration: float = 0.0
+    # the # of seconds each project took
+    project_durations: Dict[str, float] = dataclasses.field(default_factory=dict)
+    programs_persisted: int = 0
+    programs_skipped: int = 0
+    failures: List[str] = dataclasses.field(default_factory=list)
+
+
+class AutoPersister:
+
+    def __init__(self, get_persister: Optional[Callable] = None, lock=None, interval: Optional[float] = None,
+                 jitter: Optional[float] = None, rate: Optional[float] = None,
+                 clock=time.monotonic, random_func=random.uniform):
+        """ Initializes a scheduler that persists all open projects
+        periodically. Only the programs that changed since they were
+        last persisted are persisted again.
+
+        Args:
+            get_persister::callable
+                Returns the persister of a project name. If None, each
+                project is kept in memory, and loaded again once its
+                state is changed by another process.
+            lock::threading.Lock
+                Held while a project is persisted, e.g. so that it doesn't
+                run at the same time as a command of the daemon
+            interval::float
+                The # of seconds between cycles. If None, uses the
+                `auto_persist_interval` setting.
+            jitter::float
+                The fraction by which each interval is randomly changed,
+                so that many schedulers don't all run at once. If None,
+                uses the `auto_persist_jitter` setting.
+            rate::float
+                The max # of projects persisted per second, so that many
+                open projects don't cause a spike. If None, uses the
+                `auto_persist_rate` setting.
+        """
+        self._get_persister = get_persister or self._load_persister
+        # project name -> (persister, mtime of its state file)
+        self._persisters = {}
+        self._lock = lock or threading.Lock()
+        self.interval = SETTINGS.auto_persist_interval if interval is None else interval
+        self.jitter = SETTINGS.auto_persist_jitter if jitter is None else jitter
+        self.rate = SETTINGS.auto_persist_rate if rate is None else rate
+        self._clock = clock
+        self._random = random_func
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_persister(self, project_name):
+        from persistd.util.persister import Persister
+
+        cached = self._persisters.get(project_name)
+        if cached is not None:
+            persister, mtime = cached
+            if mtime == file_mtime(persister.state_path):
+                return persister
+        persister = Persister(SETTINGS.base_path, project_name)
+        self._persisters[project_name] = (persister, file_mtime(persister.state_path))
+        return persister
+
+    def next_delay(self) -> float:
+        """ The # of seconds until the next cycle, with jitter
+        """
+        return max(self.interval * (1 + self._random(-self.jitter, self.jitter)), 0)
+
+    def run_cycle(self) -> CycleReport:
+        """ Persists the changed programs of every open project, one
+        project at a time and at most `rate` projects per second.
+        """
+        report = CycleReport()
+        # other processes open and close projects
+        SETTINGS.refresh()
+        for project_name in set(self._persisters) - set(SETTINGS.open_projects):
+            del self._persisters[project_name]
+        start = self._clock()
+        min_gap = 1 / self.rate if self.rate > 0 else 0
+        last_start = None
+        for project_name in list(SETTINGS.open_projects):
+            if last_start is not None:
+                # rate limit, but stop waiting as soon as the scheduler is stopped
+                wait = last_start + min_gap - self._clock()
+                if wait > 0 and self._stop.wait(wait):
+                    break
+            last_start = self._clock()
+            try:
+                with self._lock:
+                    persister = self._get_persister(project_name)
+                    total = len(persister.used_programs)
+                    results = persister.persist_project(only_changed=True)
+                    if project_name in self._persisters:
+                        # the state file was written by this process
+                        self._persisters[project_name] = (persister, file_mtime(persister.state_path))
+            except (Exception, SystemExit) as err:
+                logger.error("Could not auto-persist %s: %s", project_name, err)
+                report.failures.append(project_name)
+                continue
+            finally:
+                report.project_durations[project_name] = self._clock() - last_start
+            report.programs_persisted += sum(result.success for result in results.values())
+            report.programs_skipped += total - len(results)
+            report.failures.extend('%s:%s' % (project_name, program_name)
+                                   for program_name, result in results.items() if not result.success)
+        report.duration = self._clock() - start
+        logger.info("Auto-persisted %d projects in %.2fs: %d programs persisted, %d skipped, %d failures",
+                    len(report.project_durations), report.duration, report.programs_persisted,
+                    report.programs_skipped, len(report.failures))
+        return report
+
+    def run_forever(self):
+        """ Runs cycles until `stop` is called
+        """
+        while not self._stop.wait(self.next_delay()):
+            self.run_cycle()
+
+    def start(self):
+        """ Runs cycles on a background thread
+        """
+        if self.interval <= 0:
+            raise ValueError("Auto-persist needs an interval above 0")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='persistd-auto-persist', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -1,17 +1,16 @@
 from __future__ import annotations
 
 import dataclasses
+import json
 import os
-from typing import Optional, List
-
-from dataclasses_json import dataclass_json
+from typing import Callable, Optional, List
 
 from persistd.util.paths import SETTINGS_PATH
+from persistd.util.savers import atomic_write, file_lock
 
 LOCAL_SETTINGS_PATH = os.path.join(SETTINGS_PATH, 'local.json')
 
 
-@dataclass_json
 @dataclasses.dataclass
 class Settings:
     base_path: str = "C:\\Users\\doruk\\Desktop\\Playground"
@@ -22,6 +21,60 @@ class Settings:
     conemu_path: str = "C:\\Tools\\ConEmu\\ConEmu64.exe"
     chrome_path: str = "C:\\Program Files (x86)\\Google\\Chrome\\Application\\chrome.exe"
     vscode_path: str = "C:\\Users\\doruk\\AppData\\Local\\Programs\\Microsoft VS Code\\Code.exe"
+    # The id of the persistd Chrome extension, which lets it connect to
+    # persistd. If empty, Chrome is controlled by opening special URLs
+    chrome_extension_id: str = ""
+    # How Chrome restores the tabs of a project: 'eager' loads them all at
+    # once, 'lazy' only loads a tab once it is focused, and 'waves' loads
+    # them a few at a time in the background
+    chrome_restore_mode: str = "lazy"
+    # The max # of tabs that load at the same time in the 'waves' mode
+    chrome_max_loading_tabs: int = 4
+    # The # of minutes after which tabs that weren't looked at are
+    # unloaded. If 0, tabs are never unloaded
+    chrome_discard_after: float = 0.0
+
+    # Concurrency
+    # The max # of programs that are operated on at the same time
+    max_workers: int = 4
+    # The max # of seconds a program may take to persist or close
+    program_timeout: float = 30.0
+    # The max # of external commands that run at the same time
+    max_commands: int = 8
+    # The max # of seconds an external command may run before it is
+    # killed. If 0, commands are waited on indefinitely
+    command_timeout: float = 120.0
+
+    # Desktops
+    # The max # of seconds to wait for the window of a launched program
+    window_timeout: float = 10.0
+    # The command that starts a long-lived desktop helper, which speaks
+    # the protocol in desktops/desktop_helper.py. None ships for Windows
+    # yet. If empty, every desktop operation runs its own process
+    desktop_helper_command: List[str] = dataclasses.field(default_factory=list)
+    # The max # of seconds to wait for the desktop helper to answer,
+    # before it is killed. If 0, it is waited on indefinitely
+    desktop_helper_timeout: float = 30.0
+    # The # of empty desktops kept ready for projects that open. If 0,
+    # every project creates its own desktop and removes it once closed
+    desktop_pool_size: int = 0
+    # The max # of seconds a snapshot of the desktops and their windows
+    # is used for looking up desktops before the desktops are listed again
+    desktop_cache_age: float = 2.0
+
+    # Auto-persist
+    # The # of seconds between snapshots of the open projects. If 0, they
+    # are only persisted when asked to
+    auto_persist_interval: float = 0.0
+    # The fraction by which each interval is randomly stretched or shrunk
+    auto_persist_jitter: float = 0.1
+    # The max # of projects persisted per second
+    auto_persist_rate: float = 2.0
+
+    # Diagnostics
+    # The file that every command appends its trace to, as json lines.
+    # If empty, commands are only traced with --profile or --trace
+    trace_path: str = ""
 
     # Projects
     open_projects: List[str] = dataclasses.field(default_factory=list)
@@ -30,43 +83,119 @@ class Settings:
     def field_names(cls):
         return [field for field in cls.__dataclass_fields__]
 
+    def to_json(self, indent: Optional[int] = None) -> str:
+        return json.dumps(dataclasses.asdict(self), indent=indent)
+
+    @classmethod
+    def from_json(cls, content: str) -> Settings:
+        # Unknown keys are ignored, e.g. settings of a newer version
+        values = json.loads(content)
+        return cls(**{name: value for name, value in values.items() if name in cls.__dataclass_fields__})
+
+    @staticmethod
+    def _signature(json_file: str):
+        """ Changes whenever the file is replaced, or None if there is no file
+        """
+        try:
+            stat = os.stat(json_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _mark_synced(self, json_file: str, content: Optional[str]):
+        # not fields, so they're never saved
+        self._synced_signature = self._signature(json_file)
+        self._synced_content = content
+
     @staticmethod
     def load(json_file: str = LOCAL_SETTINGS_PATH, missing_ok: bool = False) -> Settings:
-        if not os.path.exists(json_file):
+        # Reads don't lock, as the file is only ever replaced atomically
+        signature = Settings._signature(json_file)
+        if signature is None:
             if missing_ok:
                 return Settings(file_path=json_file)
             raise ValueError(f"There is no settings file at {json_file}")
         with open(json_file, 'r') as fp:
             content = fp.read()
-            if not content:
-                if missing_ok:
-                    return Settings(file_path=json_file)
-                raise ValueError(f"The settings file is empty at {json_file}")
-            return Settings.from_json(content)
+        if not content:
+            if missing_ok:
+                return Settings(file_path=json_file)
+            raise ValueError(f"The settings file is empty at {json_file}")
+        settings = Settings.from_json(content)
+        settings._synced_signature = signature
+        settings._synced_content = content
+        return settings
+
+    def refresh(self) -> bool:
+        """ Reloads the settings if their file changed since they were
+        last loaded or saved, e.g. by another process. Changes that
+        weren't saved are replaced by the ones in the file.
+
+        Returns:
+            reloaded::bool
+                Whether the settings were reloaded
+        """
+        signature = self._signature(self.file_path)
+        if signature is None or signature == self.__dict__.get('_synced_signature'):
+            return False
+        self.__dict__.update(Settings.load(self.file_path, missing_ok=True).__dict__)
+        return True
 
     def save(self, json_file: Optional[str] = None) -> Settings:
+        """ Writes the settings, unless the file already has the same content
+        """
         file_path = json_file if json_file else self.file_path
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'w') as fp:
-            fp.write(self.to_json(indent=4))
+        content = self.to_json(indent=4)
+        if (file_path == self.file_path and content == self.__dict__.get('_synced_content')
+                and self._signature(file_path) == self.__dict__.get('_synced_signature')):
+            return self
+        with file_lock(file_path):
+            atomic_write(file_path, content)
+            if file_path == self.file_path:
+                self._mark_synced(file_path, content)
+        return self
+
+    def update(self, change: Callable[[Settings], None]) -> Settings:
+        """ Changes the settings and saves them as a single atomic step,
+        so that concurrent processes don't lose each other's changes.
+
+        The settings are locked, brought up to date with their file if
+        another process changed it, changed and only then saved.
+
+        Args:
+            change::callable
+                Changes the settings it is given in place. It can raise
+                to abort the update.
+        """
+        with file_lock(self.file_path):
+            self.refresh()
+            change(self)
+            self.save()
         return self
 
     def add_open_project(self, project: str, save: bool = True) -> Settings:
-        if project in self.open_projects:
-            raise ValueError("This project is already open!")
-        self.open_projects.append(project)
+        def add(settings):
+            if project in settings.open_projects:
+                raise ValueError("This project is already open!")
+            settings.open_projects.append(project)
+
         if save:
-            self.save()
+            return self.update(add)
+        add(self)
         return self
 
     def remove_open_project(self, project: str, save: bool = True) -> Settings:
-        if project not in self.open_projects:
-            raise ValueError("This project is not open!")
-        self.open_projects.remove(project)
+        def remove(settings):
+            if project not in settings.open_projects:
+                raise ValueError("This project is not open!")
+            settings.open_projects.remove(project)
+
         if save:
-            self.save()
+            return self.update(remove)
+        remove(self)
         return self
 
 
-# Initialize the settings singleton
-SETTINGS = Settings.load(missing_ok=True).save()
+# Initialize the settings singleton. It is only written once it changes,
+# so importing persistd doesn't touch the disk
+SETTINGS = Settings.load(missing_ok=True)
@@ -0,0 +1,119 @@
+""" Renders the template files of programs into projects.
+
+The default templates ship with the code under `programs/<program>/`,
+and are put into the data path the first time they are used, so that
+users can edit them. Templates are `string.Template`s, rendered with the
+variables of the project, e.g. `${project_name}` and `${project_path}`.
+
+Rendered files are only written when their content changed, so setting a
+program up again in a project that is already current costs a stat, and
+a read if the size matches, per file. Templates themselves are cached
+until their file changes.
+"""
+import os
+import string
+import threading
+from typing import Dict, List
+
+from persistd.util.paths import CODE_PATH, PROGRAMS_PATH
+from persistd.util.savers import atomic_write
+
+# template path -> (signature of the file, its content)
+_template_cache = {}
+_lock = threading.Lock()
+
+
+def _signature(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read(path):
+    # keeps the line endings of the template
+    with open(path, 'r', encoding='utf-8', newline='') as fp:
+        return fp.read()
+
+
+def load_template(program_folder: str, filename: str) -> str:
+    """ Returns the content of a template. The edited copy in the data
+    path is used if there is one; otherwise the default is put there.
+
+    Args:
+        program_folder::str
+            The folder of the program under `programs/`, e.g. `conemu`
+        filename::str
+            The file name of the template
+    """
+    path = os.path.join(PROGRAMS_PATH, program_folder, filename)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        content = _read(os.path.join(CODE_PATH, 'programs', program_folder, filename))
+        atomic_write(path, content.encode('utf-8'))
+        stat = os.stat(path)
+        with _lock:
+            _template_cache[path] = (_signature(stat), content)
+        return content
+    with _lock:
+        cached = _template_cache.get(path)
+    if cached is not None and cached[0] == _signature(stat):
+        return cached[1]
+    content = _read(path)
+    with _lock:
+        _template_cache[path] = (_signature(stat), content)
+    return content
+
+
+def render_template(template: str, variables: Dict[str, str]) -> str:
+    """ Substitutes the variables into a template. Placeholders that
+    aren't variables are left as they are.
+    """
+    return string.Template(template).safe_substitute(variables)
+
+
+def _is_current(path, content):
+    try:
+        if os.stat(path).st_size != len(content):
+            return False
+        with open(path, 'rb') as fp:
+            current = fp.read()
+    except FileNotFoundError:
+        return False
+    return current == content
+
+
+def write_if_changed(files: Dict[str, str]) -> List[str]:
+    """ Writes files whose content differs from what's on disk, creating
+    their folders if needed
+
+    Args:
+        files::dict(str, str)
+            A mapping from file path to its content
+
+    Returns:
+        written::list(str)
+            The paths that were written
+    """
+    encoded = {path: content.encode('utf-8') for path, content in files.items()}
+    changed = {path: content for path, content in encoded.items() if not _is_current(path, content)}
+    for path, content in changed.items():
+        atomic_write(path, content)
+    return list(changed)
+
+
+def provision_templates(program_folder: str, templates: Dict[str, str], variables: Dict[str, str]) -> List[str]:
+    """ Renders the templates of a program into a project
+
+    Args:
+        program_folder::str
+            The folder of the program under `programs/`
+        templates::dict(str, str)
+            A mapping from template file name to the path it is rendered to
+        variables::dict(str, str)
+            The variables of the project
+
+    Returns:
+        written::list(str)
+            The paths that were written
+    """
+    return write_if_changed({path: render_template(load_template(program_folder, filename), variables)
+                             for filename, path in templates.items()})
@@ -0,0 +1,231 @@
+""" Lightweight tracing of where the time of a persistd command goes.
+
+A span covers a single call, e.g. `Persister.launch_project` or a
+subprocess, and records its duration and counters such as the # of
+subprocesses, retries and seconds slept. Spans nest per thread, and the
+tasks of `run_in_parallel` are nested under the span that started them.
+Like durations, counters include those of nested spans, which are added
+to their parent when they end, so that e.g. `Persister.close_project`
+shows every subprocess run to close a project.
+
+Tracing is off unless `TRACER.enable()` is called, in which case every
+finished span is written as a line of json, and a summary table can be
+printed at the end. When it is off, spans cost a single check. Only the
+latest spans are kept in memory, so that long running processes such as
+the daemon don't grow, but the summary covers all of them.
+"""
+import contextlib
+import functools
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+# The counters shown in the summary table
+SUMMARY_COUNTERS = ['subprocesses', 'retries', 'sleep_seconds']
+
+# The max # of finished spans kept in memory
+MAX_SPANS = 10000
+
+
+class Span:
+
+    def __init__(self, span_id, name, parent, attrs):
+        self.id = span_id
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.counters = defaultdict(float)
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def to_dict(self):
+        return {'id': self.id,
+                'parent': self.parent.id if self.parent is not None else None,
+                'name': self.name,
+                'thread': self.thread,
+                'start': self.start,
+                'duration': self.duration,
+                'attrs': self.attrs,
+                'counters': dict(self.counters),
+                'error': self.error}
+
+
+class Tracer:
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self.enabled = False
+        # the latest finished spans
+        self.spans = deque(maxlen=max_spans)
+        # span name -> the summary row of all spans with that name
+        self._rows = {}
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def enable(self, trace_path: Optional[str] = None):
+        """ Starts tracing
+
+        Args:
+            trace_path::str
+                The file to append a json line to for every finished
+                span. If None, spans are only kept in memory.
+        """
+        if trace_path:
+            self._file = open(trace_path, 'a')
+        self.enabled = True
+        return self
+
+    def disable(self):
+        self.enabled = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def current(self) -> Optional[Span]:
+        """ The innermost open span of this thread
+        """
+        stack = self._local.__dict__.get('stack')
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def attach(self, parent: Optional[Span]):
+        """ Nests the spans of this thread under a span of another thread
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        if parent is None:
+            yield
+            return
+        stack.append(parent)
+        try:
+            yield
+        finally:
+            stack.remove(parent)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """ Records the duration of the code it wraps
+        """
+        if not self.enabled:
+            yield None
+            return
+        stack = self._local.__dict__.setdefault('stack', [])
+        span = Span(next(self._ids), name, stack[-1] if stack else None, attrs)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.error = repr(err)
+            raise
+        finally:
+            stack.pop()
+            span.duration = time.perf_counter() - span._started
+            self._finish(span)
+
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+            row = self._rows.get(span.name)
+            if row is None:
+                row = self._rows[span.name] = dict({'name': span.name, 'calls': 0, 'total': 0.0, 'max': 0.0,
+                                                    'errors': 0}, **{counter: 0 for counter in SUMMARY_COUNTERS})
+            row['calls'] += 1
+            row['total'] += span.duration
+            row['max'] = max(row['max'], span.duration)
+            row['errors'] += span.error is not None
+            for counter in SUMMARY_COUNTERS:
+                row[counter] += span.counters.get(counter, 0)
+            if span.parent is not None:
+                for counter, value in span.counters.items():
+                    span.parent.counters[counter] += value
+            if self._file is not None:
+                self._file.write(json.dumps(span.to_dict(), default=str) + '\n')
+                self._file.flush()
+
+    def count(self, counter: str, value: float = 1):
+        """ Adds to a counter of the innermost span, e.g. `retries`
+        """
+        if self.enabled:
+            span = self.current()
+            if span is not None:
+                # the spans of parallel tasks add to their parent too
+                with self._lock:
+                    span.counters[counter] += value
+
+    def clear(self):
+        """ Forgets the finished spans, and their summary
+        """
+        with self._lock:
+            self.spans.clear()
+            self._rows.clear()
+
+    def summary(self) -> List[Dict]:
+        """ Aggregates the finished spans by name, slowest first
+        """
+        with self._lock:
+            rows = [dict(row) for row in self._rows.values()]
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+    def format_summary(self) -> str:
+        """ The summary as a table
+        """
+        rows = self.summary()
+        width = max([len(row['name']) for row in rows] + [4])
+        lines = ['%-*s %6s %9s %9s %6s %8s %8s %7s' % (width, 'span', 'calls', 'total(s)', 'max(s)', 'errors',
+                                                        'subproc', 'retries', 'slept')]
+        for row in rows:
+            lines.append('%-*s %6d %9.3f %9.3f %6d %8d %8d %7.2f' % (
+                width, row['name'], row['calls'], row['total'], row['max'], row['errors'],
+                row['subprocesses'], row['retries'], row['sleep_seconds']))
+        return '\n'.join(lines)
+
+
+# The tracer of the process
+TRACER = Tracer()
+
+
+def traced(func=None, name: Optional[str] = None):
+    """ Wraps a function or method in a span. Methods are named after the
+    class of the object they're called on, e.g. `Chrome.start`.
+    """
+    if func is None:
+        return functools.partial(traced, name=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TRACER.enabled:
+            return func(*args, **kwargs)
+        if name is not None:
+            span_name = name
+        elif args and hasattr(args[0], func.__name__):
+            span_name = '%s.%s' % (type(args[0]).__name__, func.__name__)
+        else:
+            span_name = func.__qualname__
+        with TRACER.span(span_name):
+            return func(*args, **kwargs)
+
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def trace_methods(cls, method_names):
+    """ Wraps the given methods that a class defines in spans. Used by
+    base classes to trace the methods of every subclass.
+    """
+    for method_name in method_names:
+        method = cls.__dict__.get(method_name)
+        if callable(method) and not getattr(method, '__traced__', False):
+            setattr(cls, method_name, traced(method))
+
+
+def sleep(seconds: float):
+    """ Sleeps, and counts the time slept towards the current span
+    """
+    TRACER.count('sleep_seconds', seconds)
+    time.sleep(seconds)
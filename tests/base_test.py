@@ -1,9 +1,19 @@
 import os
+import tempfile
 import unittest
+from unittest import mock
+
+from persistd.util import catalog
 
 TEST_DIR = os.path.dirname(__file__)
 TEST_DATA_DIR = os.path.join(TEST_DIR, 'data')
 
 
 class BaseTest(unittest.TestCase):
-    ...
+
+    def run(self, result=None):
+        # projects keep their catalogs up to date, which shouldn't end up in the real data path
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(catalog, 'CATALOGS_PATH', os.path.join(temp_dir, 'catalogs')), \
+                mock.patch.dict(catalog._catalogs, clear=True):
+            return super().run(result)
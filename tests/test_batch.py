@@ -0,0 +1,89 @@
+import os
+import tempfile
+from unittest import mock
+
+from persistd import persist
+from persistd.desktops.fake_desktop import FakeDesktop
+from persistd.util import settings as settings_module
+from persistd.util.batch import run_on_projects
+from persistd.util.persister import Persister
+from persistd.util.settings import SETTINGS
+from tests.base_test import BaseTest
+
+PROJECTS = ['a', 'b', 'c']
+
+
+class BatchTest(BaseTest):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base_path = os.path.join(self.temp_dir.name, 'projects')
+        for name, value in [('base_path', self.base_path), ('open_projects', []),
+                            ('file_path', os.path.join(self.temp_dir.name, 'settings.json'))]:
+            patch = mock.patch.object(SETTINGS, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        for project_name in PROJECTS:
+            persister = Persister(self.base_path, project_name)
+            os.makedirs(persister.persister_folder_path)
+            persister.used_desktop = 'fake_desktop'
+            persister.used_programs = ['fake']
+            persister.save()
+
+    def test_open_and_close(self):
+        with mock.patch.object(settings_module, 'atomic_write', wraps=settings_module.atomic_write) as write:
+            results = run_on_projects('open', PROJECTS, max_workers=2)
+        self.assertTrue(all(result.success for result in results.values()))
+        self.assertListEqual(sorted(SETTINGS.open_projects), PROJECTS)
+        # the open projects are written once
+        write.assert_called_once()
+
+        results = run_on_projects('persist', ['a', 'b'])
+        self.assertTrue(all(result.success for result in results.values()))
+
+        results = run_on_projects('close', ['a', 'b'])
+        self.assertTrue(all(result.success for result in results.values()))
+        self.assertListEqual(SETTINGS.open_projects, ['c'])
+        self.assertIsNone(Persister(self.base_path, 'a').get_program_obj('fake').pid)
+
+    def test_failures(self):
+        SETTINGS.open_projects.append('a')
+        results = run_on_projects('open', ['a', 'b', 'missing'])
+        self.assertFalse(results['a'].success)
+        self.assertTrue(results['b'].success)
+        self.assertFalse(results['missing'].success)
+        self.assertListEqual(SETTINGS.open_projects, ['a', 'b'])
+
+        with self.assertRaises(ValueError):
+            run_on_projects('delete', ['a'])
+
+    def test_desktop_setup_fails(self):
+        run_on_projects('open', PROJECTS)
+        setup = FakeDesktop.setup
+        closed = []
+
+        def fail_setup(desktop):
+            return desktop.project_name != 'b' and setup(desktop)
+
+        def close_desktop(persister):
+            closed.append(persister.project_name)
+            return persister.used_desktop_obj.close_desktop()
+
+        with mock.patch.object(FakeDesktop, 'setup', autospec=True, side_effect=fail_setup), \
+                mock.patch.object(Persister, 'close_desktop', autospec=True, side_effect=close_desktop):
+            results = run_on_projects('close', PROJECTS)
+        self.assertTrue(results['a'].success)
+        self.assertTrue(results['c'].success)
+        # the other desktops are still closed, and the broken one is tried last
+        self.assertListEqual(sorted(closed[:2]), ['a', 'c'])
+        self.assertEqual(closed[2:], ['b'])
+        self.assertNotIn('a', SETTINGS.open_projects)
+        self.assertNotIn('c', SETTINGS.open_projects)
+
+    def test_command_line(self):
+        with mock.patch.object(persist, 'get_daemon_client', return_value=None):
+            persist.parse_args(['*'])
+            self.assertListEqual(sorted(SETTINGS.open_projects), PROJECTS)
+            persist.parse_args(['-p', 'a', 'b'])
+            persist.parse_args(['--close-all'])
+            self.assertListEqual(SETTINGS.open_projects, [])
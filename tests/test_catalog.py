@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from persistd.util import catalog, scanner
+from persistd.util.catalog import ProjectCatalog, ProjectEntry
+from tests.base_test import BaseTest
+
+
+class CatalogTest(BaseTest):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base_path = os.path.join(self.temp_dir.name, 'projects')
+        self.catalog_path = os.path.join(self.temp_dir.name, 'catalog.json')
+        for name in ['b', 'a', '.hidden']:
+            os.makedirs(os.path.join(self.base_path, name))
+        os.makedirs(os.path.join(self.base_path, 'a', '.persistd'))
+        with open(os.path.join(self.base_path, 'a', '.persistd', 'state.json'), 'w') as fp:
+            json.dump({'version': 1, 'persister': {'used_desktop': 'd', 'used_programs': ['p']},
+                       'desktop': None, 'programs': {}}, fp)
+
+    def test_projects(self):
+        projects = ProjectCatalog(self.base_path, self.catalog_path)
+        self.assertListEqual(projects.projects(), ['a', 'b'])
+        self.assertListEqual(projects.projects(only_initialized=True), ['a'])
+        self.assertEqual(projects.entries['a'], ProjectEntry('a', True, 'd', ['p']))
+
+    def test_incremental_refresh(self):
+        ProjectCatalog(self.base_path, self.catalog_path).projects()
+
+        # an unchanged base path is listed from the catalog file alone
+        with mock.patch.object(scanner, 'read_project_entry') as read_entry, \
+                mock.patch('persistd.util.catalog.list_project_names') as list_names:
+            self.assertListEqual(ProjectCatalog(self.base_path, self.catalog_path).projects(), ['a', 'b'])
+            read_entry.assert_not_called()
+            list_names.assert_not_called()
+
+        # only the new project is read
+        os.makedirs(os.path.join(self.base_path, 'c'))
+        os.utime(self.base_path, ns=(0, 10 ** 9))
+        with mock.patch.object(scanner, 'read_project_entry', wraps=scanner.read_project_entry) as read_entry:
+            self.assertListEqual(ProjectCatalog(self.base_path, self.catalog_path).projects(), ['a', 'b', 'c'])
+            read_entry.assert_called_once_with(self.base_path, 'c')
+
+    def test_update(self):
+        projects = ProjectCatalog(self.base_path, self.catalog_path)
+        projects.projects()
+        projects.update(ProjectEntry('b', True, 'd', []), opened=True)
+        projects.update(ProjectEntry('b', True, 'd', ['p']))
+
+        reloaded = ProjectCatalog(self.base_path, self.catalog_path)
+        self.assertListEqual(reloaded.projects(only_initialized=True), ['a', 'b'])
+        self.assertListEqual(reloaded.entries['b'].programs, ['p'])
+        self.assertIsNotNone(reloaded.entries['b'].last_opened)
+
+        reloaded.remove('b')
+        self.assertNotIn('b', ProjectCatalog(self.base_path, self.catalog_path).entries)
+
+    def test_journal(self):
+        projects = ProjectCatalog(self.base_path, self.catalog_path)
+        projects.projects()
+        # changes to single entries are appended, not written to the catalog file
+        with mock.patch.object(ProjectCatalog, 'save') as save:
+            for i in range(10):
+                projects.update(ProjectEntry('p%d' % i, True, 'd', []))
+            projects.remove('p0')
+            save.assert_not_called()
+        reloaded = ProjectCatalog(self.base_path, self.catalog_path)
+        self.assertSetEqual(set(reloaded.entries), {'a', 'b'} | {'p%d' % i for i in range(1, 10)})
+
+    def test_compaction(self):
+        projects = ProjectCatalog(self.base_path, self.catalog_path)
+        projects.projects()
+        with mock.patch.object(catalog, 'MIN_COMPACT_CHANGES', 4):
+            for i in range(20):
+                projects.update(ProjectEntry('p%d' % (i % 3), True, 'd', [str(i)]))
+        with open(projects.journal_path) as fp:
+            self.assertLess(len(fp.readlines()), 10)
+        reloaded = ProjectCatalog(self.base_path, self.catalog_path)
+        self.assertEqual(len(reloaded.entries), 5)
+        self.assertListEqual(reloaded.entries['p1'].programs, ['19'])
+
+    def test_concurrent_processes(self):
+        # e.g. the daemon and the command line, which both keep a catalog
+        daemon = ProjectCatalog(self.base_path, self.catalog_path)
+        command_line = ProjectCatalog(self.base_path, self.catalog_path)
+        daemon.projects()
+        command_line.update(ProjectEntry('b', True, 'd', ['p']), opened=True)
+        daemon.update(ProjectEntry('a', True, 'd', []))
+        self.assertListEqual(daemon.projects(only_initialized=True), ['a', 'b'])
+        # a compaction by one of them is picked up by the other
+        daemon.save()
+        command_line.remove('a')
+        daemon.update(ProjectEntry('c', True, 'd', []))
+        self.assertListEqual(ProjectCatalog(self.base_path, self.catalog_path).projects(only_initialized=True),
+                             ['b', 'c'])
+        self.assertIsNotNone(daemon.entries['b'].last_opened)
+
+    def test_other_base_path(self):
+        ProjectCatalog(self.base_path, self.catalog_path).projects()
+        other = os.path.join(self.base_path, 'b')
+        self.assertListEqual(ProjectCatalog(other, self.catalog_path).projects(), [])
+
+    def test_iter_projects(self):
+        projects = ProjectCatalog(self.base_path, self.catalog_path)
+        projects.projects()
+        os.makedirs(os.path.join(self.base_path, 'c'))
+        os.utime(self.base_path, ns=(0, 10 ** 9))
+        # known projects come first, new ones as they are read
+        self.assertListEqual(list(projects.iter_projects()), ['a', 'b', 'c'])
@@ -0,0 +1,216 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from unittest import mock
+
+from persistd.programs.chrome import chrome, native_host
+from persistd.programs.chrome.chrome import Chrome
+from persistd.programs.chrome.native_host import (ChromeHostClient, NativeHost, NativeMessagingError, read_message,
+                                                  write_message)
+from persistd.util.settings import SETTINGS
+from tests.base_test import BaseTest
+
+
+class FakeExtension:
+    """ Plays the part of the Chrome extension on the other end of the host
+    """
+
+    def __init__(self, stdin, stdout):
+        self.stdin = stdin
+        self.stdout = stdout
+        self.storage = {'project': ['https://github.com/']}
+        self.open_projects = set()
+        self.messages = []
+
+    def run(self):
+        while True:
+            message = read_message(self.stdin)
+            if message is None:
+                break
+            self.messages.append(message)
+            name = message['project']
+            response = {'id': message['id'], 'ok': True, 'tabs': None, 'error': None}
+            if message['action'] == 'start':
+                self.open_projects.add(name)
+                response['tabs'] = self.storage.get(name, [])
+            elif name not in self.open_projects:
+                response.update(ok=False, error="can't find any window for this project")
+            else:
+                response['tabs'] = self.storage.get(name, [])
+                if message['action'] in ['close', 'destroy']:
+                    self.open_projects.remove(name)
+                if message['action'] == 'destroy':
+                    del self.storage[name]
+            write_message(self.stdout, response)
+
+    def disconnect(self):
+        self.stdout.close()
+
+
+class ProtocolTest(BaseTest):
+    def test_round_trip(self):
+        stream = io.BytesIO()
+        write_message(stream, {'action': 'persist', 'project': 'ünïcode'})
+        stream.seek(0)
+        self.assertEqual(stream.read(4), len(stream.getvalue()[4:]).to_bytes(4, sys.byteorder))
+        stream.seek(0)
+        self.assertDictEqual(read_message(stream), {'action': 'persist', 'project': 'ünïcode'})
+        self.assertIsNone(read_message(stream))
+
+    def test_max_size(self):
+        with self.assertRaises(NativeMessagingError):
+            write_message(io.BytesIO(), {'tabs': ['x' * native_host.MAX_MESSAGE_SIZE]})
+
+
+class NativeHostTest(BaseTest):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        if sys.platform == 'win32':
+            self.address = r'\\.\pipe\persistd-chrome-test-%s' % uuid.uuid4().hex
+        else:
+            self.address = os.path.join(self.temp_dir.name, 'chrome.sock')
+        self.key_path = os.path.join(self.temp_dir.name, 'host.key')
+        for name, value in [('get_host_address', lambda: self.address), ('get_key_path', lambda: self.key_path)]:
+            patch = mock.patch.object(native_host, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        to_host, from_extension = os.pipe()
+        to_extension, from_host = os.pipe()
+        self.extension = FakeExtension(os.fdopen(to_extension, 'rb'), os.fdopen(from_extension, 'wb'))
+        self.host = NativeHost(os.fdopen(to_host, 'rb'), os.fdopen(from_host, 'wb'), timeout=5,
+                               get_tabs_path=self.get_tabs_path)
+        threading.Thread(target=self.extension.run, daemon=True).start()
+        self.host_thread = threading.Thread(target=self.host.serve_forever, daemon=True)
+        self.host_thread.start()
+        self.addCleanup(self.disconnect)
+        self.client = self.connect()
+        self.addCleanup(self.client.close)
+
+    def disconnect(self):
+        if not self.extension.stdout.closed:
+            self.extension.disconnect()
+        self.host_thread.join(10)
+        self.assertFalse(self.host_thread.is_alive())
+
+    def get_tabs_path(self, project_name):
+        if project_name == 'missing':
+            return None
+        return os.path.join(self.temp_dir.name, project_name, 'tabs.json')
+
+    def connect(self):
+        for _ in range(500):
+            client = ChromeHostClient.connect()
+            if client is not None:
+                return client
+            threading.Event().wait(0.01)
+        self.fail("Could not connect to the host")
+
+    def test_actions(self):
+        self.assertListEqual(self.client.request('start', 'project')['tabs'], ['https://github.com/'])
+        self.assertListEqual(self.client.request('persist', 'project')['tabs'], ['https://github.com/'])
+        self.assertListEqual(self.client.request('close', 'project')['tabs'], ['https://github.com/'])
+        with self.assertRaisesRegex(NativeMessagingError, "can't find any window"):
+            self.client.request('persist', 'project')
+
+    def test_tab_sync(self):
+        def sync(**delta):
+            write_message(self.extension.stdout, dict({'event': 'tabs', 'project': 'project', 'reset': False,
+                                                       'tabs': {}, 'removed': []}, **delta))
+
+        sync(reset=True, tabs={'1': {'index': 0, 'url': 'https://a/'}, '2': {'index': 1, 'url': 'https://b/'}})
+        sync(tabs={'3': {'index': 0, 'url': 'https://c/'}, '1': {'index': 1, 'url': 'https://a2/'}}, removed=[2])
+        write_message(self.extension.stdout, {'event': 'tabs', 'project': 'missing', 'reset': True,
+                                              'tabs': {'1': {'index': 0, 'url': 'https://a/'}}, 'removed': []})
+        # the extension handles messages in order, so the tabs are synced once this returns
+        self.client.request('start', 'project')
+        with open(self.get_tabs_path('project')) as fp:
+            self.assertDictEqual(json.load(fp), {'tabs': ['https://c/', 'https://a2/']})
+        self.assertIn('missing', self.host.project_tabs)
+
+    def test_concurrent_clients(self):
+        def start(name):
+            with self.connect() as client:
+                client.request('start', name)
+
+        threads = [threading.Thread(target=start, args=('project_%d' % i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertSetEqual(self.extension.open_projects, {'project_%d' % i for i in range(5)})
+
+    def test_chrome_program(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            program = Chrome('project', project_path, os.path.join(project_path, '.persistd', 'chrome'), None)
+            with mock.patch.object(chrome, 'run_on_command_line') as run:
+                self.assertTrue(program.start())
+                self.assertTrue(program.close())
+                self.assertFalse(program.persist())
+            # no process was started for any of them
+            run.assert_not_called()
+            self.assertListEqual(program.tabs, ['https://github.com/'])
+            # the tabs are restored the way the settings say
+            self.assertEqual(self.extension.messages[0]['restore_mode'], SETTINGS.chrome_restore_mode)
+
+    def test_extension_disconnects(self):
+        self.disconnect()
+        self.assertFalse(os.path.exists(self.key_path))
+        self.assertIsNone(ChromeHostClient.connect())
+
+
+class HostFilesTest(BaseTest):
+    def test_write_host_files(self):
+        with tempfile.TemporaryDirectory() as host_path, mock.patch.object(native_host, 'HOST_PATH', host_path):
+            manifest_path = native_host.write_host_files('abcdefghijklmnop')
+            with open(manifest_path) as fp:
+                manifest = json.load(fp)
+            self.assertEqual(manifest['name'], native_host.HOST_NAME)
+            self.assertListEqual(manifest['allowed_origins'], ['chrome-extension://abcdefghijklmnop/'])
+            self.assertTrue(os.path.exists(manifest['path']))
+
+    def test_fallback_to_urls(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            program = Chrome('project', project_path, os.path.join(project_path, '.persistd', 'chrome'), None)
+            with mock.patch.object(ChromeHostClient, 'connect', return_value=None), \
+                    mock.patch.object(chrome, 'run_on_command_line', return_value=(0, None, 1)) as run:
+                self.assertTrue(program.persist())
+            self.assertIn(program.get_url('persist'), run.call_args[0][0])
+
+
+class RestoreOptionsTest(BaseTest):
+    def test_restore_options(self):
+        program = Chrome('project', '/project', '/project/.persistd/chrome', None)
+        with mock.patch.object(SETTINGS, 'chrome_restore_mode', 'waves'), \
+                mock.patch.object(SETTINGS, 'chrome_max_loading_tabs', 0), \
+                mock.patch.object(SETTINGS, 'chrome_discard_after', 30.0):
+            self.assertDictEqual(program.get_restore_options(),
+                                 {'restore_mode': 'waves', 'max_loading_tabs': 1, 'discard_after': 30.0})
+            program.restore_mode = 'eager'
+            self.assertEqual(program.get_restore_options()['restore_mode'], 'eager')
+            program.restore_mode = 'unknown'
+            self.assertEqual(program.get_restore_options()['restore_mode'], 'lazy')
+        self.assertIn('&restore_mode=lazy', program.get_url('start', restore_mode='lazy'))
+
+
+class ChangeTrackingTest(BaseTest):
+    def test_synced_tabs(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            program = Chrome('project', project_path, os.path.join(project_path, '.persistd', 'chrome'), None)
+            program.mark_persisted()
+            with mock.patch.object(SETTINGS, 'chrome_extension_id', ''):
+                # without the host, snapshots don't open persist windows in Chrome
+                self.assertFalse(program.has_changed())
+            with mock.patch.object(SETTINGS, 'chrome_extension_id', 'abcdefghijklmnop'):
+                self.assertFalse(program.has_changed())
+                os.makedirs(program.persist_path)
+                with open(program.synced_tabs_path, 'w') as fp:
+                    json.dump({'tabs': ['https://github.com/']}, fp)
+                self.assertTrue(program.has_changed())
+                program.mark_persisted()
+                self.assertFalse(program.has_changed())
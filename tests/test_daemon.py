@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+from persistd.util.daemon import DaemonClient, DaemonError, PersistDaemon
+from persistd.util.persister import Persister
+from persistd.util.settings import SETTINGS
+from tests.base_test import BaseTest
+
+
+class DaemonTest(BaseTest):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base_path = os.path.join(self.temp_dir.name, 'projects')
+        for name, value in [('base_path', self.base_path), ('open_projects', []),
+                            ('file_path', os.path.join(self.temp_dir.name, 'settings.json'))]:
+            patch = mock.patch.object(SETTINGS, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        persister = Persister(self.base_path, 'project')
+        os.makedirs(persister.persister_folder_path)
+        persister.used_desktop = 'fake_desktop'
+        persister.used_programs = ['fake']
+        persister.save()
+
+        if sys.platform == 'win32':
+            address = r'\\.\pipe\persistd-test-%s' % uuid.uuid4().hex
+        else:
+            address = os.path.join(self.temp_dir.name, 'daemon.sock')
+        self.key_path = os.path.join(self.temp_dir.name, 'daemon.key')
+        self.daemon = PersistDaemon(address, key_path=self.key_path)
+        self.thread = threading.Thread(target=self.daemon.serve_forever, daemon=True)
+        self.thread.start()
+        self.client = self.connect()
+
+    def connect(self):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            client = DaemonClient.connect(self.daemon.address, key_path=self.key_path)
+            if client is not None:
+                return client
+            time.sleep(0.01)
+        self.fail("Could not connect to the daemon")
+
+    def tearDown(self):
+        self.client.request('shutdown')
+        self.client.close()
+        self.thread.join(timeout=10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.key_path))
+
+    def test_project_actions(self):
+        self.assertDictEqual(self.client.request('open', project='project'), {'fake': True})
+        self.assertListEqual(self.client.request('list', status='open'), ['project'])
+        self.assertListEqual(self.client.request('list', status='initialized'), ['project'])
+        persister = self.daemon.get_persister('project')
+
+        self.assertDictEqual(self.client.request('persist', project='project'), {'fake': True})
+        self.assertDictEqual(self.client.request('close', project='project'), {'fake': True})
+        self.assertListEqual(SETTINGS.open_projects, [])
+        # the persister stayed loaded between the requests
+        self.assertIs(self.daemon.get_persister('project'), persister)
+
+        with open(persister.state_path) as fp:
+            program_state = json.load(fp)['programs']['fake']
+        self.assertEqual(program_state['persist_count'], 2)
+        self.assertIsNone(program_state['pid'])
+
+    def test_errors(self):
+        with self.assertRaisesRegex(DaemonError, 'No program with codename unknown'):
+            self.client.request('add', project='project', program='unknown')
+        # hidden programs can't be added by users
+        with self.assertRaisesRegex(DaemonError, 'No program with codename fake'):
+            self.client.request('add', project='project', program='fake')
+        with self.assertRaisesRegex(DaemonError, 'not open'):
+            self.client.request('close', project='project')
+        with self.assertRaisesRegex(DaemonError, 'not initialized'):
+            self.client.request('open', project='missing')
+        # the daemon keeps serving after errors
+        self.assertEqual(self.client.request('ping'), os.getpid())
+
+    def test_output_of_other_threads(self):
+        printed = threading.Event()
+
+        def print_in_background():
+            print('background')
+            printed.set()
+
+        def persist_project(persister, only_changed=False):
+            print('persisting %s' % persister.project_name)
+            threading.Thread(target=print_in_background).start()
+            self.assertTrue(printed.wait(timeout=10))
+            return {}
+
+        with mock.patch.object(Persister, 'persist_project', autospec=True, side_effect=persist_project), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            single = self.daemon.handle({'action': 'persist', 'project': 'project'})
+            printed.clear()
+            SETTINGS.open_projects.append('project')
+            batch = self.daemon.handle({'action': 'persist', 'projects': ['project']})
+            # the stand-in for stdout is left behind for the other threads
+            background = sys.stdout.stdout.getvalue()
+        self.assertEqual(single['output'], 'persisting project\n')
+        # batches run on worker threads, which print for the request
+        self.assertIn('persisting project\n', batch['output'])
+        self.assertNotIn('background', single['output'] + batch['output'])
+        self.assertEqual(background, 'background\nbackground\n')
+
+    def test_reject_unauthenticated_clients(self):
+        with open(self.key_path, 'w') as fp:
+            fp.write('00' * 32)
+        self.assertIsNone(DaemonClient.connect(self.daemon.address, key_path=self.key_path))
+        self.assertEqual(self.client.request('ping'), os.getpid())
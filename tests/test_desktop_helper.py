@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+from unittest import mock
+
+from persistd.desktops.desktop_helper import DesktopHelperClient, DesktopHelperError, get_helper_client
+from persistd.desktops.virtual_desktop import VirtualDesktop
+from persistd.desktops.window_probe import FakeWindowProbe
+from persistd.util.settings import SETTINGS
+from tests.base_test import BaseTest
+
+HELPER_COMMAND = [sys.executable, '-m', 'persistd.desktops.desktop_helper']
+
+
+class DesktopHelperTest(BaseTest):
+    def setUp(self):
+        self.client = DesktopHelperClient(HELPER_COMMAND)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_request(self):
+        new, = self.client.request([{'op': 'new'}])
+        self.assertDictEqual(new, {'ok': True, 'value': 1})
+        switch, missing = self.client.request([{'op': 'switch', 'desktop': 1}, {'op': 'switch', 'desktop': 5}])
+        self.assertTrue(switch['ok'])
+        self.assertFalse(missing['ok'])
+        self.assertIn('#5', missing['error'])
+
+        unknown, private = self.client.request([{'op': 'explode'}, {'op': '_check', 'desktop': 0}])
+        self.assertFalse(unknown['ok'])
+        self.assertFalse(private['ok'])
+
+    def test_restarts_helper(self):
+        self.client.request([{'op': 'new'}])
+        self.client.close()
+        # a fresh helper starts with a single desktop
+        new, = self.client.request([{'op': 'new'}])
+        self.assertEqual(new['value'], 1)
+
+    def test_unresponsive_helper(self):
+        client = DesktopHelperClient([sys.executable, '-c', 'import time; time.sleep(60)'], timeout=0.5)
+        self.addCleanup(client.close)
+        with self.assertRaises(DesktopHelperError):
+            client.request([{'op': 'list'}])
+        # the helper was killed, and is started again on the next request
+        self.assertIsNone(client._process)
+
+    def test_invalid_response(self):
+        client = DesktopHelperClient([sys.executable, '-c', 'input(); print("not json")'])
+        self.addCleanup(client.close)
+        with self.assertRaises(DesktopHelperError):
+            client.request([{'op': 'list'}])
+
+    def test_shared_client(self):
+        self.assertIs(get_helper_client(HELPER_COMMAND), get_helper_client(list(HELPER_COMMAND)))
+
+    def test_virtual_desktop(self):
+        desktop = VirtualDesktop('a', 'a', 'a')
+        desktop.window_probe = FakeWindowProbe()
+        desktop.window_probe.add_window(42)
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(SETTINGS, 'desktop_helper_command', HELPER_COMMAND), \
+                mock.patch.object(SETTINGS, 'desktop_pool_size', 0), \
+                mock.patch('persistd.desktops.virtual_desktop.POOL_PATH', os.path.join(temp_dir, 'pool.json')), \
+                mock.patch('persistd.desktops.virtual_desktop.run_on_command_line') as run:
+            self.assertTrue(desktop.create_desktop())
+            self.assertEqual(desktop.virtual_desktop_id, 1)
+            self.assertTrue(desktop.switch_to_desktop())
+            self.assertEqual(desktop.move_program(42), 42)
+            # several moves in one round trip
+            self.assertListEqual(desktop.move_programs([1, 2, 3]), [1, 2, 3])
+            self.assertListEqual(desktop.move_programs([4], desktop_id=7), [])
+            self.assertTrue(desktop.close_desktop())
+            self.assertFalse(desktop.close_current_desktop())
+            # no process was spawned per operation
+            run.assert_not_called()
+
+    def test_batch_moves(self):
+        desktop = VirtualDesktop('a', 'a', 'a')
+        desktop.window_probe = FakeWindowProbe()
+        helper = get_helper_client(HELPER_COMMAND)
+        self.addCleanup(helper.close)
+        with mock.patch.object(SETTINGS, 'desktop_helper_command', HELPER_COMMAND), \
+                mock.patch.object(helper, 'request', wraps=helper.request) as request:
+            desktop.virtual_desktop_id = 0
+            with desktop.batch_moves():
+                self.assertEqual(desktop.move_program(1, timeout=0), 1)
+                self.assertEqual(desktop.move_program(2, timeout=0), 2)
+                request.assert_not_called()
+            # both programs are moved in a single round trip
+            request.assert_called_once_with([{'op': 'move', 'desktop': 0, 'pid': 1},
+                                             {'op': 'move', 'desktop': 0, 'pid': 2}])
@@ -0,0 +1,164 @@
+import os
+import sys
+import tempfile
+from unittest import mock
+
+from persistd.desktops.desktop_helper import FakeDesktopBackend, get_helper_client, run_op
+from persistd.desktops.desktop_pool import POOL_PREFIX, DesktopPool, project_desktop_name
+from persistd.desktops.desktop_state import DesktopStateCache
+from persistd.desktops.virtual_desktop import STATE_CACHE, VirtualDesktop, _parse_desktop_list
+from persistd.util.settings import SETTINGS
+from tests.base_test import BaseTest
+
+HELPER_COMMAND = [sys.executable, '-m', 'persistd.desktops.desktop_helper']
+
+
+class DesktopPoolTest(BaseTest):
+    def setUp(self):
+        self.backend = FakeDesktopBackend()
+        self.batches = []
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pool = DesktopPool(self.run_ops, os.path.join(self.temp_dir.name, 'pool.json'), size=2,
+                                cache=DesktopStateCache())
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_ops(self, ops):
+        self.batches.append([op['op'] for op in ops])
+        return [run_op(self.backend, op) for op in ops]
+
+    def test_warm_up(self):
+        self.assertEqual(self.pool.warm_up(), 2)
+        self.assertEqual(self.backend.desktop_count, 3)
+        self.assertTrue(all(name.startswith(POOL_PREFIX) for name in self.backend.names[1:]))
+        # the desktops are created in a single batch
+        self.assertIn(['new', 'new'], self.batches)
+        # a full pool doesn't need to list the desktops
+        self.batches.clear()
+        self.assertEqual(self.pool.warm_up(), 0)
+        self.assertListEqual(self.batches, [])
+
+    def test_acquire_and_release(self):
+        self.pool.warm_up()
+        self.batches.clear()
+        position, name = self.pool.acquire('a')
+        self.assertEqual(self.backend.names[position], 'a')
+        self.assertEqual(name, 'a')
+        self.assertNotIn(['new'], self.batches)
+        self.assertEqual(self.pool.acquire('b'), (1, 'b'))
+        # the pool is empty, so a desktop is created
+        self.assertEqual(self.pool.acquire('c'), (3, 'c'))
+        # reopening a project that wasn't closed reuses its desktop
+        self.assertEqual(self.pool.acquire('c'), (3, 'c'))
+
+        self.assertTrue(self.pool.release('a'))
+        self.assertTrue(self.pool.release('b'))
+        # the pool is full again
+        self.assertTrue(self.pool.release('c'))
+        self.assertEqual(self.backend.desktop_count, 3)
+        self.assertNotIn('c', self.backend.names)
+        self.assertTrue(self.pool.release('missing'))
+
+    def test_release_with_windows(self):
+        position, _ = self.pool.acquire('a')
+        # a program that didn't close is left on the desktop
+        self.backend.move(position, 42)
+        self.assertTrue(self.pool.release('a'))
+        self.assertEqual(self.backend.desktop_count, 1)
+
+        # without enumerating the windows, desktops can't be known to be empty
+        pool = DesktopPool(self.run_ops, size=2)
+        pool.acquire('b')
+        self.assertTrue(pool.release('b'))
+        self.assertEqual(self.backend.desktop_count, 1)
+
+    def test_reconcile(self):
+        self.pool.warm_up()
+        # a pooled desktop is removed outside persistd, which moves the other
+        self.backend.remove(1)
+        position, _ = self.pool.acquire('a')
+        self.assertEqual(position, 1)
+        self.assertEqual(self.backend.names[1], 'a')
+        # the pool knew of the removed desktop, but creates a new one now
+        self.assertEqual(self.pool.acquire('b'), (2, 'b'))
+        self.assertEqual(self.pool.locate('b'), 2)
+        self.backend.remove(1)
+        self.assertEqual(self.pool.locate('b'), 1)
+        self.assertIsNone(self.pool.locate('a'))
+
+    def test_rename_fails(self):
+        def run_ops(ops):
+            return [{'ok': False, 'value': None} if op['op'] == 'rename' else run_op(self.backend, op) for op in ops]
+
+        self.pool.run_ops = run_ops
+        # the desktop can only be found by its position
+        self.assertEqual(self.pool.acquire('a'), (1, None))
+        # unnamed desktops aren't kept warm
+        self.assertEqual(self.pool.warm_up(), 0)
+        self.assertEqual(self.backend.desktop_count, 2)
+
+    def test_pool_is_saved(self):
+        self.pool.warm_up()
+        pool = DesktopPool(self.run_ops, self.pool.path, size=2)
+        self.batches.clear()
+        pool.acquire('a')
+        self.assertNotIn(['new'], self.batches)
+
+
+class VirtualDesktopPoolTest(BaseTest):
+    def setUp(self):
+        # starts a fresh helper, with a single desktop
+        get_helper_client(HELPER_COMMAND).close()
+
+    def tearDown(self):
+        get_helper_client(HELPER_COMMAND).close()
+
+    def test_stale_id(self):
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(SETTINGS, 'desktop_helper_command', HELPER_COMMAND), \
+                mock.patch.object(SETTINGS, 'desktop_pool_size', 1), \
+                mock.patch('persistd.desktops.virtual_desktop.POOL_PATH', os.path.join(temp_dir, 'pool.json')):
+            first = VirtualDesktop('first', 'first', 'first')
+            second = VirtualDesktop('second', 'second', 'second')
+            self.assertTrue(first.create_desktop())
+            self.assertEqual(first.warm_up(), 1)
+            self.assertTrue(second.create_desktop())
+            self.assertEqual(second.virtual_desktop_id, 2)
+            self.assertEqual(second.desktop_name, project_desktop_name('second'))
+
+            # the first desktop isn't removed, but recycled into the pool
+            self.assertTrue(first.close_desktop())
+            self.assertIsNone(first.virtual_desktop_id)
+            self.assertTrue(second.switch_to_desktop())
+            self.assertEqual(second.virtual_desktop_id, 2)
+
+            # the pool is full, so this one is removed
+            self.assertTrue(second.close_desktop())
+            names = second.pool.live_desktops()
+            self.assertEqual(len(names), 2)
+            self.assertNotIn(project_desktop_name('second'), names)
+
+    def test_rename_fails(self):
+        backend = FakeDesktopBackend()
+
+        def run_ops(ops):
+            return [{'ok': False, 'value': None} if op['op'] == 'rename' else run_op(backend, op) for op in ops]
+
+        STATE_CACHE.invalidate()
+        desktop = VirtualDesktop('project', 'project', 'project')
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(desktop, '_run_ops', run_ops), \
+                mock.patch('persistd.desktops.virtual_desktop.POOL_PATH', os.path.join(temp_dir, 'pool.json')):
+            self.assertTrue(desktop.create_desktop())
+            self.assertEqual(desktop.virtual_desktop_id, 1)
+            self.assertIsNone(desktop.desktop_name)
+            self.assertTrue(desktop.switch_to_desktop())
+            self.assertTrue(desktop.close_desktop())
+        self.assertEqual(backend.desktop_count, 1)
+        STATE_CACHE.invalidate()
+
+    def test_parse_desktop_list(self):
+        stdout = ("Virtual desktops:\n-----------------\nDesktop 1 (visible)\npersistd: project\n\n"
+                  "Count of desktops: 2\n")
+        self.assertListEqual(_parse_desktop_list(stdout), ['Desktop 1', 'persistd: project'])
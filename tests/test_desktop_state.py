@@ -0,0 +1,168 @@
+import os
+import sys
+import tempfile
+from unittest import mock
+
+from persistd.desktops.desktop_helper import FakeDesktopBackend, get_helper_client, run_op
+from persistd.desktops.desktop_pool import project_desktop_name
+from persistd.desktops.desktop_state import DesktopSnapshot, DesktopStateCache
+from persistd.desktops.virtual_desktop import STATE_CACHE, VirtualDesktop
+from persistd.desktops.window_probe import FakeWindowProbe
+from persistd.util.settings import SETTINGS
+from tests.base_test import BaseTest
+
+HELPER_COMMAND = [sys.executable, '-m', 'persistd.desktops.desktop_helper']
+
+
+class DesktopStateCacheTest(BaseTest):
+    def setUp(self):
+        self.backend = FakeDesktopBackend()
+        self.calls = 0
+
+    def run_ops(self, ops):
+        self.calls += 1
+        return [run_op(self.backend, op) for op in ops]
+
+    def test_snapshot(self):
+        snapshot = DesktopSnapshot(['Desktop 1', 'a', 'b'], [(10, 1, 1), (11, 2, 2), (12, 3, 2), (13, 1, 2)])
+        self.assertEqual(snapshot.position('b'), 2)
+        self.assertIsNone(snapshot.position('c'))
+        self.assertDictEqual(snapshot.window_handles([1, 2]), {1: [10, 13], 2: [11]})
+        self.assertDictEqual(snapshot.window_handles([1, 2], position=1), {1: [10]})
+        self.assertListEqual(snapshot.window_positions([1, 3]), [1, 2])
+        self.assertListEqual(snapshot.window_positions([4]), [])
+        self.assertListEqual(DesktopSnapshot(['Desktop 1'], None).window_positions([1]), [])
+
+    def test_cache(self):
+        cache = DesktopStateCache()
+        self.backend.new()
+        self.backend.move(1, 42)
+        snapshot = cache.get(self.run_ops, max_age=60)
+        self.assertListEqual(snapshot.names, ['Desktop 1', 'Desktop 2'])
+        self.assertListEqual(snapshot.windows, [(self.backend.handles[42], 42, 1)])
+        # lookups use the cached snapshot
+        self.assertIs(cache.get(self.run_ops, max_age=60), snapshot)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNot(cache.get(self.run_ops, max_age=0), snapshot)
+        cache.invalidate()
+        cache.get(self.run_ops, max_age=60)
+        self.assertEqual(self.calls, 3)
+
+
+class VirtualDesktopStateTest(BaseTest):
+    def setUp(self):
+        get_helper_client(HELPER_COMMAND).close()
+        STATE_CACHE.invalidate()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.patches = [mock.patch.object(SETTINGS, 'desktop_helper_command', HELPER_COMMAND),
+                        mock.patch.object(SETTINGS, 'desktop_pool_size', 0),
+                        mock.patch('persistd.desktops.virtual_desktop.POOL_PATH',
+                                   os.path.join(self.temp_dir.name, 'pool.json'))]
+        for patch in self.patches:
+            patch.start()
+        self.helper = get_helper_client(HELPER_COMMAND)
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        get_helper_client(HELPER_COMMAND).close()
+        STATE_CACHE.invalidate()
+        self.temp_dir.cleanup()
+
+    def desktop_names(self):
+        result, = self.helper.request([{'op': 'list'}])
+        return result['value']
+
+    def make_desktop(self, project_name):
+        desktop = VirtualDesktop(project_name, project_name, project_name)
+        desktop.window_probe = FakeWindowProbe()
+        return desktop
+
+    def test_persist_desktop(self):
+        other = self.make_desktop('other')
+        desktop = self.make_desktop('project')
+        self.assertTrue(other.create_desktop())
+        self.assertTrue(desktop.create_desktop())
+        with mock.patch('persistd.desktops.virtual_desktop.run_on_command_line', side_effect=[(0, '', 7), (0, '', 8)]):
+            for pid in [7, 8]:
+                desktop.window_probe.add_window(pid)
+            self.assertEqual(desktop.launch_program([os.path.join('tools', 'editor.exe')]), 7)
+            self.assertEqual(desktop.launch_program([os.path.join('tools', 'editor.exe')]), 8)
+        self.assertDictEqual(desktop.program_pids, {'editor.exe': [7, 8]})
+
+        # the desktop before it is removed, which moves the project's desktop
+        self.helper.request([{'op': 'remove', 'desktop': 1}])
+        self.assertTrue(desktop.persist_desktop())
+        self.assertEqual(desktop.virtual_desktop_id, 1)
+        self.assertEqual(len(desktop.window_handles['editor.exe']), 2)
+
+        # the windows are moved to a desktop of the user, and the project's desktop is renamed
+        self.helper.request([{'op': 'move', 'desktop': 0, 'pid': 7}, {'op': 'move', 'desktop': 0, 'pid': 8},
+                             {'op': 'rename', 'desktop': 1, 'name': 'renamed'}])
+        self.assertFalse(desktop.persist_desktop())
+        # the desktop with the windows isn't claimed, and the mapping stays as it was
+        self.assertListEqual(self.desktop_names(), ['Desktop 1', 'renamed'])
+        self.assertEqual(desktop.virtual_desktop_id, 1)
+        self.assertEqual(desktop.desktop_name, project_desktop_name('project'))
+        self.assertEqual(len(desktop.window_handles['editor.exe']), 2)
+
+    def test_stale_switch(self):
+        other = self.make_desktop('other')
+        desktop = self.make_desktop('project')
+        self.assertTrue(other.create_desktop())
+        self.assertTrue(desktop.create_desktop())
+        self.assertTrue(desktop.switch_to_desktop())
+        # the cached snapshot doesn't know that a desktop was removed
+        with mock.patch.object(SETTINGS, 'desktop_cache_age', 60):
+            self.assertTrue(desktop.switch_to_desktop())
+            self.helper.request([{'op': 'remove', 'desktop': 1}])
+            self.assertTrue(desktop.switch_to_desktop())
+        self.assertEqual(desktop.virtual_desktop_id, 1)
+
+    def test_close_missing_desktop(self):
+        desktop = self.make_desktop('project')
+        other = self.make_desktop('other')
+        self.assertTrue(desktop.create_desktop())
+        self.assertTrue(other.create_desktop())
+        # the project's desktop is removed outside persistd, so the other one is at its position
+        self.helper.request([{'op': 'remove', 'desktop': 1}])
+        self.assertTrue(desktop.close_desktop())
+        self.assertListEqual(self.desktop_names(), ['Desktop 1', project_desktop_name('other')])
+        self.assertTrue(other.close_desktop())
+        self.assertListEqual(self.desktop_names(), ['Desktop 1'])
+
+    def test_guarded_remove(self):
+        backend = FakeDesktopBackend()
+        backend.new()
+        result = run_op(backend, {'op': 'remove', 'desktop': 1, 'name': 'a'})
+        self.assertFalse(result['ok'])
+        self.assertEqual(backend.desktop_count, 2)
+
+    def test_guarded_exe_ops(self):
+        desktop = VirtualDesktop('project', 'project', 'project')
+        listing = "Virtual desktops:\n-----------------\nDesktop 1 (visible)\nother\n\nCount of desktops: 2\n"
+
+        def run(command, **kwargs):
+            if command[1] == '-List':
+                return 2, listing, 1
+            return 1, '', 1
+
+        with mock.patch.object(SETTINGS, 'desktop_helper_command', []), \
+                mock.patch('persistd.desktops.virtual_desktop.run_on_command_line', side_effect=run) as run_mock:
+            result, = desktop._run_ops([{'op': 'remove', 'desktop': 1, 'name': project_desktop_name('project')}])
+            self.assertFalse(result['ok'])
+            # only the desktops were listed, nothing was removed
+            self.assertListEqual([call[0][0][1] for call in run_mock.call_args_list], ['-List'])
+
+            result, = desktop._run_ops([{'op': 'switch', 'desktop': 1, 'name': 'other'}])
+            self.assertTrue(result['ok'])
+            self.assertEqual(run_mock.call_args[0][0][1:], ['-Switch:1'])
+
+    def test_exe_timeout(self):
+        desktop = VirtualDesktop('project', 'project', 'project')
+        with mock.patch.object(SETTINGS, 'desktop_helper_command', []), \
+                mock.patch('persistd.desktops.virtual_desktop.run_on_command_line',
+                           return_value=(None, TimeoutError("VirtualDesktop.exe timed out"), 1)):
+            for op in [{'op': 'new'}, {'op': 'remove_current'}]:
+                result, = desktop._run_ops([op])
+                self.assertFalse(result['ok'])
@@ -0,0 +1,101 @@
+import os
+import tempfile
+from unittest import mock
+
+from persistd.util import exe_cache, integrity
+from persistd.util.exe_cache import BLOBS_FOLDER, ExecutableCache
+from persistd.util.integrity import hash_file
+from tests.base_test import BaseTest
+
+
+class ExecutableCacheTest(BaseTest):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.exe_path = os.path.join(self.temp_dir.name, 'program', 'program.exe')
+        os.makedirs(os.path.dirname(self.exe_path))
+        self.write_exe(b'version 1')
+        self.cache = ExecutableCache(os.path.join(self.temp_dir.name, 'integrity.json'))
+
+    def write_exe(self, content):
+        with open(self.exe_path, 'wb') as fp:
+            fp.write(content)
+
+    def alias_path(self, name):
+        return os.path.join(os.path.dirname(self.exe_path), 'program_%s.exe' % name)
+
+    def read(self, path):
+        with open(path, 'rb') as fp:
+            return fp.read()
+
+    def test_aliases_share_a_blob(self):
+        with mock.patch.object(integrity, 'hash_file', wraps=hash_file) as hasher:
+            for name in ['a', 'b', 'c']:
+                self.assertIn(self.cache.link(self.exe_path, self.alias_path(name)), ['reflink', 'hardlink', 'copy'])
+                self.assertEqual(self.read(self.alias_path(name)), b'version 1')
+            self.assertEqual(self.cache.link(self.exe_path, self.alias_path('a')), 'existing')
+        # the executable is only hashed once
+        hasher.assert_called_once()
+        blobs_path = os.path.join(os.path.dirname(self.exe_path), BLOBS_FOLDER)
+        self.assertEqual(len(os.listdir(blobs_path)), 1)
+
+    def test_executable_changes(self):
+        self.cache.link(self.exe_path, self.alias_path('a'))
+        self.write_exe(b'version 2')
+        self.assertNotEqual(self.cache.link(self.exe_path, self.alias_path('a')), 'existing')
+        self.assertEqual(self.read(self.alias_path('a')), b'version 2')
+        # changing the executable in place doesn't change the alias
+        self.write_exe(b'version 3')
+        self.assertEqual(self.read(self.alias_path('a')), b'version 2')
+
+    def test_fallback_to_copy(self):
+        def fail(*args):
+            raise OSError('not supported')
+
+        with mock.patch.object(exe_cache, '_reflink', fail), mock.patch.object(os, 'link', fail):
+            self.assertEqual(self.cache.link(self.exe_path, self.alias_path('a')), 'copy')
+            self.assertEqual(self.cache.link(self.exe_path, self.alias_path('a')), 'existing')
+        self.assertEqual(self.read(self.alias_path('a')), b'version 1')
+
+    def test_remove_unused_blobs(self):
+        blobs_path = os.path.join(os.path.dirname(self.exe_path), BLOBS_FOLDER)
+        self.cache.link(self.exe_path, self.alias_path('a'))
+        self.cache.link(self.exe_path, self.alias_path('b'))
+        old_blobs = set(os.listdir(blobs_path))
+        # a blob that is still being copied in
+        open(os.path.join(blobs_path, '.tmp-copying'), 'wb').close()
+        self.write_exe(b'version 2 is longer')
+        self.cache.link(self.exe_path, self.alias_path('a'))
+        # b still has the old content
+        self.assertTrue(old_blobs < set(os.listdir(blobs_path)))
+        self.cache.link(self.exe_path, self.alias_path('b'))
+        blobs = set(os.listdir(blobs_path))
+        self.assertFalse(old_blobs & blobs)
+        self.assertEqual(len(blobs), 2)
+        self.assertIn('.tmp-copying', blobs)
+        self.assertEqual(self.read(self.alias_path('b')), b'version 2 is longer')
+
+    def test_remove_blob_of_removed_alias(self):
+        blobs_path = os.path.join(os.path.dirname(self.exe_path), BLOBS_FOLDER)
+        self.cache.link(self.exe_path, self.alias_path('a'))
+        self.write_exe(b'version 2')
+        self.cache.link(self.exe_path, self.alias_path('b'))
+        self.assertEqual(len(os.listdir(blobs_path)), 2)
+        os.remove(self.alias_path('a'))
+        self.assertEqual(len(self.cache.remove_unused_blobs(os.path.dirname(self.exe_path))), 1)
+        self.assertEqual(len(os.listdir(blobs_path)), 1)
+
+    def test_edited_copy_keeps_no_blob(self):
+        def fail(*args):
+            raise OSError('not supported')
+
+        with mock.patch.object(exe_cache, '_reflink', fail), mock.patch.object(os, 'link', fail):
+            self.cache.link(self.exe_path, self.alias_path('a'))
+        # an edit that keeps the size and the mtime of the copy
+        stat = os.stat(self.alias_path('a'))
+        with open(self.alias_path('a'), 'wb') as fp:
+            fp.write(b'version X')
+        os.utime(self.alias_path('a'), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        # the source has the content of the blob too
+        os.remove(self.exe_path)
+        self.assertEqual(len(self.cache.remove_unused_blobs(os.path.dirname(self.exe_path))), 1)
@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest import mock
+
+from persistd.desktops.fake_desktop import FakeDesktop
+from persistd.programs.fake.fake_program import FakeProgram
+from persistd.util.batch import run_on_projects
+from persistd.util.fakes import FakeBehavior
+from persistd.util.persister import Persister
+from persistd.util.settings import SETTINGS
+from persistd.util.tracing import TRACER
+from tests.base_test import BaseTest
+
+
+class FakeBehaviorTest(BaseTest):
+    def test_latency(self):
+        behavior = FakeBehavior(latency=0.01, latencies={'start': 0.02})
+        TRACER.enable()
+        self.addCleanup(TRACER.disable)
+        self.addCleanup(TRACER.clear)
+        with TRACER.span('test') as span:
+            self.assertTrue(behavior.perform('persist'))
+            self.assertTrue(behavior.perform('start'))
+        self.assertAlmostEqual(span.counters['sleep_seconds'], 0.03)
+
+    def test_failures_are_repeatable(self):
+        def outcomes():
+            behavior = FakeBehavior(failure_rate=0.5, seed=42)
+            return [behavior.perform('start') for _ in range(100)]
+        self.assertListEqual(outcomes(), outcomes())
+        self.assertIn(False, outcomes())
+        self.assertIn(True, outcomes())
+        self.assertTrue(all(FakeBehavior(failure_rate=0).perform('start') for _ in range(100)))
+        self.assertFalse(any(FakeBehavior(failure_rate=1).perform('start') for _ in range(100)))
+
+    def test_failing_programs(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        base_path = os.path.join(temp_dir.name, 'projects')
+        for name, value in [('base_path', base_path), ('open_projects', []),
+                            ('file_path', os.path.join(temp_dir.name, 'settings.json'))]:
+            patch = mock.patch.object(SETTINGS, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        persister = Persister(base_path, 'project')
+        os.makedirs(persister.persister_folder_path)
+        persister.used_desktop = 'fake_desktop'
+        persister.used_programs = ['fake']
+        persister.save()
+
+        with mock.patch.object(FakeProgram, 'behavior', FakeBehavior(failure_rate=1)):
+            results = run_on_projects('open', ['project'])
+        self.assertFalse(results['project'].success)
+        # the desktop was still created, so the project counts as open
+        self.assertListEqual(SETTINGS.open_projects, ['project'])
+
+        with mock.patch.object(FakeDesktop, 'behavior', FakeBehavior(failure_rates={'close_desktop': 1})):
+            results = run_on_projects('close', ['project'])
+        self.assertTrue(results['project'].success)
+        self.assertIsNotNone(Persister(base_path, 'project').used_desktop_obj.desktop_id)
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import tempfile
+from unittest import mock
+
+from persistd.util import integrity
+from persistd.util.integrity import IntegrityCache, hash_file
+from tests.base_test import BaseTest
+
+
+class IntegrityTest(BaseTest):
+    def test_hash_file(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path = os.path.join(dirname, 'file.bin')
+            content = os.urandom(3000)
+            with open(path, 'wb') as fp:
+                fp.write(content)
+            self.assertEqual(hash_file(path, chunk_size=1024), hashlib.md5(content).hexdigest())
+            self.assertEqual(hash_file(path, 'sha256'), hashlib.sha256(content).hexdigest())
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path = os.path.join(dirname, 'file.bin')
+            cache_path = os.path.join(dirname, 'cache', 'integrity.json')
+            with open(path, 'wb') as fp:
+                fp.write(b'a')
+
+            with mock.patch.object(integrity, 'hash_file', wraps=hash_file) as hasher:
+                digest = IntegrityCache(cache_path).file_hash(path)
+                self.assertEqual(digest, hashlib.md5(b'a').hexdigest())
+                # a new cache instance reads the stored hash
+                self.assertEqual(IntegrityCache(cache_path).file_hash(path), digest)
+                self.assertEqual(hasher.call_count, 1)
+
+                # re-hashed once the file changes
+                with open(path, 'wb') as fp:
+                    fp.write(b'bb')
+                cache = IntegrityCache(cache_path)
+                self.assertEqual(cache.file_hash(path), hashlib.md5(b'bb').hexdigest())
+                self.assertEqual(hasher.call_count, 2)
+
+                cache.forget(path)
+                cache.file_hash(path)
+                self.assertEqual(hasher.call_count, 3)
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from persistd.util.parallel import run_in_parallel
+from tests.base_test import BaseTest
+
+
+class ParallelTest(BaseTest):
+    def test_results(self):
+        def fail():
+            raise RuntimeError('nope')
+
+        results = run_in_parallel({'a': lambda: True, 'b': lambda: False, 'c': fail})
+        self.assertListEqual(list(results), ['a', 'b', 'c'])
+        self.assertTrue(results['a'].success)
+        self.assertFalse(results['b'].success)
+        self.assertIsNone(results['b'].error)
+        self.assertFalse(results['c'].success)
+        self.assertIn('nope', results['c'].error)
+
+    def test_runs_concurrently(self):
+        start = time.monotonic()
+        results = run_in_parallel({str(i): lambda: time.sleep(0.2) or True for i in range(4)})
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertTrue(all(result.success for result in results.values()))
+
+    def test_max_workers(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def task():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return True
+
+        run_in_parallel({str(i): task for i in range(6)}, max_workers=2)
+        self.assertEqual(peak[0], 2)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        results = run_in_parallel({'hung': lambda: time.sleep(5), 'ok': lambda: True}, max_workers=1, timeout=0.2)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertTrue(results['hung'].timed_out)
+        self.assertFalse(results['hung'].success)
+        # the hung task gave its slot away
+        self.assertTrue(results['ok'].success)
+        self.assertFalse(results['ok'].timed_out)
@@ -0,0 +1,218 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import persistd.desktops as desktops
+import persistd.programs as programs
+from persistd.desktops.base_desktop import BaseDesktop
+from persistd.programs.base_program import BaseProgram
+import persistd.util.persister as persister_module
+from persistd.util.persister import Persister
+from tests.base_test import BaseTest
+
+CREATED = []
+
+
+class RecordingDesktop(BaseDesktop):
+    desktop_id = None
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        CREATED.append('desktop')
+
+    def setup(self):
+        CREATED.append('desktop.setup')
+        return True
+
+    def create_desktop(self):
+        self.desktop_id = 1
+        return True
+
+    def switch_to_desktop(self, desktop_id=None):
+        return True
+
+    def persist_desktop(self, desktop_id=None):
+        pass
+
+    def close_desktop(self, desktop_id=None):
+        return True
+
+    def close_current_desktop(self):
+        return True
+
+    def launch_program(self, command, **kwargs):
+        return 1
+
+    def destroy(self):
+        pass
+
+    @property
+    def os(self):
+        return 'any'
+
+
+class RecordingProgram(BaseProgram):
+    pid = None
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        CREATED.append(self.persist_path.split(os.sep)[-1])
+
+    def setup(self):
+        pass
+
+    def start(self):
+        self.pid = self.desktop.launch_program(['program'])
+        return True
+
+    def persist(self):
+        return True
+
+    def close(self):
+        self.pid = None
+        return True
+
+    def destroy(self):
+        shutil.rmtree(self.persist_path)
+
+
+class PinnedProgram(RecordingProgram):
+    MOVES_WINDOW = False
+    started_under_lock = None
+
+    def start(self):
+        PinnedProgram.started_under_lock = persister_module._desktop_lock.locked()
+        return super().start()
+
+
+class PersisterTest(BaseTest):
+    def setUp(self):
+        CREATED.clear()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base_path = self.temp_dir.name
+        persist_path = os.path.join(self.base_path, 'project', '.persistd')
+        os.makedirs(persist_path)
+        with open(os.path.join(persist_path, 'pd.json'), 'w') as fp:
+            json.dump({'used_desktop': 'recording', 'used_programs': ['p1', 'p2']}, fp)
+        # one json file per object, as in the legacy layout
+        for name in ['recording', 'p1', 'p2']:
+            os.makedirs(os.path.join(persist_path, name))
+            with open(os.path.join(persist_path, name, name + '.json'), 'w') as fp:
+                json.dump({'legacy': name}, fp)
+        patches = [mock.patch.dict(desktops.code_name_to_class, {'recording': RecordingDesktop}),
+                   mock.patch.dict(programs.code_name_to_class, {'p1': RecordingProgram, 'p2': RecordingProgram})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_lazy_load(self):
+        persister = Persister(self.base_path, 'project')
+        self.assertListEqual(persister.used_programs, ['p1', 'p2'])
+        self.assertListEqual(CREATED, [])
+
+        # a single program doesn't need the desktop
+        persister.get_program_obj('p1')
+        self.assertListEqual(CREATED, ['p1'])
+
+        persister.used_program_objs
+        self.assertListEqual(CREATED, ['p1', 'p2'])
+
+        persister.used_desktop_obj
+        self.assertListEqual(CREATED, ['p1', 'p2', 'desktop', 'desktop.setup'])
+
+    def test_save_and_reload(self):
+        persister = Persister(self.base_path, 'project')
+        with mock.patch('persistd.util.persister.SETTINGS') as settings:
+            settings.max_workers = 2
+            settings.program_timeout = 5
+            persister.launch_project()
+        self.assertEqual(persister.used_desktop_obj.desktop_id, 1)
+
+        persister = Persister(self.base_path, 'project')
+        self.assertEqual(persister.get_program_obj('p2').pid, 1)
+        # the desktop is only set up when a program uses it
+        self.assertNotIn('desktop.setup', CREATED[-1:])
+        self.assertEqual(persister.used_desktop_obj.desktop_id, 1)
+
+    def test_pinned_programs(self):
+        persister = Persister(self.base_path, 'project')
+        with mock.patch.dict(programs.code_name_to_class, {'p2': PinnedProgram}), \
+                mock.patch('persistd.util.persister.SETTINGS') as settings:
+            settings.max_workers = 2
+            settings.program_timeout = 5
+            results = persister.launch_project()
+        self.assertSetEqual(set(results), {'p1', 'p2'})
+        # the window of p2 opens on the current desktop, so no other project may switch desktops meanwhile
+        self.assertTrue(PinnedProgram.started_under_lock)
+
+    def test_remove_program(self):
+        persister = Persister(self.base_path, 'project')
+        persister.remove_program_from_project('p2')
+        self.assertListEqual(CREATED, ['p2'])
+        self.assertFalse(os.path.exists(os.path.join(persister.persister_folder_path, 'p2')))
+        self.assertListEqual(Persister(self.base_path, 'project').used_programs, ['p1'])
+
+    def test_migrate_legacy_layout(self):
+        persister = Persister(self.base_path, 'project')
+        self.assertEqual(persister.get_program_obj('p1').legacy, 'p1')
+        persister.save()
+
+        folder = persister.persister_folder_path
+        self.assertListEqual(sorted(os.listdir(folder)), ['p1', 'p2', 'recording', 'state.json'])
+        for name in ['recording', 'p1', 'p2']:
+            self.assertListEqual(os.listdir(os.path.join(folder, name)), [])
+        with open(persister.state_path) as fp:
+            state = json.load(fp)
+        self.assertEqual(state['version'], 1)
+        self.assertListEqual(state['persister']['used_programs'], ['p1', 'p2'])
+        self.assertDictEqual(state['desktop'], {'legacy': 'recording'})
+        # programs that were never initialized keep their state
+        self.assertDictEqual(state['programs']['p2'], {'legacy': 'p2'})
+
+        persister = Persister(self.base_path, 'project')
+        self.assertEqual(persister.get_program_obj('p2').legacy, 'p2')
+        self.assertEqual(persister.used_desktop_obj.legacy, 'recording')
+
+    def test_atomic_save(self):
+        persister = Persister(self.base_path, 'project')
+        persister.save()
+        with mock.patch('persistd.util.savers.os.replace', side_effect=OSError('crash')):
+            persister.used_programs.append('p3')
+            with self.assertRaises(OSError):
+                persister.save()
+        # the previous state is intact and no temporary files are left over
+        self.assertListEqual(Persister(self.base_path, 'project').used_programs, ['p1', 'p2'])
+        self.assertNotIn('.tmp', ''.join(os.listdir(persister.persister_folder_path)))
+
+    def test_dirty_tracking(self):
+        persister = Persister(self.base_path, 'project')
+        # migrating writes everything
+        report = persister.save()
+        self.assertEqual(report.files_written, 1)
+        self.assertEqual(report.objects_serialized, 4)
+
+        # nothing changed
+        persister.used_program_objs
+        report = persister.save()
+        self.assertEqual(report.files_written, 0)
+        self.assertEqual(report.bytes_serialized, 0)
+
+        # only the changed program is serialized again
+        persister.get_program_obj('p2').pid = 5
+        report = persister.save()
+        self.assertEqual(report.files_written, 1)
+        self.assertEqual(report.objects_serialized, 1)
+        self.assertEqual(report.bytes_serialized, len(json.dumps(persister.get_program_obj('p2').get_state())))
+        with open(persister.state_path) as fp:
+            self.assertEqual(json.load(fp)['programs']['p2']['pid'], 5)
+
+        persister = Persister(self.base_path, 'project')
+        self.assertEqual(persister.get_program_obj('p2').pid, 5)
+        self.assertEqual(persister.save().files_written, 0)
+        persister.used_programs.remove('p1')
+        report = persister.save()
+        self.assertEqual(report.files_written, 1)
+        self.assertEqual(report.objects_serialized, 3)
@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+
+from persistd.util.command_line import run_on_command_line
+from persistd.util.processes import ProcessRunner
+from tests.base_test import BaseTest
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+class ProcessRunnerTest(BaseTest):
+    def setUp(self):
+        self.runner = ProcessRunner(max_commands=2)
+        self.addCleanup(self.runner.close)
+
+    def test_run(self):
+        result = self.runner.run(python('import sys; print(sys.stdin.read().upper()); sys.exit(3)'),
+                                 input=b'hello')
+        self.assertEqual(result.return_code, 3)
+        self.assertEqual(result.stdout.strip(), b'HELLO')
+        self.assertFalse(result.timed_out)
+
+    def test_streaming(self):
+        lines = []
+        first_line = threading.Event()
+
+        def on_line(line):
+            lines.append(line)
+            first_line.set()
+
+        future = self.runner.submit(python('import time; print("ready", flush=True); time.sleep(0.5); print("done")'),
+                                    on_line=on_line)
+        # the first line arrives while the command is still running
+        self.assertTrue(first_line.wait(5))
+        self.assertFalse(future.done())
+        self.assertEqual(future.result(5).return_code, 0)
+        self.assertListEqual(lines, ['ready', 'done'])
+
+    def test_timeout(self):
+        start = time.monotonic()
+        result = self.runner.run(python('import time; time.sleep(30)'), timeout=0.5)
+        self.assertTrue(result.timed_out)
+        self.assertIsNone(result.return_code)
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_cancel(self):
+        lines = []
+        future = self.runner.submit(python('import time; print("ready", flush=True); time.sleep(30)'),
+                                    on_line=lines.append)
+        deadline = time.monotonic() + 5
+        while not lines and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(future.cancel())
+        # the cancelled command doesn't hold on to its slot
+        results = [self.runner.submit(python('pass')) for _ in range(2)]
+        self.assertTrue(all(result.result(10).return_code == 0 for result in results))
+
+    def test_max_commands(self):
+        start = time.monotonic()
+        futures = [self.runner.submit(python('import time; time.sleep(0.3)')) for _ in range(4)]
+        self.assertTrue(all(future.result(10).return_code == 0 for future in futures))
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+
+    def test_run_on_command_line(self):
+        return_code, stdout, pid = run_on_command_line(python('print("hi")'))
+        self.assertEqual(return_code, 0)
+        self.assertEqual(stdout.strip(), 'hi')
+        self.assertGreater(pid, 0)
+
+        return_code, error, _ = run_on_command_line(python('import time; time.sleep(30)'), timeout=0.5)
+        self.assertIsNone(return_code)
+        self.assertIsInstance(error, TimeoutError)
+
+        # the environment is only set for the command
+        env = dict(os.environ, PERSISTD_TEST_VALUE='only here')
+        _, stdout, _ = run_on_command_line(python('import os; print(os.environ["PERSISTD_TEST_VALUE"])'), env=env)
+        self.assertEqual(stdout.strip(), 'only here')
+        self.assertNotIn('PERSISTD_TEST_VALUE', os.environ)
@@ -9,3 +9,10 @@ class ProjectsTest(BaseTest):
 
         # Only initialized projects
         self.assertListEqual(['a'], projects.get_all_projects(TEST_DATA_DIR, only_initialized=True))
+
+    def test_match_projects(self):
+        candidates = ['work-a', 'work-b', 'home']
+        self.assertListEqual(projects.match_projects(['work-*'], candidates), ['work-a', 'work-b'])
+        self.assertListEqual(projects.match_projects(['home', 'work-[b]', 'home'], candidates), ['home', 'work-b'])
+        # plain names don't need to be candidates
+        self.assertListEqual(projects.match_projects(['other', 'x*'], candidates), ['other'])
@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+from persistd.util.scanner import ProjectEntry, list_project_names, scan_projects
+from tests.base_test import BaseTest, TEST_DATA_DIR
+
+
+class ScannerTest(BaseTest):
+    def test_list_project_names(self):
+        self.assertListEqual(sorted(list_project_names(TEST_DATA_DIR)), ['a', 'b'])
+
+    def test_scan_projects(self):
+        entries = sorted(scan_projects(TEST_DATA_DIR), key=lambda entry: entry.name)
+        # a has an empty legacy pd.json
+        self.assertListEqual(entries, [ProjectEntry('a', initialized=True), ProjectEntry('b')])
+        self.assertListEqual([entry.name for entry in scan_projects(TEST_DATA_DIR, ['b'])], ['b'])
+
+    def test_stop_early(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            for i in range(100):
+                os.makedirs(os.path.join(dirname, str(i)))
+            scan = scan_projects(dirname, max_workers=2)
+            next(scan)
+            scan.close()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from persistd.util.persister import Persister
+from persistd.util.scheduler import AutoPersister
+from persistd.util.settings import SETTINGS, Settings
+from tests.base_test import BaseTest
+
+
+class AutoPersisterTest(BaseTest):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base_path = os.path.join(self.temp_dir.name, 'projects')
+        for name, value in [('base_path', self.base_path), ('open_projects', ['a', 'b', 'c']),
+                            ('file_path', os.path.join(self.temp_dir.name, 'settings.json'))]:
+            patch = mock.patch.object(SETTINGS, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.persisters = {}
+        for project_name in SETTINGS.open_projects:
+            persister = Persister(self.base_path, project_name)
+            os.makedirs(persister.persister_folder_path)
+            persister.used_desktop = 'fake_desktop'
+            persister.used_programs = ['fake']
+            persister.save()
+            self.persisters[project_name] = persister
+
+    def persist_count(self, project_name):
+        return Persister(self.base_path, project_name).get_program_obj('fake').persist_count
+
+    def test_skip_unchanged_programs(self):
+        scheduler = AutoPersister(get_persister=self.persisters.get, interval=1, rate=0)
+        report = scheduler.run_cycle()
+        self.assertEqual(report.programs_persisted, 3)
+        self.assertListEqual(sorted(report.project_durations), ['a', 'b', 'c'])
+
+        report = scheduler.run_cycle()
+        self.assertEqual(report.programs_persisted, 0)
+        self.assertEqual(report.programs_skipped, 3)
+
+        self.persisters['b'].get_program_obj('fake').state_changed()
+        report = scheduler.run_cycle()
+        self.assertEqual(report.programs_persisted, 1)
+        self.assertEqual(report.programs_skipped, 2)
+        self.assertEqual(self.persist_count('a'), 1)
+        self.assertEqual(self.persist_count('b'), 2)
+
+    def test_open_projects_change(self):
+        scheduler = AutoPersister(interval=1, rate=0)
+        SETTINGS.save()
+        self.assertEqual(len(scheduler.run_cycle().project_durations), 3)
+        # another process closes projects
+        other = Settings.load(SETTINGS.file_path)
+        other.open_projects = ['a']
+        other.save()
+        self.assertListEqual(list(scheduler.run_cycle().project_durations), ['a'])
+
+    def test_state_changes(self):
+        scheduler = AutoPersister(interval=1, rate=0)
+        scheduler.run_cycle()
+        cached = scheduler._get_persister('a')
+        # another process reopens the project
+        persister = Persister(self.base_path, 'a')
+        persister.get_program_obj('fake').pid = 1234
+        persister.save()
+        scheduler.run_cycle()
+        reloaded = scheduler._get_persister('a')
+        self.assertIsNot(reloaded, cached)
+        self.assertEqual(reloaded.get_program_obj('fake').pid, 1234)
+
+    def test_rate_limit(self):
+        scheduler = AutoPersister(interval=1, rate=20)
+        report = scheduler.run_cycle()
+        # 3 projects at most 0.05s apart
+        self.assertGreaterEqual(report.duration, 0.09)
+        self.assertListEqual(report.failures, [])
+
+    def test_failures(self):
+        SETTINGS.open_projects.append('missing')
+        report = AutoPersister(interval=1, rate=0).run_cycle()
+        self.assertListEqual(report.failures, ['missing'])
+        self.assertEqual(report.programs_persisted, 3)
+
+    def test_jitter(self):
+        scheduler = AutoPersister(interval=10, jitter=0.2, random_func=lambda low, high: high)
+        self.assertAlmostEqual(scheduler.next_delay(), 12)
+        scheduler = AutoPersister(interval=10, jitter=0.2, random_func=lambda low, high: low)
+        self.assertAlmostEqual(scheduler.next_delay(), 8)
+
+    def test_background(self):
+        with self.assertRaises(ValueError):
+            AutoPersister(interval=0).start()
+        scheduler = AutoPersister(interval=0.01, rate=0).start()
+        deadline = time.monotonic() + 10
+        while self.persist_count('c') == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        scheduler.stop(timeout=10)
+        self.assertEqual(self.persist_count('c'), 1)
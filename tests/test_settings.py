@@ -1,5 +1,8 @@
 import os
+import subprocess
+import sys
 import tempfile
+from unittest import mock
 
 from persistd.util.settings import Settings, SETTINGS
 from tests.base_test import BaseTest
@@ -64,3 +67,43 @@ class SettingsTest(BaseTest):
             # Test re-removing same project
             with self.assertRaises(ValueError):
                 settings.remove_open_project('c')
+
+    def test_skip_unchanged_save(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            temp_file = os.path.join(dirname, 'settings.json')
+            settings = Settings.load(temp_file, missing_ok=True).save()
+            with mock.patch('persistd.util.settings.atomic_write') as atomic_write:
+                settings.save()
+                Settings.load(temp_file).save()
+                atomic_write.assert_not_called()
+                settings.base_path = 'dummy/path'
+                settings.save()
+                atomic_write.assert_called_once()
+
+    def test_refresh(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            temp_file = os.path.join(dirname, 'settings.json')
+            settings = Settings.load(temp_file, missing_ok=True).save()
+            other = Settings.load(temp_file)
+            self.assertFalse(other.refresh())
+
+            settings.add_open_project('a')
+            self.assertTrue(other.refresh())
+            self.assertListEqual(other.open_projects, ['a'])
+            self.assertFalse(other.refresh())
+
+            # updates don't lose the changes of others
+            other.add_open_project('b')
+            settings.remove_open_project('a')
+            self.assertListEqual(Settings.load(temp_file).open_projects, ['b'])
+
+    def test_concurrent_updates(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            temp_file = os.path.join(dirname, 'settings.json')
+            Settings.load(temp_file, missing_ok=True).save()
+            script = ("import sys; from persistd.util.settings import Settings; "
+                      "Settings.load(sys.argv[1]).add_open_project(sys.argv[2])")
+            processes = [subprocess.Popen([sys.executable, '-c', script, temp_file, str(i)]) for i in range(8)]
+            for process in processes:
+                self.assertEqual(process.wait(), 0)
+            self.assertListEqual(sorted(Settings.load(temp_file).open_projects), [str(i) for i in range(8)])
@@ -0,0 +1,65 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from tests.base_test import BaseTest
+
+# Modules that are slow to import and not needed to e.g. list projects
+HEAVY_MODULES = ['requests', 'dataclasses_json', 'persistd.programs.chrome', 'persistd.desktops.virtual_desktop']
+
+# Generous budgets in seconds, so that they only fail on regressions
+IMPORT_BUDGET = 0.5
+LIST_OPEN_BUDGET = 1.0
+
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import persistd.persist as persist
+imported = time.perf_counter()
+modules = [name for name in %r if name in sys.modules]
+persist.parse_args(['--list-open'])
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'list_open': done - imported, 'modules': modules}))
+''' % HEAVY_MODULES
+
+
+class StartupTest(BaseTest):
+    def run_startup(self, data_dir):
+        env = dict(os.environ, LOCALAPPDATA=data_dir, XDG_DATA_HOME=data_dir)
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], input='n\n', env=env,
+                                stdout=subprocess.PIPE, universal_newlines=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        # the timings come after the prompt of --list-open
+        return json.loads(output[output.rindex('{'):])
+
+    def test_cold_start(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            timings = self.run_startup(data_dir)
+            self.assertListEqual(timings['modules'], [])
+            # neither importing nor listing open projects writes settings
+            self.assertListEqual(os.listdir(data_dir), [])
+        self.assertLess(timings['import'], IMPORT_BUDGET)
+        self.assertLess(timings['list_open'], LIST_OPEN_BUDGET)
+
+    def test_lazy_registry(self):
+        import persistd.programs as programs
+        self.assertIn('sublime_text', [program.CODE_NAME for program in programs.all_programs])
+        # PROGRAM_CLASS is None on other OS's, which leaves it out of the map
+        self.assertIs(programs.code_name_to_class.get('sublime_text'),
+                      programs.all_programs[2].PROGRAM_CLASS)
+        with self.assertRaises(KeyError):
+            programs.code_name_to_class['unknown']
+
+    def test_plugin_names(self):
+        import persistd.desktops as desktops
+        import persistd.programs as programs
+        plugins = (programs.all_programs + programs.hidden_programs
+                   + desktops.all_desktops + desktops.hidden_desktops)
+        for plugin in plugins:
+            # the names are repeated so that they can be listed without importing the module
+            module = importlib.import_module(plugin.module_name)
+            self.assertEqual(plugin.CODE_NAME, module.CODE_NAME, plugin.module_name)
+            self.assertEqual(plugin.HUMAN_READABLE_NAME, module.HUMAN_READABLE_NAME, plugin.module_name)
@@ -0,0 +1,52 @@
+import os
+import tempfile
+from unittest import mock
+
+from persistd.util import templates
+from persistd.util.templates import provision_templates
+from tests.base_test import BaseTest
+
+
+class TemplatesTest(BaseTest):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        code_path = os.path.join(self.temp_dir.name, 'code')
+        self.programs_path = os.path.join(self.temp_dir.name, 'data')
+        for name, value in [('CODE_PATH', code_path), ('PROGRAMS_PATH', self.programs_path)]:
+            patch = mock.patch.object(templates, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        os.makedirs(os.path.join(code_path, 'programs', 'program'))
+        with open(os.path.join(code_path, 'programs', 'program', 'start.txt'), 'wb') as fp:
+            fp.write(b'cd ${project_path}\r\necho $$HOME ${unknown}\r\n')
+        self.dest_path = os.path.join(self.temp_dir.name, 'project', '.persistd', 'program', 'start.txt')
+
+    def provision(self, project_path='/projects/a'):
+        return provision_templates('program', {'start.txt': self.dest_path}, {'project_path': project_path})
+
+    def read(self, path):
+        with open(path, 'rb') as fp:
+            return fp.read()
+
+    def test_render(self):
+        self.assertListEqual(self.provision(), [self.dest_path])
+        # line endings are kept, and unknown placeholders left as they are
+        self.assertEqual(self.read(self.dest_path), b'cd /projects/a\r\necho $HOME ${unknown}\r\n')
+        # the default template is put into the data path
+        self.assertTrue(os.path.exists(os.path.join(self.programs_path, 'program', 'start.txt')))
+
+    def test_only_write_changes(self):
+        self.provision()
+        with mock.patch.object(templates, 'atomic_write') as write:
+            self.assertListEqual(self.provision(), [])
+        write.assert_not_called()
+        self.assertListEqual(self.provision('/projects/b'), [self.dest_path])
+        self.assertEqual(self.read(self.dest_path), b'cd /projects/b\r\necho $HOME ${unknown}\r\n')
+
+    def test_edited_template(self):
+        self.provision()
+        with open(os.path.join(self.programs_path, 'program', 'start.txt'), 'w') as fp:
+            fp.write('pushd ${project_path}\n')
+        self.assertListEqual(self.provision(), [self.dest_path])
+        self.assertEqual(self.read(self.dest_path), b'pushd /projects/a\n')
@@ -0,0 +1,115 @@
+import io
+import json
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from unittest import mock
+
+from persistd import persist
+from persistd.util.command_line import run_on_command_line
+from persistd.util.parallel import run_in_parallel
+from persistd.util.persister import Persister
+from persistd.util.settings import SETTINGS
+from persistd.util.tracing import TRACER, Tracer, sleep
+from tests.base_test import BaseTest
+
+
+class TracerTest(BaseTest):
+    def test_spans(self):
+        tracer = Tracer()
+        with tracer.span('ignored'):
+            tracer.count('retries')
+        self.assertListEqual(list(tracer.spans), [])
+
+        tracer.enable()
+        with tracer.span('outer', project='a') as outer:
+            with tracer.span('inner'):
+                tracer.count('retries')
+                tracer.count('retries')
+            with self.assertRaises(ValueError):
+                with tracer.span('inner'):
+                    raise ValueError('failed')
+        inner, failed, _ = tracer.spans
+        self.assertIs(inner.parent, outer)
+        self.assertEqual(inner.counters['retries'], 2)
+        # the counters of nested spans add up in their parent
+        self.assertEqual(outer.counters['retries'], 2)
+        self.assertEqual(failed.error, "ValueError('failed')")
+        self.assertDictEqual(outer.attrs, {'project': 'a'})
+        self.assertGreaterEqual(outer.duration, inner.duration + failed.duration)
+
+        rows = {row['name']: row for row in tracer.summary()}
+        self.assertEqual(rows['inner']['calls'], 2)
+        self.assertEqual(rows['inner']['errors'], 1)
+        self.assertEqual(rows['inner']['retries'], 2)
+        self.assertEqual(rows['outer']['retries'], 2)
+        self.assertIn('outer', tracer.format_summary())
+
+    def test_max_spans(self):
+        tracer = Tracer(max_spans=2).enable()
+        for _ in range(5):
+            with tracer.span('step'):
+                pass
+        self.assertEqual(len(tracer.spans), 2)
+        self.assertEqual(tracer.summary()[0]['calls'], 5)
+        tracer.clear()
+        self.assertListEqual(list(tracer.spans), [])
+        self.assertListEqual(tracer.summary(), [])
+
+    def test_trace_file(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            trace_path = os.path.join(dirname, 'trace.jsonl')
+            tracer = Tracer().enable(trace_path)
+            with tracer.span('outer'):
+                with tracer.span('inner'):
+                    pass
+            tracer.disable()
+            with open(trace_path) as fp:
+                lines = [json.loads(line) for line in fp]
+        self.assertListEqual([line['name'] for line in lines], ['inner', 'outer'])
+        self.assertEqual(lines[0]['parent'], lines[1]['id'])
+
+
+class TracedCallsTest(BaseTest):
+    def setUp(self):
+        TRACER.enable()
+        self.addCleanup(TRACER.clear)
+        self.addCleanup(TRACER.disable)
+
+    def test_parallel_tasks_nest(self):
+        with TRACER.span('caller') as caller:
+            run_in_parallel({'a': lambda: sleep(0.01) or True, 'b': lambda: run_on_command_line(
+                [sys.executable, '-c', 'pass'])[0] == 0})
+        spans = {span.name: span for span in TRACER.spans}
+        subprocess_span = spans['run_on_command_line']
+        self.assertIs(subprocess_span.parent, caller)
+        self.assertEqual(subprocess_span.counters['subprocesses'], 1)
+        self.assertAlmostEqual(caller.counters['sleep_seconds'], 0.01)
+        self.assertEqual(caller.counters['subprocesses'], 1)
+
+    def test_lifecycle_methods(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            patches = [mock.patch.object(SETTINGS, 'open_projects', []),
+                       mock.patch.object(SETTINGS, 'file_path', os.path.join(dirname, 'settings.json'))]
+            for patch in patches:
+                patch.start()
+                self.addCleanup(patch.stop)
+            persister = Persister(dirname, 'project')
+            os.makedirs(persister.persister_folder_path)
+            persister.used_desktop = 'fake_desktop'
+            persister.used_programs = ['fake']
+            persister.launch_project()
+        spans = {span.name: span for span in TRACER.spans}
+        self.assertEqual(spans['FakeProgram.start'].parent.name, 'Persister.launch_project')
+        self.assertIs(spans['FakeDesktop.launch_program'].parent, spans['FakeProgram.start'])
+        self.assertIn('Persister.save', spans)
+
+    def test_profile(self):
+        TRACER.disable()
+        output = io.StringIO()
+        with mock.patch('builtins.input', return_value='n'), redirect_stdout(output), \
+                mock.patch.object(persist, 'get_daemon_client', return_value=None):
+            persist.parse_args(['--profile', '--list-open'])
+        self.assertIn('total(s)', output.getvalue())
+        self.assertFalse(TRACER.enabled)
@@ -0,0 +1,64 @@
+import time
+from unittest import mock
+
+from persistd.desktops.virtual_desktop import VirtualDesktop
+from persistd.desktops.window_probe import FakeWindowProbe, wait_until
+from tests.base_test import BaseTest
+
+
+class WindowProbeTest(BaseTest):
+    def test_wait_until(self):
+        self.assertTrue(wait_until(lambda: True, timeout=0))
+        start = time.monotonic()
+        self.assertFalse(wait_until(lambda: False, timeout=0.1))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_wait_for_window(self):
+        probe = FakeWindowProbe()
+        probe.add_window(42, latency=0.2)
+        self.assertFalse(probe.window_exists(42))
+
+        start = time.monotonic()
+        self.assertTrue(probe.wait_for_window(42, timeout=2))
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.15)
+        self.assertLess(elapsed, 1)
+
+        # A window that never appears
+        self.assertFalse(probe.wait_for_window(43, timeout=0.1))
+
+    def test_wait_for_new_window(self):
+        probe = FakeWindowProbe()
+        probe.add_window(1)
+        known = probe.list_windows()
+        self.assertFalse(probe.wait_for_new_window(known, timeout=0.1))
+        probe.add_window(2, latency=0.1)
+        self.assertTrue(probe.wait_for_new_window(known, timeout=2))
+
+    def test_wait_for_new_window_of_class(self):
+        probe = FakeWindowProbe()
+        known = probe.list_windows()
+        # e.g. a dialog of another program
+        probe.add_window(1, window_class='#32770')
+        self.assertFalse(probe.wait_for_new_window(known, timeout=0.1, window_class='Chrome_WidgetWin_1'))
+        hwnd = probe.add_window(2, latency=0.1, window_class='Chrome_WidgetWin_1')
+        self.assertTrue(probe.wait_for_new_window(known, timeout=2, window_class='Chrome_WidgetWin_1'))
+        self.assertEqual(probe.window_class(hwnd), 'Chrome_WidgetWin_1')
+
+    def test_move_program_waits_for_window(self):
+        probe = FakeWindowProbe()
+        desktop = VirtualDesktop('a', 'a', 'a')
+        desktop.window_probe = probe
+        desktop.virtual_desktop_id = 2
+        probe.add_window(42, latency=0.2)
+
+        moves = []
+
+        def run(command, **kwargs):
+            moves.append(probe.window_exists(42))
+            return 2, '', 0
+
+        with mock.patch('persistd.desktops.virtual_desktop.run_on_command_line', side_effect=run):
+            self.assertEqual(desktop.move_program(42, timeout=2), 42)
+        # moved exactly once, after the window appeared
+        self.assertListEqual(moves, [True])